@@ -0,0 +1,348 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+from trueskill import Rating
+import db_extract
+from db_extract import GameArrays, init_db, process_game_arrays, process_game_data, get_playoff_game_arrays_range, get_season_end_rosters, regular_season_games_query, stream_game_blocks
+from ts_ratings import weighted_update, batch_weighted_update, schedule_batches
+from rating_store import RatingStore
+from rate_games import generate_ts_ratings, generate_ts_ratings_pregame, compute_team_rating, compute_team_ratings, batch_team_rows
+from merge_features import extract_features
+from synthetic_league import build_synthetic_db
+
+# Benchmarks for the pipeline's hot paths, on a synthetic league (see synthetic_league.py) so they run anywhere and
+# always see the same data.  Micro benchmarks time one piece on one season (or the playoff chain), end to end ones time
+# extract_features over the whole league.
+# Every benchmark reports its best time over the repeats, throughput (games/sec, or teams/sec for the team ratings) and
+# peak memory (tracemalloc peak of one extra run, so the timed runs aren't slowed down by it).  Results are compared to
+# a stored baseline: slower or bigger than the baseline by more than the tolerance is a regression, and the script
+# exits with 1.  Baselines are per machine- save one with --save-baseline before a change, run again after.
+
+BENCHMARKS = dict()
+
+# registers a benchmark.  The decorated setup(data) returns (run, items): run() does the work once, items is how many
+# games (or whatever unit is) one run gets through.  None skips it (e.g. no xgboost for the compiled model ones)
+def benchmark(name, kind="micro", unit="games"):
+    def register(setup):
+        BENCHMARKS[name] = (setup, kind, unit)
+        return setup
+    return register
+
+# what the micro benchmarks work on: the last regular season (rows, arrays, rosters, a store rated on it) and the
+# whole playoff chain
+class BenchmarkData:
+    def __init__(self, season_range, playoff_rating_prefix):
+        self.season_range = season_range
+        self.playoff_rating_prefix = playoff_rating_prefix
+        last_season = season_range[1]
+        self.rs_rows = db_extract.cursor.execute(regular_season_games_query((last_season, last_season))).fetchall()
+        self.rs_games = process_game_arrays(self.rs_rows)
+        self.rs_store = generate_ts_ratings(self.rs_games)
+        self.rosters = get_season_end_rosters(last_season)
+        self.po_games = GameArrays.concat(list(get_playoff_game_arrays_range(season_range).values()))
+
+    def __repr__(self):
+        return f"BenchmarkData(Seasons: {self.season_range}, RS games: {len(self.rs_games)}, PO games: {len(self.po_games)})"
+
+# the per game reference update (trueskill.rate on two pseudo players), what everything batched is checked against
+@benchmark("weighted_update")
+def bench_weighted_update(data, n_games=200):
+    games = data.rs_games.slice_games(0, n_games).games()
+
+    def run():
+        ratings = dict()
+        for game in games:
+            home = [ratings.get(player.player_id, Rating()) for player in game.home_team.players]
+            away = [ratings.get(player.player_id, Rating()) for player in game.away_team.players]
+            home, away = weighted_update(home, away, [player.minutes for player in game.home_team.players],
+                                         [player.minutes for player in game.away_team.players], 1 if game.home_win else 2)
+            for player, rating in zip(game.home_team.players + game.away_team.players, home + away):
+                ratings[player.player_id] = rating
+    return run, len(games)
+
+@benchmark("batch_weighted_update")
+def bench_batch_weighted_update(data):
+    games = data.rs_games
+    store = RatingStore()
+    slots = store.slots_for(games.players)[games.player_index]
+    batches = list(schedule_batches(slots, games.game_offsets, len(store)))
+
+    def run():
+        mu, sigma = store.mu.copy(), store.sigma.copy()
+        for batch in batches:
+            batch_weighted_update(mu, sigma, slots, games.minutes, games.game_offsets, games.home_splits, games.home_win, batch)
+    return run, len(games)
+
+@benchmark("generate_ts_ratings")
+def bench_generate_ts_ratings(data):
+    return lambda: generate_ts_ratings(data.rs_games), len(data.rs_games)
+
+@benchmark("generate_ts_ratings_pregame")
+def bench_generate_ts_ratings_pregame(data):
+    return lambda: generate_ts_ratings_pregame(data.po_games), len(data.po_games)
+
+# one team at a time, every season end roster 20 times over
+@benchmark("compute_team_rating", unit="teams")
+def bench_compute_team_rating(data, n_repeats=20):
+    def run():
+        for _ in range(n_repeats):
+            for team in data.rosters:
+                compute_team_rating(data.rs_store, team)
+    return run, n_repeats * len(data.rosters)
+
+# the service/bracket pattern: rate a game, then look up every roster again (mostly cache hits + a few delta updates)
+@benchmark("compute_team_rating_live", unit="teams")
+def bench_compute_team_rating_live(data, n_games=100):
+    games = [data.rs_games.slice_games(i, i + 1) for i in range(min(n_games, len(data.rs_games)))]
+
+    def run():
+        store = RatingStore()
+        for game in games:
+            generate_ts_ratings(game, store)
+            for team in data.rosters:
+                compute_team_rating(store, team)
+    return run, len(games) * len(data.rosters)
+
+# both teams of every game of the season, a schedule batch at a time (the pregame lookup without the updates)
+@benchmark("compute_team_ratings")
+def bench_compute_team_ratings(data):
+    games = data.rs_games
+    slots = data.rs_store.slots_for(games.players)[games.player_index]
+    batches = list(schedule_batches(slots, games.game_offsets, len(data.rs_store)))
+
+    def run():
+        for batch in batches:
+            rows, team_seg = batch_team_rows(games, batch)
+            compute_team_ratings(data.rs_store, slots[rows], team_seg, 2 * len(batch))
+    return run, len(games)
+
+# a notebook sized XGBClassifier (300 trees, depth 7) on random feature rows + the CompiledModel of it, built once.
+# None without xgboost
+def benchmark_tree_model(data, n_rows=20000, seed=0):
+    if not hasattr(data, "tree_model"):
+        try:
+            from xgboost import XGBClassifier
+        except ImportError:
+            data.tree_model = None
+            return None
+        import pandas as pd
+        from compiled_model import compile_xgboost
+        from simulate_bracket import FEATURE_COLUMNS
+
+        rng = np.random.default_rng(seed)
+        X = pd.DataFrame(rng.normal(20, 5, size=(n_rows, len(FEATURE_COLUMNS))), columns=FEATURE_COLUMNS)
+        y = (X["team_a_po_rating"] - X["team_b_po_rating"] + X["team_a_rs_rating"] - X["team_b_rs_rating"] + rng.normal(0, 5, n_rows) > 0).astype(int)
+        model = XGBClassifier(n_estimators=300, max_depth=7, eval_metric="logloss").fit(X, y)
+        data.tree_model = model, compile_xgboost(model), X
+    return data.tree_model
+
+# scoring a big frame: the compiled model (hands it to the native booster, see compiled_model.py), the same compiled
+# model kept on its numpy path, and the XGBClassifier it replaces
+def tree_model_batch(data, scorer, n_rows=100000):
+    tree_model = benchmark_tree_model(data)
+    if tree_model is None:
+        return None
+    model, compiled_model, X = tree_model
+    batch = X.sample(n_rows, replace=True, random_state=0).reset_index(drop=True)
+    if scorer == "numpy":
+        from compiled_model import CompiledModel
+        compiled_model = CompiledModel(compiled_model.kind, compiled_model.feature_names_in_, compiled_model.arrays)
+        compiled_model.native_min_rows = None
+    scorer_model = model if scorer == "xgboost" else compiled_model
+    return lambda: scorer_model.predict_proba(batch), n_rows
+
+@benchmark("compiled_model_batch", unit="rows")
+def bench_compiled_model_batch(data):
+    return tree_model_batch(data, "compiled")
+
+@benchmark("compiled_model_batch_numpy", unit="rows")
+def bench_compiled_model_batch_numpy(data):
+    return tree_model_batch(data, "numpy")
+
+@benchmark("xgboost_batch", unit="rows")
+def bench_xgboost_batch(data):
+    return tree_model_batch(data, "xgboost")
+
+# a service sized batch, always the numpy path
+@benchmark("compiled_model_small", unit="rows")
+def bench_compiled_model_small(data):
+    return tree_model_batch(data, "compiled", n_rows=64)
+
+@benchmark("process_game_data")
+def bench_process_game_data(data):
+    return lambda: process_game_data(data.rs_rows), len(data.rs_games)
+
+@benchmark("process_game_arrays")
+def bench_process_game_arrays(data):
+    return lambda: process_game_arrays(data.rs_rows), len(data.rs_games)
+
+# db read + game assembly for every regular season game in the league
+@benchmark("stream_game_blocks")
+def bench_stream_game_blocks(data):
+    query = regular_season_games_query(data.season_range)
+    n_games = db_extract.cursor.execute(f"SELECT COUNT(DISTINCT gameId) FROM ({query})").fetchone()[0]
+
+    def run():
+        for _ in stream_game_blocks(query):
+            pass
+    return run, n_games
+
+def extract_features_games(data):
+    start_season, end_season = data.season_range
+    rated_start = start_season + data.playoff_rating_prefix
+    return db_extract.cursor.execute(f"""
+    SELECT COUNT(*) FROM games WHERE (gameType = 'Regular Season' AND season_start_year BETWEEN {rated_start} AND {end_season})
+    OR (gameType = 'Playoffs' AND season_start_year BETWEEN {start_season} AND {end_season})
+    """).fetchone()[0]
+
+# the whole feature build, from the first season after the playoff prefix, into a throwaway output dir
+def extract_features_run(data, **extract_args):
+    start_season, end_season = data.season_range
+
+    def run():
+        with tempfile.TemporaryDirectory() as output_dir:
+            extract_features((start_season + data.playoff_rating_prefix, end_season), data.playoff_rating_prefix, output_dir + "/", **extract_args)
+    return run, extract_features_games(data)
+
+@benchmark("extract_features", kind="end_to_end")
+def bench_extract_features(data):
+    return extract_features_run(data)
+
+@benchmark("extract_features_stream", kind="end_to_end")
+def bench_extract_features_stream(data):
+    return extract_features_run(data, stream_chunk_rows=db_extract.stream_chunk_rows)
+
+# seconds per run (best of repeats) + tracemalloc peak of one more run.  Like timeit's autorange, every timed repeat
+# calls run enough times to take at least min_seconds, so short benchmarks aren't all timer noise.  Pipeline prints are
+# swallowed
+def measure(run, repeats, min_seconds=0.2):
+    with contextlib.redirect_stdout(io.StringIO()):
+        number = 1
+        if min_seconds:
+            start = time.perf_counter()
+            run()
+            number = max(1, int(np.ceil(min_seconds / max(time.perf_counter() - start, 1e-9))))
+
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for _ in range(number):
+                run()
+            times.append((time.perf_counter() - start) / number)
+
+        tracemalloc.start()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return min(times), peak
+
+def run_benchmarks(data, names, repeats=5):
+    results = dict()
+    for name in names:
+        setup, kind, unit = BENCHMARKS[name]
+        print(f"{name}... ", end="", flush=True)
+        setup_result = setup(data)
+        if setup_result is None:
+            print("skipped (missing optional dependency)")
+            continue
+        run, items = setup_result
+        seconds, peak = measure(run, repeats if kind == "micro" else 1, 0.2 if kind == "micro" else 0)
+        results[name] = {"kind": kind, "unit": unit, "items": items, "seconds": seconds, "items_per_sec": items / seconds, "peak_mb": peak / 1024 ** 2}
+        print(f"{seconds:.4f}s, {items / seconds:,.0f} {unit}/sec, peak {peak / 1024 ** 2:.1f} MB")
+    return results
+
+# name -> list of regressions ("time", "memory") past tolerance.  Memory gets memory_slack_mb on top, a few hundred
+# kB either way on a tiny peak isn't a regression
+def find_regressions(results, baseline, tolerance=0.2, memory_slack_mb=1.0):
+    regressions = dict()
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        slower = result["seconds"] > baseline[name]["seconds"] * (1 + tolerance)
+        bigger = result["peak_mb"] > baseline[name]["peak_mb"] * (1 + tolerance) + memory_slack_mb
+        if slower or bigger:
+            regressions[name] = (["time"] if slower else []) + (["memory"] if bigger else [])
+    return regressions
+
+def print_comparison(results, baseline, regressions):
+    print(f"{'benchmark':<28}{'seconds':>10}{'baseline':>10}{'ratio':>8}{'peak MB':>10}{'baseline':>10}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<28}{result['seconds']:>10.4f}{'-':>10}{'-':>8}{result['peak_mb']:>10.1f}{'-':>10}")
+            continue
+        flag = "  REGRESSION (" + ", ".join(regressions[name]) + ")" if name in regressions else ""
+        print(f"{name:<28}{result['seconds']:>10.4f}{base['seconds']:>10.4f}{result['seconds'] / base['seconds']:>8.2f}"
+              f"{result['peak_mb']:>10.1f}{base['peak_mb']:>10.1f}{flag}")
+
+# the synthetic db for a season range + seed, built once and reused
+def synthetic_db(benchmark_dir, season_range, seed):
+    db_path = Path(benchmark_dir) / f"synthetic_{season_range[0]}_{season_range[1]}_seed{seed}.db"
+    if not db_path.exists():
+        print("Building synthetic league db", db_path, "... ", end="", flush=True)
+        build_synthetic_db(db_path, season_range, seed)
+        print("done")
+    return db_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the rating + feature pipeline on a synthetic league.")
+    parser.add_argument("--seasons", type=int, default=20, help="Number of synthetic seasons, ending with --end-season.")
+    parser.add_argument("--end-season", type=int, default=2024, help="Last synthetic season start year.")
+    parser.add_argument("--seed", type=int, default=0, help="Synthetic league seed.")
+    parser.add_argument("--prefix", type=int, default=5, help="Playoff rating prefix seasons for extract_features.")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed repeats per micro benchmark (best one counts), end to end ones run once.")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Only run these benchmarks.")
+    parser.add_argument("--kind", choices=["micro", "end_to_end"], help="Only run one kind of benchmark.")
+    parser.add_argument("--dir", default="output/benchmarks/", help="Folder for the synthetic dbs, baseline and results.")
+    parser.add_argument("--baseline", default=None, help="Baseline json to compare to (default <dir>/baseline.json).")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative slowdown/memory growth that counts as a regression.")
+    args = parser.parse_args()
+
+    season_range = (args.end_season - args.seasons + 1, args.end_season)
+    db_extract.db_path = str(synthetic_db(args.dir, season_range, args.seed))
+    init_db()
+
+    names = [name for name, (_, kind, _) in BENCHMARKS.items() if (args.only is None or name in args.only) and (args.kind is None or kind == args.kind)]
+    print("Loading benchmark data... ", end="", flush=True)
+    data = BenchmarkData(season_range, args.prefix)
+    print(data)
+    results = run_benchmarks(data, names, args.repeats)
+
+    report = {
+        "league": {"season_range": list(season_range), "seed": args.seed, "prefix": args.prefix},
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "numpy": np.__version__},
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "benchmarks": results,
+    }
+    benchmark_dir = Path(args.dir)
+    (benchmark_dir / "latest.json").write_text(json.dumps(report, indent=2))
+
+    baseline_path = Path(args.baseline) if args.baseline else benchmark_dir / "baseline.json"
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else None
+    if baseline is not None and baseline["league"] != report["league"]:
+        print("Baseline", baseline_path, "is for a different league", baseline["league"], "- not comparing")
+        baseline = None
+
+    regressions = dict()
+    if baseline is not None:
+        print("Compared to baseline", baseline_path, "from", baseline["created"])
+        regressions = find_regressions(results, baseline["benchmarks"], args.tolerance)
+        print_comparison(results, baseline["benchmarks"], regressions)
+        if regressions:
+            print(len(regressions), "regression(s):", ", ".join(regressions))
+
+    if args.save_baseline:
+        # keep the baseline entries of benchmarks that weren't run this time
+        kept = baseline["benchmarks"] if baseline is not None else dict()
+        baseline_path.write_text(json.dumps({**report, "benchmarks": {**kept, **results}}, indent=2))
+        print("Saved baseline", baseline_path)
+    elif regressions:
+        raise SystemExit(1)
@@ -0,0 +1,320 @@
+import argparse
+import json
+import sys
+import numpy as np
+
+# Trained models compiled down to flat numpy arrays in one small .npz (no pickles), plus a scorer that only needs
+# numpy- no xgboost/sklearn import at load time, and a whole batch is scored with a handful of array ops.
+#
+#   - "tree_ensemble" (XGBClassifier): every tree laid out as a complete binary tree of the ensemble's max depth
+#     (node i's children are 2i + 1 and 2i + 2), so all (row, tree) pairs step down one level per iteration with no
+#     child lookups.  A leaf above the bottom level becomes a pass-through: every bottom leaf under it has its value.
+#     Splits compare float32 values like xgboost does (x < threshold goes left, missing goes the default way).
+#     The numpy walk wins on cold start + small batches (the simulator, the service), but it's gather bound: past a
+#     few thousand rows it's ~4x slower than xgboost's own predict.  So the .npz also keeps the booster's raw model,
+#     and batches of at least native_min_rows go to xgboost when it can be imported- from NATIVE_MIN_ROWS once
+#     xgboost is loaded in the process, from NATIVE_COLD_MIN_ROWS when it would have to be imported first (~1.2s,
+#     which that many rows of numpy scoring cost).  Without xgboost every batch stays on the numpy path
+#   - "quadratic" (sklearn logreg Pipeline: ColumnTransformer/StandardScaler -> PolynomialFeatures(degree<=2) ->
+#     LogisticRegression): scaling, polynomial expansion and coefficients folded into one quadratic form on the raw
+#     features, logit = bias + x.w + x.Q.x (x centered on the scaler means)
+#
+# Both give team a's win probability through the sigmoid of the margin, with predict_proba like the originals.
+
+COMPILED_MODEL_VERSION = 1
+MAX_TREE_DEPTH = 16 # complete trees double per level
+TREE_BLOCK_SIZE = 1 << 20 # (row, tree) pairs per traversal block, bounds the scratch memory
+# measured on a 300 tree, depth 7 model (benchmark.py compiled_model_batch*/xgboost_batch): native predict is 3-5x
+# faster from ~1k rows with xgboost loaded, and the import pays for itself from ~50k rows.  Models compiled before the
+# booster was saved always use numpy
+NATIVE_MIN_ROWS = 1024
+NATIVE_COLD_MIN_ROWS = 65536
+
+def _sigmoid(margin):
+    return 1 / (1 + np.exp(-margin))
+
+class CompiledModel:
+    def __init__(self, kind, feature_names, arrays):
+        self.kind = kind
+        self.feature_names_in_ = np.array(feature_names, dtype=object)
+        self.arrays = arrays
+        # set to None to always score with numpy
+        self.native_min_rows = NATIVE_MIN_ROWS
+        self._booster = None
+
+    def __repr__(self):
+        if self.kind == "tree_ensemble":
+            return f"CompiledModel(tree_ensemble, Trees: {len(self.arrays['split_feature'])}, Depth: {int(self.arrays['depth'])}, Features: {len(self.feature_names_in_)})"
+        return f"CompiledModel({self.kind}, Features: {len(self.feature_names_in_)})"
+
+    # X: a DataFrame or dict of columns (only the model's features are read), or an array already in feature order
+    def _matrix(self, X, dtype):
+        if isinstance(X, np.ndarray):
+            return np.asarray(X, dtype=dtype).reshape(-1, len(self.feature_names_in_))
+        return np.column_stack([np.asarray(X[name], dtype=dtype) for name in self.feature_names_in_])
+
+    def decision_function(self, X):
+        if self.kind == "tree_ensemble":
+            X = self._matrix(X, np.float32)
+            booster = self._native_booster(len(X))
+            if booster is not None:
+                n_trees = len(self.arrays["split_feature"])
+                return booster.inplace_predict(X, iteration_range=(0, n_trees), predict_type="margin").astype(np.float64)
+            return self._tree_margin(X)
+        X = self._matrix(X, np.float64) - self.arrays["center"]
+        return self.arrays["bias"] + X @ self.arrays["linear"] + np.einsum("ij,jk,ik->i", X, self.arrays["quadratic"], X)
+
+    def predict_proba(self, X):
+        proba = _sigmoid(self.decision_function(X))
+        return np.column_stack([1 - proba, proba])
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] > 0.5).astype(np.int64)
+
+    # the xgboost booster for a batch of n_rows, or None to score it with numpy (small batch, no booster saved, or no
+    # xgboost).  Only imports xgboost for a batch big enough to be worth it
+    def _native_booster(self, n_rows):
+        if self.native_min_rows is None or n_rows < self.native_min_rows or "booster" not in self.arrays:
+            return None
+        if self._booster is None:
+            if n_rows < max(self.native_min_rows, NATIVE_COLD_MIN_ROWS) and "xgboost" not in sys.modules:
+                return None
+            try:
+                import xgboost as xgb
+            except ImportError:
+                self._booster = False
+                return None
+            self._booster = xgb.Booster()
+            self._booster.load_model(bytearray(self.arrays["booster"].tobytes()))
+        return self._booster or None
+
+    # every (row, tree) pair walks down one level per step, as a flat index into the (n_trees, n_internal) node
+    # tables: tree offset + heap position
+    def _tree_margin(self, X):
+        n_trees, n_internal = self.arrays["split_feature"].shape
+        depth = int(self.arrays["depth"])
+        split_feature = self.arrays["split_feature"].ravel()
+        threshold = self.arrays["threshold"].ravel()
+        default_left = self.arrays["default_left"].ravel()
+        leaf_value = self.arrays["leaf_value"].ravel()
+        tree_offsets = np.arange(n_trees, dtype=np.int64) * n_internal
+        # bottom level position -> leaf_value index
+        leaf_offsets = np.arange(n_trees, dtype=np.int64) * (n_internal + 1) - n_internal
+        has_missing = bool(np.isnan(X).any())
+
+        margin = np.full(len(X), float(self.arrays["base_margin"]))
+        block_rows = max(1, TREE_BLOCK_SIZE // max(n_trees, 1))
+        for start in range(0, len(X), block_rows):
+            X_block = np.ascontiguousarray(X[start:start + block_rows])
+            row_offsets = (np.arange(len(X_block), dtype=np.int64) * X.shape[1])[:, None]
+            flat = np.repeat(tree_offsets[None, :], len(X_block), axis=0)
+            for _ in range(depth):
+                values = X_block.ravel()[row_offsets + split_feature[flat]]
+                go_right = ~(values < threshold[flat])
+                if has_missing:
+                    missing = np.isnan(values)
+                    go_right[missing] = ~default_left[flat[missing]]
+                # heap position p -> 2p + 1 (left) / 2p + 2 (right), keeping the tree offset
+                flat = 2 * flat - tree_offsets + 1 + go_right
+            margin[start:start + block_rows] += leaf_value[flat - tree_offsets + leaf_offsets].sum(axis=1, dtype=np.float64)
+        return margin
+
+    def save(self, path):
+        meta = {"version": COMPILED_MODEL_VERSION, "kind": self.kind, "feature_names": list(self.feature_names_in_)}
+        np.savez_compressed(path, meta=np.array(json.dumps(meta)), **self.arrays)
+
+def load_compiled_model(path):
+    with np.load(path, allow_pickle=False) as compiled:
+        meta = json.loads(str(compiled["meta"]))
+        if meta["version"] != COMPILED_MODEL_VERSION:
+            raise ValueError(f"Compiled model version {meta['version']} (expected {COMPILED_MODEL_VERSION}): {path}")
+        arrays = {name: compiled[name] for name in compiled.files if name != "meta"}
+    return CompiledModel(meta["kind"], meta["feature_names"], arrays)
+
+# XGBClassifier -> tree_ensemble.  Only binary:logistic with numeric splits, and the trees predict_proba would use
+def compile_xgboost(model):
+    booster = model.get_booster()
+    config = json.loads(booster.save_config())
+    if config["learner"]["objective"]["name"] != "binary:logistic":
+        raise ValueError(f"Can only compile binary:logistic models, got {config['learner']['objective']['name']}")
+    base_score = float(config["learner"]["learner_model_param"]["base_score"].strip("[]"))
+
+    feature_names = list(model.feature_names_in_) if hasattr(model, "feature_names_in_") else list(booster.feature_names or [])
+    if not feature_names:
+        raise ValueError("Model was fit without feature names- fit it on a DataFrame")
+
+    trees = json.loads(booster.save_raw("json"))["learner"]["gradient_booster"]["model"]["trees"]
+    try:
+        trees = trees[:model.best_iteration + 1] # early stopping: predict_proba stops at the best iteration
+    except AttributeError:
+        pass
+    if any(any(split_type != 0 for split_type in tree.get("split_type", [])) for tree in trees):
+        raise ValueError("Categorical splits aren't supported")
+
+    def tree_depth(tree):
+        stack, max_depth = [(0, 0)], 0
+        while stack:
+            node, level = stack.pop()
+            max_depth = max(max_depth, level)
+            if tree["left_children"][node] != -1:
+                stack += [(tree["left_children"][node], level + 1), (tree["right_children"][node], level + 1)]
+        return max_depth
+
+    depth = max([tree_depth(tree) for tree in trees] + [1])
+    if depth > MAX_TREE_DEPTH:
+        raise ValueError(f"Trees are {depth} deep, at most {MAX_TREE_DEPTH} can be compiled")
+    n_internal = 2 ** depth - 1
+
+    split_feature = np.zeros((len(trees), n_internal), dtype=np.int32)
+    threshold = np.full((len(trees), n_internal), np.inf, dtype=np.float32)
+    default_left = np.ones((len(trees), n_internal), dtype=bool)
+    leaf_value = np.zeros((len(trees), n_internal + 1), dtype=np.float32)
+    for tree_index, tree in enumerate(trees):
+        stack = [(0, 0, 0)] # (xgboost node, heap position, level)
+        while stack:
+            node, position, level = stack.pop()
+            left, right = tree["left_children"][node], tree["right_children"][node]
+            if left == -1:
+                # leaf values live in split_conditions.  Fill every bottom leaf under this position
+                first_leaf = (position + 1) * 2 ** (depth - level) - 1 - n_internal
+                leaf_value[tree_index, first_leaf:first_leaf + 2 ** (depth - level)] = tree["split_conditions"][node]
+                continue
+            split_feature[tree_index, position] = tree["split_indices"][node]
+            threshold[tree_index, position] = tree["split_conditions"][node]
+            default_left[tree_index, position] = bool(tree["default_left"][node])
+            stack.append((left, 2 * position + 1, level + 1))
+            stack.append((right, 2 * position + 2, level + 1))
+
+    base_margin = np.log(base_score / (1 - base_score))
+    arrays = {"split_feature": split_feature, "threshold": threshold, "default_left": default_left, "leaf_value": leaf_value,
+              "depth": np.array(depth), "base_margin": np.array(base_margin),
+              # raw (ubj) model for big batches, see _native_booster
+              "booster": np.frombuffer(booster.save_raw("ubj"), dtype=np.uint8)}
+    return CompiledModel("tree_ensemble", feature_names, arrays)
+
+# affine map of a preprocessing step: (A, d) maps the raw features onto the step's input (z = A x + d), returns the
+# map onto its output
+def _affine_step(step, A, d, input_names):
+    from sklearn.compose import ColumnTransformer
+    from sklearn.preprocessing import StandardScaler, FunctionTransformer
+
+    # fitted ColumnTransformers hold "passthrough" as an identity FunctionTransformer
+    if isinstance(step, FunctionTransformer) and step.func is None:
+        return A, d
+    if isinstance(step, StandardScaler):
+        mean = step.mean_ if step.mean_ is not None else np.zeros(len(d))
+        scale = step.scale_ if step.scale_ is not None else np.ones(len(d))
+        return A / scale[:, None], (d - mean) / scale
+    if isinstance(step, ColumnTransformer):
+        blocks = []
+        for name, transformer, columns in step.transformers_:
+            if isinstance(transformer, str) and transformer == "drop":
+                continue
+            columns = [input_names.index(column) if isinstance(column, str) else int(column) for column in np.atleast_1d(columns)]
+            if len(columns) == 0:
+                continue
+            block_A, block_d = A[columns], d[columns]
+            if not (isinstance(transformer, str) and transformer == "passthrough"):
+                block_A, block_d = _affine_step(transformer, block_A, block_d, [input_names[column] for column in columns])
+            blocks.append((block_A, block_d))
+        return np.vstack([block_A for block_A, _ in blocks]), np.concatenate([block_d for _, block_d in blocks])
+    raise ValueError(f"Can't compile preprocessing step {type(step).__name__}")
+
+# logreg (optionally a Pipeline of affine preprocessing -> PolynomialFeatures -> LogisticRegression) -> quadratic
+def compile_logreg(model):
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import PolynomialFeatures
+    from sklearn.linear_model import LogisticRegression
+
+    steps = [step for _, step in model.steps] if isinstance(model, Pipeline) else [model]
+    classifier = steps[-1]
+    if not isinstance(classifier, LogisticRegression) or classifier.coef_.shape[0] != 1:
+        raise ValueError("Can only compile a binary LogisticRegression")
+
+    input_names = [str(name) for name in getattr(model, "feature_names_in_", [])]
+    if not input_names:
+        raise ValueError("Model was fit without feature names- fit it on a DataFrame")
+    A, d = np.eye(len(input_names)), np.zeros(len(input_names))
+    powers = None
+    for step in steps[:-1]:
+        if powers is not None:
+            raise ValueError("PolynomialFeatures has to be the last step before the classifier")
+        if isinstance(step, PolynomialFeatures):
+            powers = step.powers_
+            if powers.sum(axis=1).max() > 2:
+                raise ValueError("Only polynomial features up to degree 2 can be compiled")
+        else:
+            A, d = _affine_step(step, A, d, input_names)
+    if powers is None:
+        powers = np.eye(len(d), dtype=np.int64)
+
+    # expand around a center where the scaled features are ~0 (their means) instead of x = 0, so the folded terms
+    # don't cancel out in floating point
+    center = np.zeros(len(input_names))
+    for row, offset in zip(A, d):
+        if np.count_nonzero(row) == 1:
+            center[np.flatnonzero(row)[0]] = -offset / row[np.flatnonzero(row)[0]]
+    d = d + A @ center
+
+    # every polynomial term of z = A (x - center) + d as bias/linear/quadratic terms of x - center
+    bias, linear, quadratic = float(classifier.intercept_[0]), np.zeros(len(input_names)), np.zeros((len(input_names), len(input_names)))
+    for coef, term_powers in zip(classifier.coef_[0], powers):
+        factors = np.repeat(np.arange(len(term_powers)), term_powers)
+        if len(factors) == 0:
+            bias += coef
+        elif len(factors) == 1:
+            i = factors[0]
+            bias += coef * d[i]
+            linear += coef * A[i]
+        else:
+            i, j = factors
+            bias += coef * d[i] * d[j]
+            linear += coef * (d[j] * A[i] + d[i] * A[j])
+            quadratic += coef * np.outer(A[i], A[j])
+
+    # only the raw features that end up mattering (e.g. season_start_year goes through the pipeline unused)
+    used = np.flatnonzero((linear != 0) | (quadratic != 0).any(axis=0) | (quadratic != 0).any(axis=1))
+    arrays = {"center": center[used], "bias": np.array(bias), "linear": linear[used], "quadratic": quadratic[np.ix_(used, used)]}
+    return CompiledModel("quadratic", [input_names[i] for i in used], arrays)
+
+def compile_model(model):
+    from xgboost import XGBClassifier
+    if isinstance(model, XGBClassifier):
+        return compile_xgboost(model)
+    return compile_logreg(model)
+
+# compiles a saved (joblib) model to output_path, and checks it against the original on the feature store rows
+def export_compiled_model(model_path, output_path, feature_output_dir="output/"):
+    import joblib
+    model = joblib.load(model_path)
+    compiled_model = compile_model(model)
+    compiled_model.save(output_path)
+    print("Compiled", model_path, "->", output_path, compiled_model)
+
+    try:
+        from feature_store import load_features
+        features_df = load_features(output_dir=feature_output_dir, dropna=True)
+    except (OSError, FileNotFoundError):
+        print("No feature store to check the compiled model against")
+        return compiled_model
+
+    # the numpy path- big batches would otherwise go to the booster and check it against itself
+    columns = list(model.feature_names_in_)
+    expected = model.predict_proba(features_df[columns].astype(np.float64))[:, 1]
+    loaded_model = load_compiled_model(output_path)
+    loaded_model.native_min_rows = None
+    actual = loaded_model.predict_proba(features_df)[:, 1]
+    max_diff = float(np.max(np.abs(expected - actual))) if len(expected) else 0.0
+    print("Checked on", len(expected), "feature store rows, max probability difference:", max_diff)
+    if max_diff > 1e-5:
+        raise ValueError(f"Compiled model doesn't match {model_path} (max difference {max_diff})")
+    return compiled_model
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile a saved model into a dependency free numpy scorer.")
+    parser.add_argument("model", help="Saved (joblib) model, e.g. output/boosted_tree.pkl.")
+    parser.add_argument("output", nargs="?", default=None, help="Output .npz path (default: next to the model).")
+    parser.add_argument("--features", default="output/", help="Output folder with the feature store to check against.")
+    args = parser.parse_args()
+
+    export_compiled_model(args.model, args.output or args.model.rsplit(".", 1)[0] + ".npz", args.features)
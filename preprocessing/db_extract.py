@@ -1,8 +1,12 @@
 import kagglehub
 from datetime import datetime
+import queue
 import sqlite3
+import threading
+import numpy as np
 import pandas as pd
 from pathlib import Path
+from profiling import profiled, profiled_cursor
 
 class Player:
     def __init__(self, player_id, first_name, last_name, minutes):
@@ -39,134 +43,643 @@ class Game:
         return f"Game(ID: {self.game_id}, Date: {self.date}, Home: {self.home_team.team_name}, Away: {self.away_team.team_name})"
 
 
+# Columnar (CSR style) view of a list of games, in chronological order.  Game i owns player rows
+# game_offsets[i]:game_offsets[i + 1], home players first, away players starting at home_splits[i].
+# Players are stored once in `players` (person ids) and rows point at them through `player_index`,
+# so the rating code can map a whole block onto rating store slots in one go.
+# The Player/Team/Game objects are still available through game()/games() as a thin view over the arrays.
+class GameArrays:
+    def __init__(self, game_ids, date_strings, home_win, home_team_names, away_team_names, game_offsets, home_splits,
+                 players, player_index, minutes, first_names, last_names, season_start_years=None):
+        self.game_ids = game_ids
+        self.date_strings = date_strings
+        self.dates = np.array([date[:10] for date in date_strings], dtype="datetime64[D]").astype(np.int32) # epoch day
+        self.home_win = home_win
+        self.home_team_names = home_team_names
+        self.away_team_names = away_team_names
+        self.game_offsets = game_offsets
+        self.home_splits = home_splits
+        self.players = players
+        self.player_index = player_index
+        self.minutes = minutes
+        self.first_names = first_names
+        self.last_names = last_names
+        self.season_start_years = season_start_years # per game, only set by the range queries
+
+    def __len__(self):
+        return len(self.game_ids)
+
+    def __repr__(self):
+        return f"GameArrays(Games: {len(self)}, Player rows: {len(self.minutes)}, Players: {len(self.players)})"
+
+    def _make_team(self, team_name, start, end):
+        team = Team(team_name)
+        for row in range(start, end):
+            player = self.player_index[row]
+            team.add_player(Player(self.players[player], self.first_names[player], self.last_names[player], self.minutes[row]))
+        return team
+
+    def game(self, i):
+        game = Game(self.game_ids[i], datetime.strptime(self.date_strings[i], "%Y-%m-%d %H:%M:%S"), bool(self.home_win[i]))
+        game.home_team = self._make_team(self.home_team_names[i], self.game_offsets[i], self.home_splits[i])
+        game.away_team = self._make_team(self.away_team_names[i], self.home_splits[i], self.game_offsets[i + 1])
+        return game
+
+    # Game objects one at a time, built as they're asked for
+    def iter_games(self):
+        for i in range(len(self)):
+            yield self.game(i)
+
+    def games(self):
+        return list(self.iter_games())
+
+    # games start:end as their own block, players re-indexed so the block only carries who actually played
+    def slice_games(self, start, end):
+        row_start, row_end = self.game_offsets[start], self.game_offsets[end]
+        players, first_idx, player_index = np.unique(self.player_index[row_start:row_end], return_index=True, return_inverse=True)
+        return GameArrays(
+            self.game_ids[start:end],
+            self.date_strings[start:end],
+            self.home_win[start:end],
+            self.home_team_names[start:end],
+            self.away_team_names[start:end],
+            self.game_offsets[start:end + 1] - row_start,
+            self.home_splits[start:end] - row_start,
+            self.players[players],
+            player_index.astype(np.int64),
+            self.minutes[row_start:row_end],
+            self.first_names[players],
+            self.last_names[players],
+            None if self.season_start_years is None else self.season_start_years[start:end],
+        )
+
+    # partition a multi-season block (games ordered by season) into season -> GameArrays
+    def split_seasons(self):
+        if len(self) == 0:
+            return dict()
+        bounds = np.flatnonzero(np.r_[True, self.season_start_years[1:] != self.season_start_years[:-1], True])
+        return {int(self.season_start_years[start]): self.slice_games(start, end) for start, end in zip(bounds[:-1], bounds[1:])}
+
+    # build from the old object representation, for callers that still hand us Game lists
+    @classmethod
+    def from_games(cls, games_list):
+        rows = []
+        for game in games_list:
+            for player in game.home_team.players:
+                rows.append((player.first_name, player.last_name, player.player_id, game.game_id,
+                             game.date.strftime("%Y-%m-%d %H:%M:%S"), game.home_team.team_name, 1, player.minutes,
+                             1 if game.home_win else 0, 0))
+            for player in game.away_team.players:
+                rows.append((player.first_name, player.last_name, player.player_id, game.game_id,
+                             game.date.strftime("%Y-%m-%d %H:%M:%S"), game.away_team.team_name, 0, player.minutes,
+                             1 if game.home_win else 0, 0))
+        return process_game_arrays(rows)
+
+    # chain several blocks (e.g. playoff prefix seasons) into one, in the order given
+    @classmethod
+    def concat(cls, blocks):
+        blocks = [block for block in blocks if len(block)]
+        if not blocks:
+            return process_game_arrays([])
+
+        row_offsets = np.cumsum([0] + [len(block.minutes) for block in blocks])
+        all_players = np.concatenate([block.players for block in blocks])
+        players, first_idx, inverse = np.unique(all_players, return_index=True, return_inverse=True)
+        player_offsets = np.cumsum([0] + [len(block.players) for block in blocks])
+
+        return cls(
+            np.concatenate([block.game_ids for block in blocks]),
+            np.concatenate([block.date_strings for block in blocks]),
+            np.concatenate([block.home_win for block in blocks]),
+            np.concatenate([block.home_team_names for block in blocks]),
+            np.concatenate([block.away_team_names for block in blocks]),
+            np.concatenate([block.game_offsets[:-1] + row_offsets[i] for i, block in enumerate(blocks)] + [row_offsets[-1:]]),
+            np.concatenate([block.home_splits + row_offsets[i] for i, block in enumerate(blocks)]),
+            players,
+            np.concatenate([inverse[block.player_index + player_offsets[i]] for i, block in enumerate(blocks)]),
+            np.concatenate([block.minutes for block in blocks]),
+            np.concatenate([block.first_names for block in blocks])[first_idx],
+            np.concatenate([block.last_names for block in blocks])[first_idx],
+            None if any(block.season_start_years is None for block in blocks) else np.concatenate([block.season_start_years for block in blocks]),
+        )
+
+
 db_path, connection, cursor = "output/nba_data.db", None, None
 
-def init_db():
+# read_only: open the db read only and skip the index layer check- for worker processes that only extract, each with
+# its own connection (the main process prepares the db before starting them)
+def init_db(read_only=False):
     global connection, cursor
 
     # Initialize SQLite database
+    if read_only:
+        connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        cursor = profiled_cursor(connection.cursor())
+        return
     connection = sqlite3.connect(db_path)
-    cursor = connection.cursor()
+    cursor = profiled_cursor(connection.cursor())
+
+    # older dbs were built without the index layer- add it once, it's a no-op afterwards
+    if not db_is_prepared(connection):
+        prepare_db(connection)
+
+# Index + derived data layer on top of the raw kaggle tables, so every extractor below is an index search instead of
+# a full scan:
+# - games.season_start_year: playoffs count for the year before, everything else by the Sep - May window it falls in
+# - season_end_rosters: last team per player for each season (Jan - May of Y + 1), materialized once instead of running
+#   a ROW_NUMBER window over all of PlayerStatistics on every call
+# - indexes on gameId, gameDate, gameType, personId, covering the game/player join
+SEASON_START_YEAR_SQL = """
+    CASE WHEN gameType = 'Playoffs' OR substr(gameDate, 6) < '09-01' THEN CAST(strftime('%Y', gameDate) AS INTEGER) - 1
+         ELSE CAST(strftime('%Y', gameDate) AS INTEGER) END
+"""
+
+DB_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_games_type_season ON games (gameType, season_start_year, gameDate, gameId)",
+    "CREATE INDEX IF NOT EXISTS idx_games_game_id ON games (gameId)",
+    "CREATE INDEX IF NOT EXISTS idx_games_game_date ON games (gameDate)",
+    "CREATE INDEX IF NOT EXISTS idx_player_stats_game ON PlayerStatistics (gameId, numMinutes, home, personId, playerteamName, firstName, lastName)",
+    "CREATE INDEX IF NOT EXISTS idx_player_stats_person_date ON PlayerStatistics (personId, gameDate)",
+    "CREATE INDEX IF NOT EXISTS idx_player_stats_game_date ON PlayerStatistics (gameDate)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_season_end_rosters ON season_end_rosters (season_start_year, personId)",
+]
+
+def db_is_prepared(conn):
+    games_columns = [column[1] for column in conn.execute("PRAGMA table_info(games)")]
+    if not games_columns:
+        # nothing loaded yet
+        return True
+    has_rosters = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'season_end_rosters'").fetchone()
+    return "season_start_year" in games_columns and has_rosters is not None
+
+# season_start_years=None rebuilds every season, otherwise only the given ones (used by incremental loads)
+def refresh_season_end_rosters(conn, season_start_years=None):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS season_end_rosters (
+        season_start_year INTEGER, personId INTEGER, firstName TEXT, lastName TEXT, playerteamName TEXT
+    )""")
+
+    season_filter = ""
+    if season_start_years is not None:
+        season_start_years = sorted(set(int(season_year) for season_year in season_start_years))
+        if not season_start_years:
+            return
+        season_filter = "AND (" + " OR ".join(
+            f"p.gameDate BETWEEN '{season_year + 1}-01-01' AND '{season_year + 1}-05-31'" for season_year in season_start_years) + ")"
+        conn.execute(f"DELETE FROM season_end_rosters WHERE season_start_year IN ({', '.join(str(season_year) for season_year in season_start_years)})")
+    else:
+        conn.execute("DELETE FROM season_end_rosters")
+
+    conn.execute(f"""
+    INSERT INTO season_end_rosters (season_start_year, personId, firstName, lastName, playerteamName)
+    SELECT season_start_year, id, fname, lname, team
+    FROM (
+        SELECT p.firstName fname, p.lastName lname, p.personId id, p.playerteamName team,
+               CAST(strftime('%Y', p.gameDate) AS INTEGER) - 1 AS season_start_year,
+               ROW_NUMBER() OVER (PARTITION BY strftime('%Y', p.gameDate), p.personId ORDER BY p.gameDate DESC) as row_num
+        FROM PlayerStatistics p
+        WHERE substr(p.gameDate, 6) <= '05-31' {season_filter}
+    ) subquery
+    WHERE row_num = 1
+    """)
+
+def prepare_db(conn):
+    games_columns = [column[1] for column in conn.execute("PRAGMA table_info(games)")]
+    if "season_start_year" not in games_columns:
+        conn.execute("ALTER TABLE games ADD COLUMN season_start_year INTEGER")
+    conn.execute(f"UPDATE games SET season_start_year = {SEASON_START_YEAR_SQL} WHERE season_start_year IS NULL")
 
-def update_db_source():
+    refresh_season_end_rosters(conn)
+
+    for index_sql in DB_INDEXES:
+        conn.execute(index_sql)
+    conn.execute("ANALYZE")
+    conn.commit()
+
+ingest_chunk_size = 100000
+
+def update_db_source(incremental=False, chunk_size=ingest_chunk_size):
     # Download latest version
     csv_path = kagglehub.dataset_download("eoinamoore/historical-nba-data-and-player-box-scores")
 
-    # Connect to or create SQLite database
-    conn = sqlite3.connect(db_path)
-
     # Path to folder with CSV files
     csv_folder = Path(csv_path)
 
-    # Load each CSV into its own table
+    if incremental and Path(db_path).exists():
+        # autocommit mode, ingest_incremental handles the transaction itself
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        ingest_incremental(conn, csv_folder, chunk_size)
+        conn.close()
+        init_db()
+        return
+
+    # Connect to or create SQLite database
+    conn = sqlite3.connect(db_path)
+
+    # Load each CSV into its own table, a chunk at a time so we never hold a whole file in memory
     for file in csv_folder.glob("*.csv"):
-        df = pd.read_csv(file)
         table_name = file.stem
-        df.to_sql(table_name, conn, if_exists="replace", index=False)
+        for i, chunk in enumerate(pd.read_csv(file, chunksize=chunk_size)):
+            chunk.to_sql(table_name, conn, if_exists="replace" if i == 0 else "append", index=False)
 
+    prepare_db(conn)
+    for file in csv_folder.glob("*.csv"):
+        record_high_water_mark(conn, file.stem)
+    conn.commit()
     conn.close()
 
     init_db()
 
+# Incremental ingest: per table high-water mark (max gameDate + the gameIds stored on that date) in ingest_state.
+# Rows past the mark get appended, everything else in the csv is skipped- existing rows + indexes are left alone.
+# Tables without gameDate/gameId (players, team histories...) are small, those get their contents swapped.
+# Late corrections to rows before the mark are not picked up- do a full --update-db for that.
+def read_high_water_mark(conn, table_name):
+    conn.execute("CREATE TABLE IF NOT EXISTS ingest_state (table_name TEXT PRIMARY KEY, max_game_date TEXT, max_game_id INTEGER, updated_at TEXT)")
+    state = conn.execute("SELECT max_game_date FROM ingest_state WHERE table_name = ?", (table_name,)).fetchone()
+    max_game_date = state[0] if state else conn.execute(f'SELECT MAX(gameDate) FROM "{table_name}"').fetchone()[0]
+    if max_game_date is None:
+        return None, set()
+
+    game_ids = conn.execute(f'SELECT DISTINCT gameId FROM "{table_name}" WHERE gameDate = ?', (max_game_date,)).fetchall()
+    return max_game_date, set(game_id for game_id, in game_ids)
+
+def record_high_water_mark(conn, table_name):
+    conn.execute("CREATE TABLE IF NOT EXISTS ingest_state (table_name TEXT PRIMARY KEY, max_game_date TEXT, max_game_id INTEGER, updated_at TEXT)")
+    columns = [column[1] for column in conn.execute(f'PRAGMA table_info("{table_name}")')]
+    if "gameDate" not in columns or "gameId" not in columns:
+        return
+
+    max_game_date = conn.execute(f'SELECT MAX(gameDate) FROM "{table_name}"').fetchone()[0]
+    max_game_id = conn.execute(f'SELECT MAX(gameId) FROM "{table_name}" WHERE gameDate = ?', (max_game_date,)).fetchone()[0]
+    conn.execute("INSERT OR REPLACE INTO ingest_state VALUES (?, ?, ?, ?)",
+                 (table_name, max_game_date, max_game_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+def ingest_incremental(conn, csv_folder, chunk_size=ingest_chunk_size):
+    new_rows = dict()
+    new_game_dates = set()
+
+    conn.execute("BEGIN")
+    try:
+        for file in csv_folder.glob("*.csv"):
+            table_name = file.stem
+            table_exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone() is not None
+            new_rows[table_name] = 0
+
+            for i, chunk in enumerate(pd.read_csv(file, chunksize=chunk_size)):
+                incremental_table = "gameDate" in chunk.columns and "gameId" in chunk.columns
+
+                if i == 0:
+                    if not table_exists:
+                        conn.execute(pd.io.sql.get_schema(chunk, table_name))
+                        max_game_date, max_date_game_ids = None, set()
+                    elif incremental_table:
+                        max_game_date, max_date_game_ids = read_high_water_mark(conn, table_name)
+                    else:
+                        conn.execute(f'DELETE FROM "{table_name}"')
+
+                # only rows past the high-water mark
+                if incremental_table and max_game_date is not None:
+                    game_dates = chunk["gameDate"].astype(str)
+                    past_mark = (game_dates > max_game_date) | ((game_dates == max_game_date) & ~chunk["gameId"].isin(max_date_game_ids))
+                    chunk = chunk[past_mark]
+                if len(chunk) == 0:
+                    continue
+
+                if incremental_table:
+                    new_game_dates.update(chunk["gameDate"].astype(str).unique())
+
+                columns = ", ".join(f'"{column}"' for column in chunk.columns)
+                placeholders = ", ".join("?" for _ in chunk.columns)
+                values = chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+                conn.executemany(f'INSERT INTO "{table_name}" ({columns}) VALUES ({placeholders})', values)
+                new_rows[table_name] += len(chunk)
+
+            if new_rows[table_name]:
+                record_high_water_mark(conn, table_name)
+
+        # derived data for the new rows only- indexes are maintained by sqlite as rows go in
+        if db_is_prepared(conn) and new_game_dates:
+            min_new_date = min(new_game_dates)
+            conn.execute(f"UPDATE games SET season_start_year = {SEASON_START_YEAR_SQL} WHERE gameDate >= ? AND season_start_year IS NULL", (min_new_date,))
+            refresh_season_end_rosters(conn, [int(game_date[:4]) - 1 for game_date in new_game_dates if game_date[5:] <= "05-31"])
+
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+    # first load into an empty db- build the whole index layer
+    if not db_is_prepared(conn):
+        prepare_db(conn)
+
+    for table_name, count in new_rows.items():
+        print(f"{table_name}: {count} new rows")
+    return new_rows
+
+# same row layout as the game queries below: firstName, lastName, personId, gameId, gameDate, playerTeamName, home,
+# numMinutes, homeScore, awayScore, and optionally season_start_year.  Rows must be grouped by game (the queries order by date + id)
+@profiled("process_game_arrays")
+def process_game_arrays(row_list):
+    if not row_list:
+        empty_str = np.array([], dtype=object)
+        return GameArrays(np.array([], dtype=np.int64), empty_str, np.array([], dtype=bool), empty_str, empty_str,
+                          np.zeros(1, dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.int64),
+                          np.array([], dtype=np.int64), np.array([], dtype=np.float64), empty_str, empty_str)
+
+    columns = list(zip(*row_list))
+    first_names, last_names, person_ids, game_ids, game_dates, team_names, home, minutes, home_scores, away_scores = columns[:10]
+    game_ids = np.array(game_ids)
+    home = np.array(home, dtype=np.int8)
+
+    # game boundaries, then home rows first within each game
+    game_starts = np.flatnonzero(np.r_[True, game_ids[1:] != game_ids[:-1]])
+    row_game = np.cumsum(np.r_[True, game_ids[1:] != game_ids[:-1]]) - 1
+    order = np.lexsort((1 - home, row_game))
+    home = home[order]
+
+    game_offsets = np.append(game_starts, len(row_list)).astype(np.int64)
+    home_splits = game_offsets[:-1] + np.bincount(row_game, home, minlength=len(game_starts)).astype(np.int64)
+
+    person_ids = np.array(person_ids, dtype=np.int64)[order]
+    players, first_idx, player_index = np.unique(person_ids, return_index=True, return_inverse=True)
+    team_names = np.array(team_names, dtype=object)[order]
+    # a team with no rows would leave the split at the game boundary- just don't index past the end
+    home_rows, away_rows = game_offsets[:-1], np.minimum(home_splits, len(row_list) - 1)
+
+    return GameArrays(
+        game_ids[game_starts].astype(np.int64),
+        np.array(game_dates, dtype=object)[game_starts],
+        np.array(home_scores)[game_starts] > np.array(away_scores)[game_starts],
+        team_names[home_rows],
+        team_names[away_rows],
+        game_offsets,
+        home_splits,
+        players,
+        player_index.astype(np.int64),
+        np.array(minutes, dtype=np.float64)[order],
+        np.array(first_names, dtype=object)[order][first_idx],
+        np.array(last_names, dtype=object)[order][first_idx],
+        np.array(columns[10], dtype=np.int32)[game_starts] if len(columns) > 10 else None,
+    )
+
+@profiled("process_game_data")
 def process_game_data(row_list):
-    games = []
-    game = None
-    for row in row_list:
-        if not game or game.game_id != row[3]:
-            if game:
-                games.append(game)
-            game = Game(row[3], datetime.strptime(row[4], "%Y-%m-%d %H:%M:%S"), row[8] > row[9])
-        
-        if row[6] == 1:
-            if(game.home_team is None):
-                game.home_team = Team(row[5])
-            game.home_team.add_player(Player(row[2], row[0], row[1], row[7]))
-        else:
-            if(game.away_team is None):
-                game.away_team = Team(row[5])
-            game.away_team.add_player(Player(row[2], row[0], row[1], row[7]))
-        
-    if game:
-        games.append(game)
-    return games
+    return process_game_arrays(row_list).games()
 
-def get_playoff_games(season_start_year):
-    # Use SQL functions to extract the year from the gameDate field
-    # Get playoff games for a specific year
-    query = f"""
-    SELECT p.firstName, p.lastName, p.personId, p.gameId, p.gameDate, p.playerTeamName, p.home, p.numMinutes, g.homeScore, g.awayScore
-    FROM games g LEFT JOIN PlayerStatistics p ON g.gameId = p.gameId 
-    WHERE strftime('%Y', g.gameDate) = '{season_start_year + 1}' AND g.gameType = 'Playoffs'
+# Range extractors: one query over the whole season span, season read from games.season_start_year (see prepare_db),
+# partitioned in memory afterwards.  The single season functions just call these with a one season range.
+# Query text comes from the *_query builders so explain_queries.py can check the plans.
+
+GAME_ROW_COLUMNS = "p.firstName, p.lastName, p.personId, g.gameId, g.gameDate, p.playerTeamName, p.home, p.numMinutes, g.homeScore, g.awayScore, g.season_start_year"
+
+# after=(gameDate, gameId) only returns games past that game in (gameDate, gameId) order- used to resume from a checkpoint
+def after_game_filter(after):
+    if after is None:
+        return ""
+    game_date, game_id = after
+    return f"AND (g.gameDate > '{game_date}' OR (g.gameDate = '{game_date}' AND g.gameId > {int(game_id)}))"
+
+# playoffs for season Y are the playoff games played in calendar year Y + 1
+def playoff_games_query(season_start_year_range, after=None):
+    start_season_year, end_season_year = season_start_year_range
+    return f"""
+    SELECT {GAME_ROW_COLUMNS}
+    FROM games g JOIN PlayerStatistics p ON g.gameId = p.gameId 
+    WHERE g.gameType = 'Playoffs' AND g.season_start_year BETWEEN {start_season_year} AND {end_season_year}
+    {after_game_filter(after)}
     AND p.numMinutes IS NOT NULL AND p.numMinutes > 0
     ORDER BY g.gameDate, g.gameId, p.home ASC
     """
-    
-    cursor.execute(query)
-    return process_game_data(cursor.fetchall())
+
+def get_playoff_game_arrays_range(season_start_year_range, after=None):
+    cursor.execute(playoff_games_query(season_start_year_range, after))
+    return process_game_arrays(cursor.fetchall()).split_seasons()
+
+def get_playoff_game_arrays(season_start_year):
+    return get_playoff_game_arrays_range((season_start_year, season_start_year)).get(season_start_year, process_game_arrays([]))
+
+def get_playoff_games(season_start_year):
+    return get_playoff_game_arrays(season_start_year).games()
     
 
-def get_regular_season_games(season_start_year):
-    # Get regular season games from September of the start year to May of the next year
-    query = f"""
-    SELECT p.firstName, p.lastName, p.personId, p.gameId, p.gameDate, p.playerTeamName, p.home, p.numMinutes, g.homeScore, g.awayScore
-    FROM games g LEFT JOIN PlayerStatistics p ON g.gameId = p.gameId 
-    WHERE g.gameDate BETWEEN '{season_start_year}-09-01' AND '{int(season_start_year) + 1}-05-31' 
-    AND g.gameType = 'Regular Season'
+# regular season for season Y is September of Y to May of Y + 1- games outside every window (summer) are dropped,
+# same as the old per season BETWEEN on gameDate
+def regular_season_games_query(season_start_year_range, after=None):
+    start_season_year, end_season_year = season_start_year_range
+    return f"""
+    SELECT {GAME_ROW_COLUMNS}
+    FROM games g JOIN PlayerStatistics p ON g.gameId = p.gameId 
+    WHERE g.gameType = 'Regular Season' AND g.season_start_year BETWEEN {start_season_year} AND {end_season_year}
+    AND (substr(g.gameDate, 6) >= '09-01' OR substr(g.gameDate, 6) <= '05-31')
+    {after_game_filter(after)}
     AND p.numMinutes IS NOT NULL AND p.numMinutes > 0
     ORDER BY g.gameDate, g.gameId, p.home ASC
     """
-    
-    cursor.execute(query)
-    return process_game_data(cursor.fetchall())
+
+def get_regular_season_game_arrays_range(season_start_year_range, after=None):
+    cursor.execute(regular_season_games_query(season_start_year_range, after))
+    return process_game_arrays(cursor.fetchall()).split_seasons()
+
+def get_regular_season_game_arrays(season_start_year):
+    return get_regular_season_game_arrays_range((season_start_year, season_start_year)).get(season_start_year, process_game_arrays([]))
+
+def get_regular_season_games(season_start_year):
+    return get_regular_season_game_arrays(season_start_year).games()
+
+# Streaming extractors: the same game queries, read fetchmany chunks at a time and handed out as
+# (season_start_year, GameArrays) blocks of whole games that never cross a season.  The caller only ever holds the
+# block it's rating (+ the chunk being read), so memory doesn't grow with the number of seasons replayed.
+# A season usually comes in several blocks- rate them in order into the same store, same result as one big block.
+stream_chunk_rows = 20000
+
+# blocks of a game query (see *_games_query) in query order.  A game's rows can straddle two chunks, so the last game
+# of every chunk is held back and goes out with the next one.  conn: connection to read on (default the module one)
+def stream_game_blocks(query, chunk_rows=stream_chunk_rows, conn=None):
+    stream_cursor = profiled_cursor((conn or connection).cursor())
+    stream_cursor.execute(query)
+    pending = []
+    try:
+        while True:
+            chunk = stream_cursor.fetchmany(chunk_rows)
+            if not chunk:
+                break
+            rows = pending + chunk
+            cut = len(rows)
+            while cut and rows[cut - 1][3] == rows[-1][3]:
+                cut -= 1
+            pending = rows[cut:]
+            if cut:
+                yield from process_game_arrays(rows[:cut]).split_seasons().items()
+        if pending:
+            yield from process_game_arrays(pending).split_seasons().items()
+    finally:
+        stream_cursor.close()
+
+# stream_game_blocks on a background thread with its own read only connection, at most max_pending blocks ahead of
+# whoever is consuming them- rating on this thread overlaps with sqlite reading + assembling the next blocks (sqlite
+# lets go of the GIL while it steps the query).  Errors on the reader come back out of the generator, and dropping
+# the generator early stops the reader
+def prefetch_game_blocks(query, chunk_rows=stream_chunk_rows, max_pending=4):
+    pending = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        reader_connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            for block in stream_game_blocks(query, chunk_rows, reader_connection):
+                if not put(block):
+                    return
+            put(done)
+        except Exception as e:
+            put(e)
+        finally:
+            reader_connection.close()
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = pending.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        reader.join()
+
+# groups a block stream by season: (season_year, generator over that season's blocks) for every season in
+# season_years, in order- seasons without games get an empty one.  Blocks for seasons not in season_years are skipped.
+# A season's blocks have to be used before moving on to the next season (whatever is left gets skipped)
+def blocks_by_season(blocks, season_years):
+    blocks = iter(blocks)
+    next_block = next(blocks, None)
+
+    def season_blocks(season_year):
+        nonlocal next_block
+        while next_block is not None and next_block[0] <= season_year:
+            block = next_block
+            next_block = next(blocks, None)
+            if block[0] == season_year:
+                yield block[1]
+
+    for season_year in season_years:
+        group = season_blocks(season_year)
+        yield season_year, group
+        for _ in group:
+            pass
+
+# Game objects straight off a block stream, for code that still works game by game
+def stream_games(blocks):
+    for _, block in blocks:
+        yield from block.iter_games()
 
 # this is not foolproof, but it is good enough for this project- theoretically misses players with looooong injuries that come back late in the playoffs
 # also misses players that stay on the roster but don't play the whole end of the season... which is fine, since we don't care about anyone who plays zero
 # playoff mins anyway.  In any case, the dataset doesn't have structure for this so we're doing it this way
-def get_season_end_rosters(season_start_year):
-    # Get all players and their teams
-    query = f"""
-    SELECT fname, lname, id, team
-    FROM (
-        SELECT p.firstName fname, p.lastName lname, p.personId id, p.playerTeamName team, 
-               ROW_NUMBER() OVER (PARTITION BY p.personId ORDER BY p.gameDate DESC) as row_num
-        FROM PlayerStatistics p
-        where p.gameDate BETWEEN '{int(season_start_year) + 1}-01-01' AND '{int(season_start_year) + 1}-05-31'
-    ) subquery
-    WHERE row_num = 1
+# (last team per player in January - May of Y + 1, materialized in season_end_rosters by prepare_db)
+def season_end_rosters_query(season_start_year_range):
+    start_season_year, end_season_year = season_start_year_range
+    return f"""
+    SELECT firstName, lastName, personId, playerteamName, season_start_year
+    FROM season_end_rosters
+    WHERE season_start_year BETWEEN {start_season_year} AND {end_season_year}
+    ORDER BY season_start_year, personId
     """
-    cursor.execute(query)
 
-    teams_dict = dict()
+def get_season_end_rosters_range(season_start_year_range):
+    start_season_year, end_season_year = season_start_year_range
+    cursor.execute(season_end_rosters_query(season_start_year_range))
+
+    season_teams = {season_year: dict() for season_year in range(start_season_year, end_season_year + 1)}
     for player in cursor.fetchall():
+        teams_dict = season_teams[player[4]]
         if player[3] not in teams_dict:
             teams_dict[player[3]] = Team(player[3])
 
         teams_dict[player[3]].add_player(Player(player[2], player[0], player[1], 0))
 
-    return [team for _, team in teams_dict.items()]
+    return {season_year: [team for _, team in teams_dict.items()] for season_year, teams_dict in season_teams.items()}
 
-def get_playoff_game_metadata(season_start_year):
-    # Get playoff game metadata
+# how many games of a type exist up to and including a given game, used to check a checkpoint still lines up with the db
+def count_games_through(game_type, start_season_year, game_tag):
     query = f"""
+    SELECT COUNT(*) FROM games g
+    WHERE g.gameType = '{game_type}' AND g.season_start_year BETWEEN {start_season_year} AND {game_tag["season_start_year"]}
+    AND (g.gameDate < '{game_tag["game_date"]}' OR (g.gameDate = '{game_tag["game_date"]}' AND g.gameId <= {int(game_tag["game_id"])}))
+    """
+    cursor.execute(query)
+    return cursor.fetchone()[0]
+
+# per season summary of the db content a stage reads, for the stage cache (see stage_cache.py): the season's games
+# (count, last game, id + score sums), their player rows (count, minutes + person id sums) and, for the regular season,
+# the season end rosters.  Any appended, dropped or corrected game/box score in a season changes its fingerprint
+def season_fingerprints(game_type, season_start_year_range):
+    start_season_year, end_season_year = season_start_year_range
+    fingerprints = {season_year: [] for season_year in range(start_season_year, end_season_year + 1)}
+    queries = [
+        f"""
+        SELECT season_start_year, COUNT(*), MAX(gameDate), MAX(gameId), SUM(gameId), SUM(homeScore), SUM(awayScore), SUM(seriesGameNumber)
+        FROM games WHERE gameType = '{game_type}' AND season_start_year BETWEEN {start_season_year} AND {end_season_year}
+        GROUP BY season_start_year
+        """,
+        f"""
+        SELECT g.season_start_year, COUNT(*), ROUND(SUM(p.numMinutes), 6), SUM(p.personId), SUM(p.home)
+        FROM games g JOIN PlayerStatistics p ON g.gameId = p.gameId
+        WHERE g.gameType = '{game_type}' AND g.season_start_year BETWEEN {start_season_year} AND {end_season_year}
+        GROUP BY g.season_start_year
+        """,
+    ]
+    if game_type == "Regular Season":
+        queries.append(f"""
+        SELECT season_start_year, COUNT(*), SUM(personId) FROM season_end_rosters
+        WHERE season_start_year BETWEEN {start_season_year} AND {end_season_year}
+        GROUP BY season_start_year
+        """)
+
+    for query in queries:
+        season_rows = {row[0]: list(row[1:]) for row in cursor.execute(query).fetchall()}
+        for season_year in fingerprints:
+            fingerprints[season_year].append(season_rows.get(season_year))
+    return fingerprints
+
+def get_season_end_rosters(season_start_year):
+    return get_season_end_rosters_range((season_start_year, season_start_year))[season_start_year]
+
+def playoff_game_metadata_query(season_start_year_range):
+    start_season_year, end_season_year = season_start_year_range
+    return f"""
     WITH fixed_team_pos_games AS (
         SELECT 
-        gameId, gameDate, seriesGameNumber,
+        gameId, gameDate, seriesGameNumber, season_start_year,
         CASE WHEN hometeamName > awayteamName THEN hometeamName ELSE awayteamName END AS team_a_name,
         CASE WHEN hometeamName > awayteamName THEN awayteamName ELSE hometeamName END AS team_b_name,
         CASE WHEN hometeamName > awayteamName THEN 1 ELSE 0 END AS team_a_home,
         CASE WHEN (homeScore > awayScore AND hometeamName > awayteamName) OR (awayScore > homeScore AND hometeamName < awayteamName) THEN 1 ELSE 0 END AS team_a_win
         FROM games
-        WHERE gameType = 'Playoffs' AND strftime('%Y', gameDate) = '{season_start_year + 1}'
+        WHERE gameType = 'Playoffs' AND season_start_year BETWEEN {start_season_year} AND {end_season_year}
     ),
     series_data AS (
         SELECT
-        gameId, gameDate, seriesGameNumber, team_a_name, team_b_name, team_a_home,
+        gameId, gameDate, seriesGameNumber, season_start_year, team_a_name, team_b_name, team_a_home,
         COALESCE(SUM(team_a_win) OVER series, 0) AS team_a_series_wins,
         COALESCE(SUM(CASE WHEN NOT team_a_win THEN 1 ELSE 0 END) OVER series, 0) AS team_b_series_wins,
         team_a_win
         FROM fixed_team_pos_games
         WINDOW series AS (
-            PARTITION BY team_a_name, team_b_name
+            PARTITION BY season_start_year, team_a_name, team_b_name
             ORDER BY seriesGameNumber ASC
             ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
         )
@@ -174,24 +687,24 @@ def get_playoff_game_metadata(season_start_year):
     SELECT
         gameId, gameDate, team_a_name, team_b_name, team_a_home, seriesGameNumber,
         team_a_series_wins, team_b_series_wins, team_a_series_wins - team_b_series_wins AS series_diff,
-        {season_start_year} AS season_start_year,
+        season_start_year,
         team_a_win
-    FROM series_data;
+    FROM series_data
+    ORDER BY season_start_year, team_a_name, team_b_name, seriesGameNumber;
     """
-    
-    cursor.execute(query)
-    return cursor.fetchall()
 
 def get_playoff_game_metadata_range(season_start_year_range):
     start_season_year, end_season_year = season_start_year_range
-    all_games = []
+    print("Processing Season years: ", start_season_year, "-", end_season_year, "... ", end="", flush=True)
 
-    for season_year in range(start_season_year, end_season_year + 1):
-        print("Processing Season year: ", season_year, "... ", end="", flush=True)
-        games = get_playoff_game_metadata(season_year)
-        all_games.extend(games)
-        print("Done")
+    # Get playoff game metadata
+    cursor.execute(playoff_game_metadata_query(season_start_year_range))
+    all_games = cursor.fetchall()
+    print("Done")
     return all_games
+
+def get_playoff_game_metadata(season_start_year):
+    return get_playoff_game_metadata_range((season_start_year, season_start_year))
     
 if __name__ == "__main__":
     init_db()
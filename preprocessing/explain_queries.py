@@ -0,0 +1,65 @@
+import argparse
+import time
+import db_extract
+from db_extract import init_db, playoff_games_query, regular_season_games_query, season_end_rosters_query, playoff_game_metadata_query
+
+# Prints EXPLAIN QUERY PLAN + timings for every extractor query, and flags any step that falls back to a full scan.
+# usage: python preprocessing/explain_queries.py --start 2004 --end 2024
+
+EXTRACTOR_QUERIES = {
+    "playoff_games": playoff_games_query,
+    "regular_season_games": regular_season_games_query,
+    "season_end_rosters": season_end_rosters_query,
+    "playoff_game_metadata": playoff_game_metadata_query,
+}
+
+# a plan step is a full scan if it reads a whole table (or a whole index) instead of searching it.
+# scans of CTE/subquery results are fine, those are already filtered
+def full_scan_steps(plan_rows, table_aliases):
+    scans = []
+    for row in plan_rows:
+        detail = row[-1]
+        if detail.startswith("SCAN "):
+            target = detail.split()[1]
+            if target in table_aliases:
+                scans.append(detail)
+    return scans
+
+def explain_queries(season_start_year_range):
+    cursor = db_extract.cursor
+    table_aliases = {"g", "p", "games", "PlayerStatistics", "season_end_rosters"}
+    full_scans = dict()
+
+    for name, query_builder in EXTRACTOR_QUERIES.items():
+        query = query_builder(season_start_year_range)
+
+        print(f"== {name} {season_start_year_range}")
+        plan_rows = cursor.execute("EXPLAIN QUERY PLAN " + query).fetchall()
+        for row in plan_rows:
+            print("   ", row[-1])
+
+        start = time.perf_counter()
+        rows = cursor.execute(query).fetchall()
+        elapsed = time.perf_counter() - start
+        print(f"    rows: {len(rows)}, time: {elapsed * 1000:.1f} ms")
+
+        scans = full_scan_steps(plan_rows, table_aliases)
+        if scans:
+            full_scans[name] = scans
+            print("    FULL SCAN:", "; ".join(scans))
+
+    return full_scans
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show query plans + timings for the db_extract queries.")
+    parser.add_argument("--start", type=int, default=2004, help="First season start year.")
+    parser.add_argument("--end", type=int, default=2024, help="Last season start year.")
+    args = parser.parse_args()
+
+    init_db()
+    full_scans = explain_queries((args.start, args.end))
+
+    if full_scans:
+        print("Extractors falling back to a full scan:", ", ".join(full_scans))
+        raise SystemExit(1)
+    print("No full scans.")
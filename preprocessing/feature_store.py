@@ -0,0 +1,142 @@
+import shutil
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+# Typed columnar store for the extract_features tables, replacing the csv round trip for anything that reads them back.
+# Each table is an Arrow IPC (feather v2, uncompressed) dataset partitioned by season:
+#   output/feature_store/<table>/season_start_year=<year>/part-0.arrow
+# Uncompressed IPC files are memory mapped and read without decoding, so loading only touches the pages of the
+# columns + seasons that get asked for (parquet would have to decompress/decode every column it reads).
+# Explicit dtypes: int32 ids, float32 ratings, categorical (dictionary) team names, small ints for series state.
+
+SEASON_PARTITIONING = ds.partitioning(pa.schema([("season_start_year", pa.int16())]), flavor="hive")
+
+TEAM_NAME = pa.dictionary(pa.int16(), pa.string())
+
+PLAYOFF_GAME_METADATA_SCHEMA = [
+    ("game_id", pa.int32()),
+    ("game_date", pa.timestamp("s")),
+    ("team_a_name", TEAM_NAME),
+    ("team_b_name", TEAM_NAME),
+    ("team_a_home", pa.int8()),
+    ("series_game_number", pa.float32()),
+    ("team_a_series_wins", pa.int8()),
+    ("team_b_series_wins", pa.int8()),
+    ("series_diff", pa.int8()),
+    ("season_start_year", pa.int16()),
+    ("team_a_win", pa.int8()),
+]
+
+PO_RATING_SCHEMA = [
+    ("team_a_po_rating", pa.float32()),
+    ("team_a_po_rating_var", pa.float32()),
+    ("team_b_po_rating", pa.float32()),
+    ("team_b_po_rating_var", pa.float32()),
+]
+
+RS_RATING_SCHEMA = [
+    ("team_a_rs_rating", pa.float32()),
+    ("team_a_rs_rating_var", pa.float32()),
+    ("team_b_rs_rating", pa.float32()),
+    ("team_b_rs_rating_var", pa.float32()),
+]
+
+# Glicko-2 ratings (extract_features with glicko2_period_days).  Optional- only written when the frame has them, so a
+# TrueSkill only store doesn't get all null columns (which would make dropna loads drop every row)
+PO_GLICKO2_SCHEMA = [
+    ("team_a_po_glicko", pa.float32()),
+    ("team_a_po_glicko_var", pa.float32()),
+    ("team_b_po_glicko", pa.float32()),
+    ("team_b_po_glicko_var", pa.float32()),
+]
+
+RS_GLICKO2_SCHEMA = [
+    ("team_a_rs_glicko", pa.float32()),
+    ("team_a_rs_glicko_var", pa.float32()),
+    ("team_b_rs_glicko", pa.float32()),
+    ("team_b_rs_glicko_var", pa.float32()),
+]
+
+TEAM_GLICKO2_SCHEMA = [("glicko_mean", pa.float32()), ("glicko_var", pa.float32())]
+GLICKO2_DIFF_SCHEMA = [("rs_glicko_diff", pa.float32()), ("po_glicko_diff", pa.float32())]
+
+OPTIONAL_FIELDS = {name for name, _ in PO_GLICKO2_SCHEMA + RS_GLICKO2_SCHEMA + TEAM_GLICKO2_SCHEMA + GLICKO2_DIFF_SCHEMA}
+
+FEATURE_STORE_SCHEMAS = {
+    "playoff_game_metadata": pa.schema(PLAYOFF_GAME_METADATA_SCHEMA),
+    "playoff_pregame_ratings": pa.schema([("season_start_year", pa.int16()), ("game_id", pa.int32()), ("team_a_name", TEAM_NAME),
+                                          ("team_b_name", TEAM_NAME), *PO_RATING_SCHEMA, *PO_GLICKO2_SCHEMA]),
+    "regular_season_ratings": pa.schema([("season_start_year", pa.int16()), ("team_name", TEAM_NAME),
+                                         ("rating_mean", pa.float32()), ("rating_var", pa.float32()), *TEAM_GLICKO2_SCHEMA]),
+    # + the rating diffs the models use, so nobody has to recompute them after loading
+    "playoff_features": pa.schema([*PLAYOFF_GAME_METADATA_SCHEMA, *PO_RATING_SCHEMA, *PO_GLICKO2_SCHEMA, *RS_RATING_SCHEMA, *RS_GLICKO2_SCHEMA,
+                                   ("rs_rating_diff", pa.float32()), ("po_rating_diff", pa.float32()), *GLICKO2_DIFF_SCHEMA]),
+}
+
+def feature_store_dir(output_dir="output/"):
+    return Path(output_dir) / "feature_store"
+
+# df -> arrow table in the table's schema.  Columns the schema derives (the diffs) are computed here from the
+# full precision ratings, before the float32 cast.  Optional fields the df doesn't have are left out
+def to_feature_table(df, table_name):
+    df = df.copy()
+    if table_name == "playoff_features":
+        df["rs_rating_diff"] = df["team_a_rs_rating"] - df["team_b_rs_rating"]
+        df["po_rating_diff"] = df["team_a_po_rating"] - df["team_b_po_rating"]
+        if "team_a_rs_glicko" in df:
+            df["rs_glicko_diff"] = df["team_a_rs_glicko"] - df["team_b_rs_glicko"]
+        if "team_a_po_glicko" in df:
+            df["po_glicko_diff"] = df["team_a_po_glicko"] - df["team_b_po_glicko"]
+    schema = pa.schema([field for field in FEATURE_STORE_SCHEMAS[table_name] if field.name not in OPTIONAL_FIELDS or field.name in df])
+    if "game_date" in df:
+        df["game_date"] = pd.to_datetime(df["game_date"])
+
+    columns = []
+    for field in schema:
+        values = df[field.name]
+        # integer columns from a left merge can come in as float with nulls
+        if pa.types.is_integer(field.type) and values.isna().any():
+            values = values.astype("Int64")
+        columns.append(pa.array(values, type=field.type, from_pandas=True))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+# replaces the table's dataset with df (a narrower run shouldn't leave stale seasons behind)
+def write_feature_table(df, table_name, output_dir="output/"):
+    table_dir = feature_store_dir(output_dir) / table_name
+    if table_dir.exists():
+        shutil.rmtree(table_dir)
+    ds.write_dataset(to_feature_table(df, table_name), table_dir, format="ipc", partitioning=SEASON_PARTITIONING,
+                     basename_template="part-{i}.arrow", preserve_order=True)
+
+def feature_dataset(table_name, output_dir="output/"):
+    return ds.dataset(feature_store_dir(output_dir) / table_name, format="ipc", partitioning=SEASON_PARTITIONING,
+                      filesystem=fs.LocalFileSystem(use_mmap=True))
+
+# reads a table as an arrow table- columns: only these columns, seasons: only these season start years (whole
+# partitions are skipped), dropna: drop rows with a null in any of the loaded columns
+def read_feature_table(table_name="playoff_features", output_dir="output/", columns=None, seasons=None, dropna=False):
+    dataset = feature_dataset(table_name, output_dir)
+    # schema order- the dataset alone would put the partition column last.  Optional fields only if they were written
+    if columns is None:
+        columns = [name for name in FEATURE_STORE_SCHEMAS[table_name].names if name not in OPTIONAL_FIELDS or name in dataset.schema.names]
+    season_filter = ds.field("season_start_year").isin(list(seasons)) if seasons is not None else None
+    table = dataset.to_table(columns=columns, filter=season_filter)
+
+    if dropna and table.num_rows:
+        valid = None
+        for column in table.column_names:
+            column_valid = pc.is_valid(table[column])
+            if pa.types.is_floating(table.schema.field(column).type):
+                column_valid = pc.and_(column_valid, pc.invert(pc.is_nan(table[column])))
+            valid = column_valid if valid is None else pc.and_(valid, column_valid)
+        table = table.filter(valid)
+    return table
+
+# same as read_feature_table, as a DataFrame.  Numeric columns without nulls come out as zero copy views of the
+# mapped files, team names as categoricals
+def load_features(table_name="playoff_features", output_dir="output/", columns=None, seasons=None, dropna=False):
+    return read_feature_table(table_name, output_dir, columns, seasons, dropna).to_pandas(split_blocks=True)
@@ -0,0 +1,119 @@
+import numpy as np
+from ts_ratings import segment_rows
+
+# Glicko-2 (Glickman, "Example of the Glicko-2 system") for the minute-weighted team games we rate with TrueSkill.
+# Same team composite as weighted_update: each team is a pseudo-player with the minute weighted mean of its players'
+# ratings and weighted sum of their variances.  Games are grouped into rating periods (a game day, a week...) and a
+# whole period is one vectorized update: every player active in the period gets the standard Glicko-2 step
+# (v, delta, volatility iteration, new phi/mu) over their games in it, where a game counts with the player's minute
+# share- the derivative of the team rating wrt the player's.  Opponents are the pregame (start of period) composites.
+# A player in a single one-man team is plain Glicko-2.
+
+GLICKO2_SCALE = 173.7178
+GLICKO2_TAU = 0.5 # system constant, constrains the volatility change
+GLICKO2_EPSILON = 0.000001
+
+# games of a date sorted block, grouped into rating periods of period_days days (1 = game day).
+# returns (list of game index arrays, period number of each)
+def rating_periods(dates, period_days=1):
+    periods = np.asarray(dates, dtype=np.int64) // period_days
+    if len(periods) == 0:
+        return [], np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+    return np.split(np.arange(len(periods)), starts[1:]), periods[starts]
+
+def _g(phi):
+    return 1 / np.sqrt(1 + 3 * phi ** 2 / np.pi ** 2)
+
+# step 5 of the paper (Illinois algorithm), for many players at once
+def _new_volatility(phi, sigma, v, delta, tau=GLICKO2_TAU, max_iterations=100):
+    a = np.log(sigma ** 2)
+
+    def f(x):
+        ex = np.exp(x)
+        return ex * (delta ** 2 - phi ** 2 - v - ex) / (2 * (phi ** 2 + v + ex) ** 2) - (x - a) / tau ** 2
+
+    A = a.copy()
+    big_delta = delta ** 2 > phi ** 2 + v
+    B = np.where(big_delta, np.log(np.where(big_delta, delta ** 2 - phi ** 2 - v, 1)), a - tau)
+    need_step = ~big_delta & (f(B) < 0)
+    k = 1
+    while need_step.any() and k < max_iterations:
+        k += 1
+        B = np.where(need_step, a - k * tau, B)
+        need_step &= f(B) < 0
+
+    f_A, f_B = f(A), f(B)
+    for _ in range(max_iterations):
+        open_ = np.abs(B - A) > GLICKO2_EPSILON
+        if not open_.any():
+            break
+        with np.errstate(divide="ignore", invalid="ignore"):
+            C = np.where(open_, A + (A - B) * f_A / (f_B - f_A), B)
+        f_C = f(C)
+        swap = f_C * f_B <= 0
+        A, f_A = np.where(open_ & swap, B, A), np.where(open_, np.where(swap, f_B, f_A / 2), f_A)
+        B, f_B = np.where(open_, C, B), np.where(open_, f_C, f_B)
+
+    return np.exp(A / 2)
+
+# step 6 for players who sat out: rating deviation grows by sigma^2 per idle period (capped at the default), applied
+# lazily when a player shows up again.  players: slots about to play in `period`.  Brings them up to the end of the
+# previous period, so calling it again in the same period is a no-op (pregame snapshots call it before the update)
+def inflate_idle(rating_store, players, period):
+    last_period = rating_store.last_period[players]
+    idle = np.where(last_period >= 0, period - last_period - 1, 0)
+    phi = rating_store.sigma[players] / GLICKO2_SCALE
+    phi = np.sqrt(phi ** 2 + idle * rating_store.volatility[players] ** 2)
+    rating_store.sigma[players] = np.minimum(phi * GLICKO2_SCALE, rating_store.default_sigma)
+    rating_store.last_period[players] = np.where(last_period >= 0, period - 1, last_period)
+
+# one rating period.  slots/minutes/game_offsets/home_splits/home_win are a CSR game block like batch_weighted_update,
+# games the block's games in this period.  Updates rating_store.mu/sigma/volatility/last_period in place
+def glicko2_period_update(rating_store, slots, minutes, game_offsets, home_splits, home_win, games, period, tau=GLICKO2_TAU):
+    n_games = len(games)
+    if n_games == 0:
+        return
+
+    rows = segment_rows(game_offsets, games)
+    row_game = np.repeat(np.arange(n_games), game_offsets[games + 1] - game_offsets[games])
+    team_seg = 2 * row_game + (rows >= home_splits[games][row_game])
+    row_slots = slots[rows]
+
+    players, player_rows = np.unique(row_slots, return_inverse=True)
+    inflate_idle(rating_store, players, period)
+
+    # to the glicko-2 scale
+    mu = (rating_store.mu - rating_store.default_mu) / GLICKO2_SCALE
+    phi = rating_store.sigma / GLICKO2_SCALE
+
+    # minute weighted team composites, same as weighted_update
+    row_mins = np.asarray(minutes, dtype=float)[rows]
+    team_mins = np.bincount(team_seg, row_mins, minlength=2 * n_games)
+    w = row_mins / team_mins[team_seg]
+    team_mu = np.bincount(team_seg, w * mu[row_slots], minlength=2 * n_games)
+    team_phi_sq = np.bincount(team_seg, (w ** 2) * (phi[row_slots] ** 2), minlength=2 * n_games)
+
+    # every row plays its team's game against the other team's composite
+    opponent_seg = team_seg ^ 1
+    g_opponent = _g(np.sqrt(team_phi_sq[opponent_seg]))
+    expected = 1 / (1 + np.exp(-g_opponent * (team_mu[team_seg] - team_mu[opponent_seg])))
+    team_win = np.asarray(home_win, dtype=bool)[games][row_game] == (team_seg % 2 == 0)
+
+    # steps 3 + 4 per player, each game weighted by the player's minute share
+    info = np.bincount(player_rows, (w * g_opponent) ** 2 * expected * (1 - expected), minlength=len(players))
+    score = np.bincount(player_rows, w * g_opponent * (team_win - expected), minlength=len(players))
+    v = 1 / np.maximum(info, 1e-12)
+    delta = v * score
+
+    # steps 5 - 8
+    player_phi = phi[players]
+    new_volatility = _new_volatility(player_phi, rating_store.volatility[players], v, delta, tau)
+    phi_star_sq = player_phi ** 2 + new_volatility ** 2
+    new_phi = 1 / np.sqrt(1 / phi_star_sq + 1 / v)
+    new_mu = mu[players] + new_phi ** 2 * score
+
+    rating_store.mu[players] = new_mu * GLICKO2_SCALE + rating_store.default_mu
+    rating_store.sigma[players] = new_phi * GLICKO2_SCALE
+    rating_store.volatility[players] = new_volatility
+    rating_store.last_period[players] = period
@@ -1,7 +1,13 @@
 import pandas as pd
-from db_extract import get_playoff_game_metadata_range, update_db_source, init_db
-from rate_games import generate_rs_rating_period, generate_po_pregame_ratings
+from db_extract import GameArrays, get_playoff_game_metadata_range, get_playoff_game_arrays_range, season_fingerprints, update_db_source, init_db, stream_chunk_rows
+from rate_games import generate_rs_rating_period, generate_po_pregame_ratings, generate_ts_ratings
+from stage_cache import StageCache, cached_season_stage, cached_chain_stage
+from feature_store import write_feature_table, load_features
+from profiling import profile_stage, start_profiling, stop_profiling, print_report, write_report
 import argparse
+import cProfile
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
 # db extract- playoff game metadata, rate_games- rs_rating_period, po_pregame_ratings
 
@@ -10,54 +16,160 @@ import argparse
 # features: team_a_home, seriesGameNumber, team_a_series_wins, team_b_series_wins, series_diff,
 # home_team_rs_rating, home_team_rs_rating_var, away_team_rs_rating, away_team_rs_rating_var, 
 # home_team_po_rating, home_team_po_rating_var, away_team_po_rating, away_team_po_rating_var
+# with glicko2_period_days also: team_a_po_glicko(_var), team_b_po_glicko(_var), team_a_rs_glicko(_var), team_b_rs_glicko(_var)
+# (the feature store adds rs_glicko_diff + po_glicko_diff next to the rating diffs)
 
 # starting with: 16 seasons of data, 5 year playoff prefix, train/validation split of 8 seasons/2 seasons, rolling window of 1 season, so we can validate 5 different sets
 # test the finished model on the last 2 seasons
 # in total: 21 seasons of playoffs, 16 regular seasons
 
-def extract_features(season_start_year_range = (2009, 2024), playoff_rating_prefix = 5, output_dir="output/"):
-    print("Extracting season start range: ", season_start_year_range, "and playoff rating prefix: ", playoff_rating_prefix)
+PLAYOFF_GAME_METADATA_COLUMNS = ["game_id", "game_date", "team_a_name", "team_b_name", "team_a_home", "series_game_number", "team_a_series_wins", "team_b_series_wins", "series_diff", "season_start_year", "team_a_win"]
 
-    # PO game metadata
-    print("Extracting playoff game metadata...")
-    po_game_metadata_list = get_playoff_game_metadata_range(season_start_year_range)
-    po_game_metadata_df = pd.DataFrame(po_game_metadata_list, columns=["game_id", "game_date", "team_a_name", "team_b_name", "team_a_home", "series_game_number", "team_a_series_wins", "team_b_series_wins", "series_diff", "season_start_year", "team_a_win"])
-    print(po_game_metadata_df.head())
-    po_game_metadata_df.to_csv(output_dir + "playoff_game_metadata.csv", index=False)
+def extract_playoff_game_metadata(season_start_year_range):
+    with profile_stage("playoff_game_metadata"):
+        po_game_metadata_list = get_playoff_game_metadata_range(season_start_year_range)
+        return pd.DataFrame(po_game_metadata_list, columns=PLAYOFF_GAME_METADATA_COLUMNS)
 
-    # PO pregame ratings
-    print("Generating playoff pregame ratings...")
-    po_pregame_df = generate_po_pregame_ratings(season_start_year_range, playoff_rating_prefix)
-    print(po_pregame_df.head())
-    po_pregame_df.to_csv(output_dir + "playoff_pregame_ratings.csv", index=False)
+# worker process setup- every worker gets its own read only connection (sqlite connections can't cross processes)
+def _init_stage_worker():
+    init_db(read_only=True)
+
+# runs the three stages (PO game metadata, PO pregame ratings, RS ratings) and returns their dfs.
+# n_workers > 1 runs them in a process pool: the stages run side by side, and RS seasons (fresh store each) are split
+# into one task per season.  The PO rating chain is sequential, so it stays a single task.  Results are put back
+# together in season order, not completion order, so the output is the same as a serial run.
+# With a checkpoint_dir the RS stage stays one task as well- it resumes from one checkpoint, and everything before
+# the checkpointed season comes out of it anyway
+# stream_chunk_rows: stream the rating stages' games off the db (see stream_game_blocks)
+# glicko2_period_days: also rate both rating stages with Glicko-2 (see generate_po_pregame_ratings)
+def run_feature_stages(season_start_year_range, playoff_rating_prefix, checkpoint_dir=None, n_workers=1, stream_chunk_rows=None, glicko2_period_days=None):
+    po_checkpoint_path = checkpoint_dir + "po_pregame_ratings.npz" if checkpoint_dir else None
+    rs_checkpoint_path = checkpoint_dir + "rs_ratings.npz" if checkpoint_dir else None
+
+    if n_workers <= 1:
+        print("Extracting playoff game metadata...")
+        po_game_metadata_df = extract_playoff_game_metadata(season_start_year_range)
+        print("Generating playoff pregame ratings...")
+        with profile_stage("po_pregame_ratings"):
+            po_pregame_df = generate_po_pregame_ratings(season_start_year_range, playoff_rating_prefix, checkpoint_path=po_checkpoint_path, stream_chunk_rows=stream_chunk_rows,
+                                                        glicko2_period_days=glicko2_period_days)
+        print("Generating regular season ratings...")
+        with profile_stage("rs_ratings"):
+            rs_ratings_df = generate_rs_rating_period(season_start_year_range, checkpoint_path=rs_checkpoint_path, stream_chunk_rows=stream_chunk_rows,
+                                                      glicko2_period_days=glicko2_period_days)
+        return po_game_metadata_df, po_pregame_df, rs_ratings_df
+
+    print("Running playoff game metadata, playoff pregame ratings and regular season ratings on", n_workers, "workers...")
+    start_season, end_season = season_start_year_range
+    with profile_stage("worker_stages"), ProcessPoolExecutor(max_workers=n_workers, initializer=_init_stage_worker) as executor:
+        # longest task first
+        po_pregame_future = executor.submit(generate_po_pregame_ratings, season_start_year_range, playoff_rating_prefix, checkpoint_path=po_checkpoint_path,
+                                            stream_chunk_rows=stream_chunk_rows, glicko2_period_days=glicko2_period_days)
+        if rs_checkpoint_path:
+            rs_ratings_futures = [executor.submit(generate_rs_rating_period, season_start_year_range, checkpoint_path=rs_checkpoint_path, stream_chunk_rows=stream_chunk_rows,
+                                                  glicko2_period_days=glicko2_period_days)]
+        else:
+            rs_ratings_futures = [executor.submit(generate_rs_rating_period, (season_year, season_year), stream_chunk_rows=stream_chunk_rows, glicko2_period_days=glicko2_period_days)
+                                  for season_year in range(start_season, end_season + 1)]
+        po_game_metadata_future = executor.submit(extract_playoff_game_metadata, season_start_year_range)
+
+        po_game_metadata_df = po_game_metadata_future.result()
+        po_pregame_df = po_pregame_future.result()
+        rs_ratings_df = pd.concat([future.result() for future in rs_ratings_futures], ignore_index=True)
 
+    return po_game_metadata_df, po_pregame_df, rs_ratings_df
 
-    # RS ratings
+# same three stages, through the stage cache (see stage_cache.py)- only seasons that are missing from it or whose db
+# content/code changed get computed, everything else is read back
+def run_feature_stages_cached(season_start_year_range, playoff_rating_prefix, cache, stream_chunk_rows=None):
+    start_season, end_season = season_start_year_range
+    chain_start = start_season - playoff_rating_prefix
+    po_fingerprints = season_fingerprints("Playoffs", (chain_start, end_season))
+    rs_fingerprints = season_fingerprints("Regular Season", season_start_year_range)
+
+    # the chain for one season, from the previous season's store (or from the prefix for the first season)
+    def po_pregame_season(season_year, resume_store):
+        if resume_store is None:
+            prefix_games = get_playoff_game_arrays_range((season_year - playoff_rating_prefix, season_year - 1))
+            resume_store = generate_ts_ratings(GameArrays.concat([prefix_games[year] for year in sorted(prefix_games)]))
+        return generate_po_pregame_ratings((season_year, season_year), playoff_rating_prefix, resume_store=resume_store, stream_chunk_rows=stream_chunk_rows), resume_store
+
+    print("Extracting playoff game metadata...")
+    po_game_metadata_df = cached_season_stage(cache, "playoff_game_metadata", dict(), season_start_year_range, po_fingerprints,
+                                              extract_playoff_game_metadata)
+    print("Generating playoff pregame ratings...")
+    with profile_stage("po_pregame_ratings"):
+        po_pregame_df = cached_chain_stage(cache, "po_pregame_ratings", {"start_season": start_season, "prefix_seasons_size": playoff_rating_prefix},
+                                           season_start_year_range, po_fingerprints, chain_start, po_pregame_season)
     print("Generating regular season ratings...")
-    rs_ratings_df = generate_rs_rating_period(season_start_year_range)
-    print(rs_ratings_df.head())
-    rs_ratings_df.to_csv(output_dir + "regular_season_ratings.csv", index=False)
-
-    # Merge PO game metadata with PO pregame ratings
-    print("Merging playoff game metadata with pregame ratings...", end="", flush=True)
-    po_game_metadata_df = po_game_metadata_df.merge(po_pregame_df, left_on=["game_id", "team_a_name", "team_b_name", "season_start_year"], right_on=["game_id", "team_a_name", "team_b_name", "season_start_year"], how="left")
-    print("done")
-    print(po_game_metadata_df.head())
-    
-    print("Merging playoff game metadata with regular season ratings...", end="", flush=True)
-    po_game_metadata_df = po_game_metadata_df.merge(rs_ratings_df, left_on=["team_a_name", "season_start_year"], right_on=["team_name", "season_start_year"], how="left")
-    po_game_metadata_df = po_game_metadata_df.rename(columns={"rating_mean": "team_a_rs_rating", "rating_var": "team_a_rs_rating_var"})
-    po_game_metadata_df = po_game_metadata_df.merge(rs_ratings_df, left_on=["team_b_name", "season_start_year"], right_on=["team_name", "season_start_year"], how="left")
-    po_game_metadata_df = po_game_metadata_df.rename(columns={"rating_mean": "team_b_rs_rating", "rating_var": "team_b_rs_rating_var"})
-    po_game_metadata_df = po_game_metadata_df.drop(columns=["team_name_x", "team_name_y"])
-    print("done")
-    print(po_game_metadata_df.head())
-    po_game_metadata_df.to_csv(output_dir + "playoff_features.csv", index=False)
-
-def load_data(output_dir="output/"):
-    # Load the data from the CSV file
-    features_df = pd.read_csv(output_dir + "playoff_features.csv")
-    return features_df
+    with profile_stage("rs_ratings"):
+        rs_ratings_df = cached_season_stage(cache, "rs_ratings", dict(), season_start_year_range, rs_fingerprints,
+                                            lambda season_range: generate_rs_rating_period(season_range, stream_chunk_rows=stream_chunk_rows))
+
+    print("Stage cache:", cache.hits, "hits,", cache.misses, "misses,", cache.evict(), "evicted")
+    return po_game_metadata_df, po_pregame_df, rs_ratings_df
+
+# checkpoint_dir: optional folder for rating checkpoints- rating state is saved there after each run and the next run
+# only rates games played since (see rating_checkpoint.py)
+# n_workers: number of processes for the stages (see run_feature_stages), 1 runs everything in this process
+# cache_dir: optional stage cache folder, stage results are cached per season there (takes the place of checkpoints
+# + workers, misses are computed in this process)
+# stream_chunk_rows: stream games off the db in chunks of that many rows instead of loading whole season ranges
+# glicko2_period_days: add Glicko-2 features next to the TrueSkill ones (rating periods of that many days, 1 = game
+# day): team_a/b_po_glicko(_var) + team_a/b_rs_glicko(_var).  Rating checkpoints and the stage cache only keep the
+# TrueSkill stores, so it can't go with checkpoint_dir or cache_dir
+def extract_features(season_start_year_range = (2009, 2024), playoff_rating_prefix = 5, output_dir="output/", checkpoint_dir=None, n_workers=1, cache_dir=None,
+                     stream_chunk_rows=None, glicko2_period_days=None):
+    print("Extracting season start range: ", season_start_year_range, "and playoff rating prefix: ", playoff_rating_prefix)
+    if glicko2_period_days and (checkpoint_dir or cache_dir):
+        raise ValueError("glicko2_period_days can't be combined with checkpoint_dir or cache_dir, they only keep the TrueSkill ratings")
+
+    if cache_dir:
+        po_game_metadata_df, po_pregame_df, rs_ratings_df = run_feature_stages_cached(season_start_year_range, playoff_rating_prefix, StageCache(cache_dir), stream_chunk_rows)
+    else:
+        po_game_metadata_df, po_pregame_df, rs_ratings_df = run_feature_stages(season_start_year_range, playoff_rating_prefix, checkpoint_dir, n_workers, stream_chunk_rows,
+                                                                               glicko2_period_days)
+
+    with profile_stage("write_stage_tables"):
+        # PO game metadata
+        print(po_game_metadata_df.head())
+        po_game_metadata_df.to_csv(output_dir + "playoff_game_metadata.csv", index=False)
+        write_feature_table(po_game_metadata_df, "playoff_game_metadata", output_dir)
+
+        # PO pregame ratings
+        print(po_pregame_df.head())
+        po_pregame_df.to_csv(output_dir + "playoff_pregame_ratings.csv", index=False)
+        write_feature_table(po_pregame_df, "playoff_pregame_ratings", output_dir)
+
+        # RS ratings
+        print(rs_ratings_df.head())
+        rs_ratings_df.to_csv(output_dir + "regular_season_ratings.csv", index=False)
+        write_feature_table(rs_ratings_df, "regular_season_ratings", output_dir)
+
+    with profile_stage("merge_features"):
+        # Merge PO game metadata with PO pregame ratings
+        print("Merging playoff game metadata with pregame ratings...", end="", flush=True)
+        po_game_metadata_df = po_game_metadata_df.merge(po_pregame_df, left_on=["game_id", "team_a_name", "team_b_name", "season_start_year"], right_on=["game_id", "team_a_name", "team_b_name", "season_start_year"], how="left")
+        print("done")
+        print(po_game_metadata_df.head())
+
+        print("Merging playoff game metadata with regular season ratings...", end="", flush=True)
+        po_game_metadata_df = po_game_metadata_df.merge(rs_ratings_df, left_on=["team_a_name", "season_start_year"], right_on=["team_name", "season_start_year"], how="left")
+        po_game_metadata_df = po_game_metadata_df.rename(columns={"rating_mean": "team_a_rs_rating", "rating_var": "team_a_rs_rating_var",
+                                                                  "glicko_mean": "team_a_rs_glicko", "glicko_var": "team_a_rs_glicko_var"})
+        po_game_metadata_df = po_game_metadata_df.merge(rs_ratings_df, left_on=["team_b_name", "season_start_year"], right_on=["team_name", "season_start_year"], how="left")
+        po_game_metadata_df = po_game_metadata_df.rename(columns={"rating_mean": "team_b_rs_rating", "rating_var": "team_b_rs_rating_var",
+                                                                  "glicko_mean": "team_b_rs_glicko", "glicko_var": "team_b_rs_glicko_var"})
+        po_game_metadata_df = po_game_metadata_df.drop(columns=["team_name_x", "team_name_y"])
+        print("done")
+        print(po_game_metadata_df.head())
+        po_game_metadata_df.to_csv(output_dir + "playoff_features.csv", index=False)
+        write_feature_table(po_game_metadata_df, "playoff_features", output_dir)
+
+# playoff features from the typed feature store (the csvs are only kept as a readable export).
+# columns/seasons: load only these columns/season start years, dropna: drop rows missing any loaded column
+def load_data(output_dir="output/", columns=None, seasons=None, dropna=False):
+    return load_features("playoff_features", output_dir, columns, seasons, dropna)
 
 # call once for up to date data.  In an operational setting we would update incrementally with a service/job, but not necessary for this scale
 if __name__ == "__main__":
@@ -65,22 +177,59 @@ if __name__ == "__main__":
     # param for updating the db source or not
     parser = argparse.ArgumentParser(description="Update database and features.")
     parser.add_argument("--update-db", action="store_true", help="Flag to update the database source.")
+    parser.add_argument("--incremental", action="store_true", help="With --update-db, only append games past the last ingested game instead of rebuilding the db.")
+    parser.add_argument("--resume", action="store_true", help="Resume ratings from the checkpoints in output/checkpoints/ and only rate new games.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes for the feature stages.")
+    parser.add_argument("--cache", action="store_true", help="Reuse per season stage results from output/stage_cache/ and only compute missing or changed seasons.")
+    parser.add_argument("--stream", type=int, nargs="?", const=stream_chunk_rows, default=None, metavar="CHUNK_ROWS",
+                        help=f"Stream games off the db in chunks of CHUNK_ROWS player rows (default {stream_chunk_rows}) instead of loading whole season ranges.")
+    parser.add_argument("--glicko2", type=int, nargs="?", const=1, default=None, metavar="PERIOD_DAYS",
+                        help="Also rate with Glicko-2 (rating periods of PERIOD_DAYS days, default 1) and add *_po_glicko/*_rs_glicko features. Not with --resume or --cache.")
+    parser.add_argument("--profile", nargs="?", const="output/profile/profile.json", default=None, metavar="REPORT_PATH",
+                        help="Time every stage + season (rows fetched, games rated, memory) and the sql/rating hooks, and write a json report (default output/profile/profile.json).")
+    parser.add_argument("--trace-allocations", action="store_true", help="With --profile, also trace allocations per stage (tracemalloc, slows the run down).")
+    parser.add_argument("--cprofile", default=None, metavar="PROF_PATH", help="Dump cProfile stats of the run here (pstats format- snakeviz/flameprof turn it into a flamegraph).")
     args = parser.parse_args()
+    if args.glicko2 and (args.resume or args.cache):
+        parser.error("--glicko2 can't be combined with --resume or --cache, checkpoints and the stage cache only keep the TrueSkill ratings")
+
+    # before the db is opened, so its cursor gets the sql hooks
+    if args.profile:
+        start_profiling(trace_allocations=args.trace_allocations)
+    cprofiler = None
+    if args.cprofile:
+        cprofiler = cProfile.Profile()
+        cprofiler.enable()
 
     if args.update_db:
         # Update the database source
         print("Updating database source...", end="", flush=True)
-        update_db_source()
+        with profile_stage("update_db"):
+            update_db_source(incremental=args.incremental)
         print("done")
     else:
         print("Skipping database source update...")
         print("Init db...", end="", flush=True)
-        init_db()
+        with profile_stage("init_db"):
+            init_db()
         print("done")
     
 
     # Update the features
     print("Updating features csv...", end="", flush=True)
-    extract_features()
+    with profile_stage("extract_features"):
+        extract_features(checkpoint_dir="output/checkpoints/" if args.resume else None, n_workers=args.workers,
+                         cache_dir="output/stage_cache/" if args.cache else None, stream_chunk_rows=args.stream, glicko2_period_days=args.glicko2)
     print("done updating features csv.")
 
+    if cprofiler is not None:
+        cprofiler.disable()
+        Path(args.cprofile).parent.mkdir(parents=True, exist_ok=True)
+        cprofiler.dump_stats(args.cprofile)
+        print("cProfile stats written to", args.cprofile)
+    if args.profile:
+        report = stop_profiling()
+        report["args"] = vars(args)
+        print_report(report)
+        write_report(report, args.profile)
+        print("Profile report written to", args.profile)
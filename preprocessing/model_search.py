@@ -0,0 +1,231 @@
+import math
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from xgboost import XGBClassifier
+from sklearn.base import clone
+from sklearn.metrics import log_loss
+from sklearn.model_selection import ParameterSampler, ParameterGrid
+from sklearn.pipeline import Pipeline
+from concurrent.futures import ProcessPoolExecutor
+
+# Rolling window hyperparameter search for the notebooks' models, in place of RandomizedSearchCV/GridSearchCV over
+# rolling_window_splits.  Fold data is built once per search instead of once per fit:
+#   - XGBClassifier: float32 fold matrices, and a QuantileDMatrix per fold (+ max_bin) that every config trains on
+#   - sklearn Pipeline: everything before the final step (scaler, poly features...) doesn't depend on the searched
+#     params, so it's fit + applied once per fold, and configs only fit the final step
+# Configs x folds run on a process pool, and successive halving (halving_eta) scores every config on the most recent
+# fold(s) first and only keeps the best 1/eta for the next, wider set of folds.
+# Results come back like the sklearn searches: best_params_, best_score_, best_estimator_ (refit on all the data).
+
+# yields (train positions, validation positions): train_size seasons, then the next season to validate on, moving
+# forward a season per split.  Positions, not index labels- they are what the cv splitters expect
+def rolling_window_splits(df : pd.DataFrame, season_col="season_start_year", train_size=10, n_splits=5):
+    df_seasons = df[season_col].to_numpy()
+    seasons = sorted(np.unique(df_seasons))
+    if len(seasons) < train_size + n_splits:
+        raise ValueError(f"Need {train_size + n_splits} seasons for {n_splits} splits of {train_size} training seasons, got {len(seasons)}")
+
+    for i in range(n_splits):
+        train_seasons = seasons[i : i + train_size]
+        val_season = seasons[i + train_size]
+        yield np.flatnonzero(np.isin(df_seasons, train_seasons)), np.flatnonzero(df_seasons == val_season)
+
+# +-10% around each of the best params (random search -> grid search)
+def generate_search_grid(params):
+    grid = {}
+    for key, value in params.items():
+        if isinstance(value, (float, np.floating)):
+            grid[key] = [max(.001, value - 0.1*value), value, min(1, value + 0.1*value)]
+        elif isinstance(value, (int, np.integer)):
+            grid[key] = [min(value - 1, value - value//10), value, max(value + 1, value + value//10)]
+    return grid
+
+def fold_score(y_true, proba, scoring="accuracy"):
+    if scoring == "accuracy":
+        return float(np.mean((proba > 0.5) == y_true))
+    if scoring == "neg_log_loss":
+        return -log_loss(y_true, proba, labels=[0, 1])
+    raise ValueError(f"Unknown scoring: {scoring}")
+
+# XGBClassifier folds.  Trains with the native api on the cached matrices- same params, rounds and QuantileDMatrix
+# as XGBClassifier.fit, so the scores match cross validating the classifier
+class XGBoostFolds:
+    def __init__(self, estimator, X, y, splits):
+        self.estimator = estimator
+        X = np.asarray(X, dtype=np.float32)
+        self.folds = [(X[train], y[train], X[val], y[val]) for train, val in splits]
+        self.n_threads = None
+        self._dmatrices = dict()
+
+    # dmatrices live in the process that built them
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_dmatrices"] = dict()
+        return state
+
+    def dmatrices(self, fold_index, max_bin):
+        key = (fold_index, max_bin)
+        if key not in self._dmatrices:
+            X_train, y_train, X_val, _ = self.folds[fold_index]
+            dtrain = xgb.QuantileDMatrix(X_train, y_train, max_bin=max_bin, nthread=self.n_threads)
+            self._dmatrices[key] = (dtrain, xgb.DMatrix(X_val, nthread=self.n_threads))
+        return self._dmatrices[key]
+
+    # candidates that only differ in n_estimators share one booster- the first n rounds of a longer run are the
+    # same trees a run of n rounds builds
+    def shared_fit_key(self, params):
+        return tuple(sorted((name, value) for name, value in params.items() if name != "n_estimators"))
+
+    # validation probabilities for a group of candidates with the same shared_fit_key
+    def predict_proba(self, params_list, fold_index):
+        models = [clone(self.estimator).set_params(**params) for params in params_list]
+        n_rounds = [model.n_estimators or 100 for model in models]
+        booster_params = {name: value for name, value in models[0].get_xgb_params().items() if value is not None}
+        n_jobs = booster_params.pop("n_jobs", None) or self.n_threads
+        if n_jobs:
+            booster_params["nthread"] = n_jobs
+        dtrain, dval = self.dmatrices(fold_index, booster_params.get("max_bin"))
+        booster = xgb.train(booster_params, dtrain, num_boost_round=max(n_rounds))
+        return [booster.predict(dval, iteration_range=(0, rounds)) for rounds in n_rounds]
+
+# any other sklearn classifier.  For a Pipeline the steps before the classifier are fit per fold up front, searched
+# params have to belong to the final step (e.g. classifier__C)
+class EstimatorFolds:
+    def __init__(self, estimator, X, y, splits):
+        self.estimator = estimator
+        self.prefix = ""
+        preprocess = None
+        if isinstance(estimator, Pipeline):
+            final_name, self.estimator = estimator.steps[-1]
+            self.prefix = final_name + "__"
+            preprocess = Pipeline(estimator.steps[:-1]) if len(estimator.steps) > 1 else None
+
+        self.folds = []
+        for train, val in splits:
+            X_train, X_val = X.iloc[train], X.iloc[val]
+            if preprocess is not None:
+                fold_preprocess = clone(preprocess).fit(X_train, y[train])
+                X_train, X_val = fold_preprocess.transform(X_train), fold_preprocess.transform(X_val)
+            self.folds.append((X_train, y[train], X_val, y[val]))
+        self.n_threads = None
+
+    # every candidate is its own fit
+    def shared_fit_key(self, params):
+        return None
+
+    def predict_proba(self, params_list, fold_index):
+        X_train, y_train, X_val, _ = self.folds[fold_index]
+        probas = []
+        for params in params_list:
+            if any(not name.startswith(self.prefix) for name in params):
+                raise ValueError(f"Only the final pipeline step's params ({self.prefix}*) can be searched, got {list(params)}")
+            model = clone(self.estimator).set_params(**{name[len(self.prefix):]: value for name, value in params.items()})
+            probas.append(model.fit(X_train, y_train).predict_proba(X_val)[:, 1])
+        return probas
+
+def build_folds(estimator, X, y, splits):
+    if isinstance(estimator, XGBClassifier):
+        return XGBoostFolds(estimator, X, y, splits)
+    return EstimatorFolds(estimator, X, y, splits)
+
+class SearchResult:
+    def __init__(self, candidates, scores, rungs, best_index, best_estimator):
+        self.cv_results_ = pd.DataFrame({"params": candidates, "rung": rungs, "mean_test_score": np.nanmean(scores, axis=1),
+                                         **{f"split{fold_index}_test_score": scores[:, fold_index] for fold_index in range(scores.shape[1])}})
+        self.best_index_ = best_index
+        self.best_params_ = candidates[best_index]
+        self.best_score_ = float(np.mean(scores[best_index]))
+        self.best_estimator_ = best_estimator
+
+    def __repr__(self):
+        return f"SearchResult(Candidates: {len(self.cv_results_)}, Best score: {self.best_score_:.3f}, Best params: {self.best_params_})"
+
+# worker process setup- the folds are sent once per worker, each builds its own dmatrices
+_worker_folds = None
+
+def _init_search_worker(folds, n_threads=None):
+    global _worker_folds
+    _worker_folds = folds
+    _worker_folds.n_threads = n_threads
+
+# one fit: (candidate indices, fold index, their params, scoring) -> (candidate indices, fold index, scores)
+def _score_task(task):
+    config_indices, fold_index, params_list, scoring = task
+    probas = _worker_folds.predict_proba(params_list, fold_index)
+    y_val = _worker_folds.folds[fold_index][3]
+    return config_indices, fold_index, [fold_score(y_val, proba, scoring) for proba in probas]
+
+# groups the candidates that can share a fit (see shared_fit_key) into tasks, in candidate order
+def _fit_tasks(folds, candidates, config_indices, fold_indices, scoring):
+    groups = dict()
+    for config_index in config_indices:
+        key = folds.shared_fit_key(candidates[config_index])
+        groups.setdefault(("config", config_index) if key is None else key, []).append(config_index)
+    return [(group, fold_index, [candidates[config_index] for config_index in group], scoring)
+            for group in groups.values() for fold_index in fold_indices]
+
+# scores candidates (list of param dicts) on the rolling window folds of df and picks the best mean score.
+# halving_eta: None scores every candidate on every fold.  Otherwise successive halving over the folds, most recent
+# validation season first: min_folds folds, keep the best 1/eta, eta times the folds... until the survivors have been
+# scored on all folds.  Ties go to the earlier candidate, like the sklearn searches
+def search_candidates(estimator, candidates, df, target="team_a_win", season_col="season_start_year", train_size=10, n_splits=5,
+                      scoring="accuracy", n_workers=1, halving_eta=None, min_folds=1, refit=True):
+    X, y = df.drop(columns=[target]), df[target].to_numpy()
+    splits = list(rolling_window_splits(df, season_col, train_size, n_splits))
+    folds = build_folds(estimator, X, y, splits)
+
+    scores = np.full((len(candidates), n_splits), np.nan)
+    rungs = np.zeros(len(candidates), dtype=np.int64)
+    fold_order = list(range(n_splits))[::-1]
+    if halving_eta:
+        rung_folds = [min(n_splits, min_folds * halving_eta ** rung) for rung in range(math.ceil(math.log(n_splits / min_folds, halving_eta)) + 1)]
+    else:
+        rung_folds = [n_splits]
+
+    # one xgboost thread per worker, the pool is the parallelism
+    executor = None
+    if n_workers > 1:
+        executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_search_worker, initargs=(folds, 1))
+    else:
+        _init_search_worker(folds)
+
+    alive = np.arange(len(candidates))
+    try:
+        for rung, n_rung_folds in enumerate(rung_folds):
+            # survivors have been scored on the previous rungs' folds already
+            rung_fold_indices = fold_order[:n_rung_folds]
+            new_fold_indices = fold_order[rung_folds[rung - 1] if rung else 0 : n_rung_folds]
+            tasks = _fit_tasks(folds, candidates, alive, new_fold_indices, scoring)
+            print(f"Rung {rung}: {len(alive)} candidates x {n_rung_folds} folds ({len(tasks)} fits)... ", end="", flush=True)
+            results = executor.map(_score_task, tasks, chunksize=max(1, len(tasks) // (4 * n_workers))) if executor else map(_score_task, tasks)
+            for config_indices, fold_index, fold_scores in results:
+                scores[config_indices, fold_index] = fold_scores
+            print("done")
+
+            rungs[alive] = rung
+            if rung < len(rung_folds) - 1:
+                # stable sort, so ties keep the earlier candidate
+                mean_scores = np.mean(scores[alive][:, rung_fold_indices], axis=1)
+                keep = max(1, math.ceil(len(alive) / halving_eta))
+                alive = np.sort(alive[np.argsort(-mean_scores, kind="stable")[:keep]])
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    # the survivors of the last rung are the ones with every fold scored
+    best_index = int(alive[np.argmax(np.mean(scores[alive], axis=1))])
+
+    best_estimator = None
+    if refit:
+        best_estimator = clone(estimator).set_params(**candidates[best_index]).fit(X, y)
+    return SearchResult(candidates, scores, rungs, best_index, best_estimator)
+
+# RandomizedSearchCV over the rolling window folds- the same n_iter candidates RandomizedSearchCV draws for a random_state
+def random_search(estimator, param_distributions, df, n_iter=100, random_state=None, **search_args):
+    candidates = list(ParameterSampler(param_distributions, n_iter, random_state=random_state))
+    return search_candidates(estimator, candidates, df, **search_args)
+
+# GridSearchCV over the rolling window folds
+def grid_search(estimator, param_grid, df, **search_args):
+    return search_candidates(estimator, list(ParameterGrid(param_grid)), df, **search_args)
@@ -0,0 +1,332 @@
+import argparse
+import json
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from db_extract import process_game_arrays
+from rate_games import generate_ts_ratings, compute_team_ratings
+from simulate_bracket import WINS_NEEDED, load_model, load_rating_state, predict_team_a_win
+
+# Long running pregame prediction service, so a win probability doesn't mean regenerating the csvs + a notebook.
+# Everything the feature row needs stays in memory: RS team ratings (fixed for the playoffs), the playoff rating
+# chain's player store + each team's aggregated PO rating off its roster (recomputed only for teams whose players
+# changed), and the state of every series.  Rows are built the same way as simulate_bracket: team a is the team whose
+# name sorts last, series state is the pregame state.
+#
+# Predictions go through a micro-batcher: concurrent requests are queued and scored together in one model call
+# (up to max_batch games, waiting at most max_wait_ms for more after the first).  "game finished" events rate the game
+# into the playoff store (same update as the chain), add its players to the rosters and move the series on.
+#
+# HTTP api (json):
+#   POST /predict        {"games": [{"home_team": ..., "away_team": ...}, ...]}
+#   POST /game_finished  {"game_id", "game_date", "home_team", "away_team", "home_win", "players": [{"player_id", "minutes", "home"}, ...]}
+#   GET  /stats          games rated, batches scored, latency percentiles
+
+class ServiceState:
+    # rs_ratings: team -> (mean, var), rosters: Team list (season end rosters), po_rating_store: the playoff chain store
+    # series_games: optional playoff game metadata rows already played this season (see get_playoff_game_metadata),
+    # to pick the series up where they are
+    def __init__(self, season_start_year, rs_ratings, rosters, po_rating_store, series_games=()):
+        self.lock = threading.Lock()
+        self.season_start_year = season_start_year
+        self.po_rating_store = po_rating_store
+        self.rosters = {team.team_name: {player.player_id for player in team.players} for team in rosters}
+        self.teams = sorted(set(rs_ratings) | set(self.rosters))
+        self.team_index = {team: i for i, team in enumerate(self.teams)}
+
+        # team arrays by team index.  Teams without an RS rating get the default player's
+        default_rs = (po_rating_store.default_mu, po_rating_store.default_sigma ** 2)
+        self.rs_rating = np.array([rs_ratings.get(team, default_rs)[0] for team in self.teams], dtype=np.float64)
+        self.rs_rating_var = np.array([rs_ratings.get(team, default_rs)[1] for team in self.teams], dtype=np.float64)
+        self.po_rating = np.zeros(len(self.teams))
+        self.po_rating_var = np.zeros(len(self.teams))
+        self.dirty_teams = set(self.teams)
+
+        # (team a, team b) -> [team a wins, team b wins] before the next game
+        self.series_wins = dict()
+        for row in series_games:
+            team_a_name, team_b_name, team_a_wins, team_b_wins, team_a_win = row[2], row[3], row[6], row[7], row[10]
+            self.series_wins[(team_a_name, team_b_name)] = [team_a_wins + team_a_win, team_b_wins + 1 - team_a_win]
+        self.games_rated = 0
+
+    def __repr__(self):
+        return f"ServiceState(Season: {self.season_start_year}, Teams: {len(self.teams)}, Series: {len(self.series_wins)}, Games rated: {self.games_rated})"
+
+    # PO ratings of the teams whose rosters/players changed, in one vectorized pass
+    def refresh_po_ratings(self):
+        if not self.dirty_teams:
+            return
+        teams = sorted(self.dirty_teams)
+        roster_slots = [self.po_rating_store.rated_slots(list(self.rosters.get(team, ()))) for team in teams]
+        slots = np.concatenate(roster_slots) if roster_slots else np.zeros(0, dtype=np.int64)
+        team_seg = np.repeat(np.arange(len(teams)), [len(team_slots) for team_slots in roster_slots])
+        means, variances = compute_team_ratings(self.po_rating_store, slots, team_seg, len(teams))
+
+        team_indices = [self.team_index[team] for team in teams]
+        self.po_rating[team_indices], self.po_rating_var[team_indices] = means, variances
+        self.dirty_teams.clear()
+
+    def check_game(self, game):
+        for key in ("home_team", "away_team"):
+            if game.get(key) not in self.team_index:
+                raise ValueError(f"Unknown {key}: {game.get(key)}")
+        if game["home_team"] == game["away_team"]:
+            raise ValueError(f"Team can't play itself: {game['home_team']}")
+
+    # feature columns for a batch of upcoming games ({"home_team", "away_team"} dicts).  returns (features, team a names)
+    def feature_rows(self, games):
+        self.refresh_po_ratings()
+        home_names = [game["home_team"] for game in games]
+        away_names = [game["away_team"] for game in games]
+        home = np.array([self.team_index[team] for team in home_names], dtype=np.int64)
+        away = np.array([self.team_index[team] for team in away_names], dtype=np.int64)
+
+        # team a sorts last by name, same as the training data
+        home_is_a = np.array([home_team > away_team for home_team, away_team in zip(home_names, away_names)], dtype=bool)
+        a, b = np.where(home_is_a, home, away), np.where(home_is_a, away, home)
+        wins = np.array([self.series_wins.get((self.teams[team_a], self.teams[team_b]), (0, 0)) for team_a, team_b in zip(a, b)], dtype=np.int64).reshape(-1, 2)
+
+        features = {
+            "team_a_home": home_is_a.astype(np.int64),
+            "series_game_number": (wins[:, 0] + wins[:, 1] + 1).astype(np.float64),
+            "team_a_series_wins": wins[:, 0],
+            "team_b_series_wins": wins[:, 1],
+            "series_diff": wins[:, 0] - wins[:, 1],
+            "season_start_year": np.full(len(games), self.season_start_year, dtype=np.int64),
+            "team_a_rs_rating": self.rs_rating[a],
+            "team_a_rs_rating_var": self.rs_rating_var[a],
+            "team_b_rs_rating": self.rs_rating[b],
+            "team_b_rs_rating_var": self.rs_rating_var[b],
+            "team_a_po_rating": self.po_rating[a],
+            "team_a_po_rating_var": self.po_rating_var[a],
+            "team_b_po_rating": self.po_rating[b],
+            "team_b_po_rating_var": self.po_rating_var[b],
+            "rs_rating_diff": self.rs_rating[a] - self.rs_rating[b],
+            "po_rating_diff": self.po_rating[a] - self.po_rating[b],
+        }
+        return features, [self.teams[team_a] for team_a in a]
+
+    # a finished game: rated into the playoff store like the next game of the chain, then rosters + series move on
+    def game_finished(self, event):
+        self.check_game(event)
+        home_win = bool(event["home_win"])
+        rows = []
+        for player in event["players"]:
+            team = event["home_team"] if player["home"] else event["away_team"]
+            rows.append((player.get("first_name", ""), player.get("last_name", ""), int(player["player_id"]), int(event["game_id"]),
+                         event["game_date"], team, 1 if player["home"] else 0, float(player["minutes"]), int(home_win), int(not home_win)))
+        games = process_game_arrays(rows)
+        if len(games) != 1 or games.home_splits[0] in (games.game_offsets[0], games.game_offsets[1]):
+            raise ValueError("A finished game needs players on both teams")
+
+        generate_ts_ratings(games, self.po_rating_store)
+        for player in event["players"]:
+            self.rosters.setdefault(event["home_team"] if player["home"] else event["away_team"], set()).add(int(player["player_id"]))
+        # every team with one of these players on its roster has a new PO rating
+        player_ids = {int(player["player_id"]) for player in event["players"]}
+        self.dirty_teams.update(team for team, roster in self.rosters.items() if not roster.isdisjoint(player_ids))
+
+        team_a_name, team_b_name = max(event["home_team"], event["away_team"]), min(event["home_team"], event["away_team"])
+        wins = self.series_wins.setdefault((team_a_name, team_b_name), [0, 0])
+        team_a_win = home_win == (event["home_team"] == team_a_name)
+        wins[0 if team_a_win else 1] += 1
+        self.games_rated += 1
+        return {"team_a_name": team_a_name, "team_b_name": team_b_name, "team_a_series_wins": wins[0], "team_b_series_wins": wins[1],
+                "series_over": max(wins) >= WINS_NEEDED}
+
+# queues single items and hands them to score_batch(list of items) -> list of results in batches, on its own thread
+class MicroBatcher:
+    def __init__(self, score_batch, max_batch=256, max_wait_ms=2.0):
+        self.score_batch = score_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self.queue.put((item, future))
+        return future
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        closing = False
+        while not closing:
+            entry = self.queue.get()
+            if entry is None:
+                break
+
+            # whatever else shows up within max_wait of the first item rides along
+            batch = [entry]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    entry = self.queue.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if entry is None:
+                    closing = True
+                    break
+                batch.append(entry)
+
+            try:
+                results = self.score_batch([item for item, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+            self.batches += 1
+
+class PredictionService:
+    # model: anything predict_team_a_win takes (a saved notebook model)
+    def __init__(self, state, model, max_batch=256, max_wait_ms=2.0):
+        self.state = state
+        self.model = model
+        self.batcher = MicroBatcher(self._score_batch, max_batch, max_wait_ms)
+        self.latencies = deque(maxlen=10000) # seconds, per predict call
+
+    def _score_batch(self, games):
+        with self.state.lock:
+            features, team_a_names = self.state.feature_rows(games)
+        team_a_win_prob = predict_team_a_win(self.model, features)
+        return [{"home_team": game["home_team"], "away_team": game["away_team"], "team_a_name": team_a_name,
+                 "team_a_win_prob": float(prob), "home_win_prob": float(prob if game["home_team"] == team_a_name else 1 - prob)}
+                for game, team_a_name, prob in zip(games, team_a_names, team_a_win_prob)]
+
+    # blocking, one result dict per game.  Bad games are rejected before they get into a batch
+    def predict(self, games):
+        start = time.perf_counter()
+        for game in games:
+            self.state.check_game(game)
+        futures = [self.batcher.submit(game) for game in games]
+        results = [future.result() for future in futures]
+        self.latencies.append(time.perf_counter() - start)
+        return results
+
+    def game_finished(self, event):
+        with self.state.lock:
+            return self.state.game_finished(event)
+
+    def stats(self):
+        latencies_ms = np.array(self.latencies) * 1000
+        percentiles = {f"p{q}_ms": float(np.percentile(latencies_ms, q)) for q in (50, 90, 99)} if len(latencies_ms) else dict()
+        return {"season_start_year": self.state.season_start_year, "games_rated": self.state.games_rated,
+                "requests": len(latencies_ms), "batches": self.batcher.batches, **percentiles}
+
+    def close(self):
+        self.batcher.close()
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._reply(200, self.service.stats())
+        else:
+            self._reply(404, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path == "/predict":
+                self._reply(200, {"predictions": self.service.predict(body["games"])})
+            elif self.path == "/game_finished":
+                self._reply(200, self.service.game_finished(body))
+            else:
+                self._reply(404, {"error": f"Unknown path: {self.path}"})
+        except (ValueError, KeyError, TypeError) as error:
+            self._reply(400, {"error": str(error)})
+
+    # no per request logging
+    def log_message(self, format, *args):
+        pass
+
+def make_server(service, host="127.0.0.1", port=8765):
+    handler = type("BoundPredictionHandler", (PredictionHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+# client for a running service
+class ServiceClient:
+    def __init__(self, url="http://127.0.0.1:8765"):
+        self.url = url.rstrip("/")
+
+    def _request(self, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    def predict(self, games):
+        return self._request("/predict", {"games": games})["predictions"]
+
+    def game_finished(self, event):
+        return self._request("/game_finished", event)
+
+    def stats(self):
+        return self._request("/stats")
+
+# same interface, straight into an in process service (no server needed)
+class LocalClient:
+    def __init__(self, service):
+        self.service = service
+
+    def predict(self, games):
+        return self.service.predict(games)
+
+    def game_finished(self, event):
+        return self.service.game_finished(event)
+
+    def stats(self):
+        return self.service.stats()
+
+# state for a season off the db + checkpoints (see simulate_bracket.load_rating_state), series picked up from the
+# playoff games already in the db
+def load_service_state(season_start_year, po_start_season=2009, playoff_rating_prefix=5, checkpoint_dir="output/checkpoints/"):
+    from db_extract import get_playoff_game_metadata
+    rs_ratings, po_rating_store, rosters = load_rating_state(season_start_year, po_start_season, playoff_rating_prefix, checkpoint_dir)
+    return ServiceState(season_start_year, rs_ratings, rosters, po_rating_store, get_playoff_game_metadata(season_start_year))
+
+if __name__ == "__main__":
+    from db_extract import init_db
+
+    parser = argparse.ArgumentParser(description="Pregame win probability service.")
+    parser.add_argument("--season", type=int, required=True, help="Season start year of the playoffs to serve.")
+    parser.add_argument("--model", default="output/boosted_tree.pkl", help="Saved model to score games with (.pkl, or a compiled .npz).")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to listen on.")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on.")
+    parser.add_argument("--max-batch", type=int, default=256, help="Most games scored in one model call.")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0, help="How long a batch waits for more requests.")
+    args = parser.parse_args()
+
+    init_db()
+    service = PredictionService(load_service_state(args.season), load_model(args.model), args.max_batch, args.max_wait_ms)
+    server = make_server(service, args.host, args.port)
+    print("Serving", service.state, "on", f"http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,200 @@
+import functools
+import json
+import resource
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+# Optional instrumentation for extract_features + the rating loop.  Off by default- every hook below is a single
+# global check until start_profiling() is called, so the pipeline doesn't pay for it.
+#   - stages: profile_stage(name, season) around a piece of the pipeline records its wall time, rows fetched, games
+#     rated, RSS at the end + the process RSS high-water mark so far, and with trace_allocations the tracemalloc net
+#     and peak allocations.  Stages nest (the seasons inside a stage), counts go to every open stage
+#   - hooks: @profiled(name) adds a function's calls + time to the hook totals (process_game_data, weighted_update,
+#     compute_team_rating...), profiled_cursor() does the same for sql execute/fetch and counts the rows fetched
+# Rows are counted when they're fetched- with prefetch_game_blocks that's on the reader thread, so a few can land in
+# the season before the one that rates them.  Worker processes (--workers) aren't profiled, only this process.
+
+MB = 1024 ** 2
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / MB
+    except OSError:
+        return None
+
+# ru_maxrss is kB on linux
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class Profiler:
+    def __init__(self, trace_allocations=False):
+        self.trace_allocations = trace_allocations
+        self.lock = threading.Lock()
+        self.stack = []
+        self.stages = []
+        self.hooks = dict()
+        self.start_time = time.perf_counter()
+        if trace_allocations:
+            tracemalloc.start()
+
+    def __repr__(self):
+        return f"Profiler(Stages: {len(self.stages)}, Hooks: {len(self.hooks)})"
+
+    # tracemalloc has one peak, so a child stage saves its parent's peak so far before resetting it, and hands its own
+    # peak back to the parent when it's done
+    @contextmanager
+    def stage(self, name, season=None):
+        record = {"stage": name, "season": season, "depth": len(self.stack), "seconds": 0.0, "rows_fetched": 0, "games_rated": 0}
+        if self.trace_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1]["_alloc_peak"] = max(self.stack[-1]["_alloc_peak"], peak)
+            tracemalloc.reset_peak()
+            record["_alloc_start"], record["_alloc_peak"] = current, current
+        with self.lock:
+            self.stages.append(record)
+            self.stack.append(record)
+
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            with self.lock:
+                self.stack.pop()
+            if self.trace_allocations:
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(record.pop("_alloc_peak"), peak)
+                alloc_start = record.pop("_alloc_start")
+                record["alloc_net_mb"] = (current - alloc_start) / MB
+                record["alloc_peak_mb"] = (peak - alloc_start) / MB
+                if self.stack:
+                    self.stack[-1]["_alloc_peak"] = max(self.stack[-1]["_alloc_peak"], peak)
+            record["rss_mb"], record["max_rss_mb"] = rss_mb(), max_rss_mb()
+
+    # adds to every open stage, e.g. count(games_rated=1230)
+    def count(self, **counts):
+        with self.lock:
+            for record in self.stack:
+                for name, n in counts.items():
+                    record[name] += n
+
+    def hook(self, name, seconds, items=0):
+        with self.lock:
+            totals = self.hooks.setdefault(name, {"calls": 0, "seconds": 0.0, "items": 0})
+            totals["calls"] += 1
+            totals["seconds"] += seconds
+            totals["items"] += items
+
+    def report(self):
+        return {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "total_seconds": time.perf_counter() - self.start_time,
+            "max_rss_mb": max_rss_mb(),
+            "trace_allocations": self.trace_allocations,
+            "stages": self.stages,
+            "hooks": dict(sorted(self.hooks.items(), key=lambda hook: -hook[1]["seconds"])),
+        }
+
+_profiler = None
+
+def start_profiling(trace_allocations=False):
+    global _profiler
+    _profiler = Profiler(trace_allocations)
+    return _profiler
+
+# stops profiling and returns the report
+def stop_profiling():
+    global _profiler
+    report = _profiler.report()
+    if _profiler.trace_allocations:
+        tracemalloc.stop()
+    _profiler = None
+    return report
+
+def profile_stage(name, season=None):
+    return _profiler.stage(name, season) if _profiler is not None else nullcontext()
+
+def count(**counts):
+    if _profiler is not None:
+        _profiler.count(**counts)
+
+# decorator: calls + time of a function go to the hook totals under name
+def profiled(name):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _profiler.hook(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+# sqlite cursor that times execute/fetch* (sql.execute, sql.fetch hooks) and counts the rows it hands out
+class ProfiledCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def execute(self, *args):
+        if _profiler is None:
+            self.cursor.execute(*args)
+            return self
+        start = time.perf_counter()
+        self.cursor.execute(*args)
+        _profiler.hook("sql.execute", time.perf_counter() - start)
+        return self
+
+    def _fetch(self, func, *args):
+        if _profiler is None:
+            return func(*args)
+        start = time.perf_counter()
+        result = func(*args)
+        rows = len(result) if isinstance(result, list) else int(result is not None)
+        _profiler.hook("sql.fetch", time.perf_counter() - start, rows)
+        _profiler.count(rows_fetched=rows)
+        return result
+
+    def fetchone(self):
+        return self._fetch(self.cursor.fetchone)
+
+    def fetchmany(self, size):
+        return self._fetch(self.cursor.fetchmany, size)
+
+    def fetchall(self):
+        return self._fetch(self.cursor.fetchall)
+
+# cursor as is when profiling is off
+def profiled_cursor(cursor):
+    return ProfiledCursor(cursor) if _profiler is not None else cursor
+
+# stages (seasons indented under their stage) + hook totals as a table
+def print_report(report):
+    print(f"{'stage':<34}{'season':>8}{'seconds':>10}{'rows':>10}{'games':>8}{'rss MB':>9}{'alloc pk MB':>13}")
+    for record in report["stages"]:
+        season = record["season"] if record["season"] is not None else ""
+        alloc_peak = f"{record['alloc_peak_mb']:.1f}" if "alloc_peak_mb" in record else "-"
+        rss = f"{record['rss_mb']:.0f}" if record["rss_mb"] is not None else "-"
+        print(f"{'  ' * record['depth'] + record['stage']:<34}{season:>8}{record['seconds']:>10.3f}{record['rows_fetched']:>10}"
+              f"{record['games_rated']:>8}{rss:>9}{alloc_peak:>13}")
+    print(f"{'hook':<34}{'calls':>8}{'seconds':>10}{'rows':>10}")
+    for name, totals in report["hooks"].items():
+        print(f"{name:<34}{totals['calls']:>8}{totals['seconds']:>10.3f}{totals['items']:>10}")
+    print(f"total {report['total_seconds']:.2f}s, max rss {report['max_rss_mb']:.0f} MB")
+
+def write_report(report, path):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text(json.dumps(report, indent=2))
@@ -1,70 +1,318 @@
-from numpy import average
-import pandas as pd
-from ts_ratings import weighted_update, weighted_team_rating
-from db_extract import get_season_end_rosters, get_regular_season_games, get_playoff_games
-from trueskill import Rating
-
-def generate_ts_ratings(games_list, rating_dictionary = dict(), game_df_update_callback=None):
-
-    for game in games_list:
-
-        if game_df_update_callback:
-            game_df_update_callback(game, rating_dictionary)
-
-        # get player ratings from the dictionary + mins from the game
-        home_ratings = []
-        home_mins = []
-        for player in game.home_team.players:
-            if player.player_id not in rating_dictionary:
-                rating_dictionary[player.player_id] = (Rating(), [])
-            
-            home_ratings.append(rating_dictionary[player.player_id][0])
-            home_mins.append(player.minutes)
-            
-        away_ratings = []
-        away_mins = []
-        for player in game.away_team.players:
-            if player.player_id not in rating_dictionary:
-                rating_dictionary[player.player_id] = (Rating(), [])
-            
-            away_ratings.append(rating_dictionary[player.player_id][0])
-            away_mins.append(player.minutes)
-
-        # call our rating function, get updated ratings for all players with mins
-        new_home_ratings, new_away_ratings = weighted_update(home_ratings, away_ratings, home_mins, away_mins, winner=1 if game.home_win else 2)
-
-        # update the dictionary with the new ratings
-        for i, player in enumerate(game.home_team.players):
-            rating_dictionary[player.player_id] = (new_home_ratings[i], rating_dictionary[player.player_id][1] + [player.minutes])
-
-        for i, player in enumerate(game.away_team.players):
-            rating_dictionary[player.player_id] = (new_away_ratings[i], rating_dictionary[player.player_id][1] + [player.minutes])
-
-    # return dictionary
-    return rating_dictionary
-
-def generate_ts_ratings_pregame(games_list, prefix_ratings_dict=dict()):    
-    pregame_ratings_df = pd.DataFrame(columns=["game_id", "team_a_name", "team_b_name", "team_a_po_rating", "team_a_po_rating_var", "team_b_po_rating", "team_b_po_rating_var"])
-
-    def df_update_callback(game, rating_dict):
-        home_team_rating, home_team_rating_var = compute_team_rating(rating_dict, game.home_team)
-        away_team_rating, away_team_rating_var = compute_team_rating(rating_dict, game.away_team)
-
-        team_a_is_home = game.home_team.team_name > game.away_team.team_name
-        pregame_ratings_df.loc[len(pregame_ratings_df)] = {
-            "game_id": game.game_id,
-            "team_a_name": game.home_team.team_name if team_a_is_home else game.away_team.team_name,
-            "team_b_name": game.away_team.team_name if team_a_is_home else game.home_team.team_name,
-            "team_a_po_rating": home_team_rating if team_a_is_home else away_team_rating,
-            "team_a_po_rating_var": home_team_rating_var if team_a_is_home else away_team_rating_var,
-            "team_b_po_rating": away_team_rating if team_a_is_home else home_team_rating,
-            "team_b_po_rating_var": away_team_rating_var if team_a_is_home else home_team_rating_var
-        }
-
-    return pregame_ratings_df, generate_ts_ratings(games_list, prefix_ratings_dict, game_df_update_callback=df_update_callback)
-
+from collections import OrderedDict
+import numpy as np
+from ts_ratings import batch_weighted_update, schedule_batches, segment_rows
+from rating_store import RatingStore, Glicko2Store
+from glicko2 import rating_periods, inflate_idle, glicko2_period_update
+from db_extract import (GameArrays, get_season_end_rosters_range, get_season_end_rosters, get_regular_season_game_arrays_range, get_playoff_game_arrays_range,
+                        count_games_through, regular_season_games_query, playoff_games_query, prefetch_game_blocks, blocks_by_season)
+from rating_checkpoint import load_rating_checkpoint, save_rating_checkpoint, last_game_tag
+from snapshot_recorder import SnapshotRecorder
+from profiling import profiled, profile_stage, count
+
+# snapshot table layouts (column -> dtype) for the SnapshotRecorder buffers
+PREGAME_RATING_COLUMNS = {"game_id": np.int64, "team_a_name": object, "team_b_name": object, "team_a_po_rating": np.float64,
+                          "team_a_po_rating_var": np.float64, "team_b_po_rating": np.float64, "team_b_po_rating_var": np.float64}
+PO_PREGAME_RATING_COLUMNS = {"season_start_year": np.int64, **PREGAME_RATING_COLUMNS}
+PO_GLICKO2_RATING_COLUMNS = {"team_a_po_glicko": np.float64, "team_a_po_glicko_var": np.float64, "team_b_po_glicko": np.float64, "team_b_po_glicko_var": np.float64}
+TEAM_RATING_COLUMNS = {"team_name": object, "rating_mean": np.float64, "rating_var": np.float64}
+RS_RATING_COLUMNS = {"season_start_year": np.int64, **TEAM_RATING_COLUMNS}
+RS_GLICKO2_RATING_COLUMNS = {"glicko_mean": np.float64, "glicko_var": np.float64}
+
+def generate_ts_ratings(games, rating_store=None, batch_update_callback=None):
+
+    # fresh state per call unless we're continuing from a prefix
+    if rating_store is None:
+        rating_store = RatingStore()
+
+    # columnar games from db_extract, or an old style Game list
+    if not isinstance(games, GameArrays):
+        games = GameArrays.from_games(games)
+    count(games_rated=len(games))
+
+    # map the block's players onto store slots once, then every row points straight at its slot
+    slots = rating_store.slots_for(games.players)[games.player_index]
+
+    if isinstance(rating_store, Glicko2Store):
+        return generate_glicko2_ratings(games, slots, rating_store, batch_update_callback)
+
+    # rate player-disjoint batches of games at once- same result as going game by game in date order
+    for batch in schedule_batches(slots, games.game_offsets, len(rating_store)):
+        ts_batch_update(games, batch, slots, rating_store, batch_update_callback)
+
+    # return store
+    return rating_store
+
+# one player-disjoint batch: pregame callback, update, minutes + versions
+def ts_batch_update(games, batch, slots, rating_store, batch_update_callback=None):
+
+    # pregame state for every game in the batch is the state right now
+    if batch_update_callback:
+        batch_update_callback(games, batch, slots, rating_store)
+
+    batch_weighted_update(rating_store.mu, rating_store.sigma, slots, games.minutes,
+                          games.game_offsets, games.home_splits, games.home_win, batch)
+
+    rows = segment_rows(games.game_offsets, batch)
+    rating_store.record_minutes(slots[rows], games.minutes[rows])
+    rating_store.bump_versions(slots[rows])
+
+# Glicko-2 path of generate_ts_ratings: one vectorized update per rating period instead of per player-disjoint batch,
+# the callback gets the games of each period (ratings are fixed within a period, so that's their pregame state)
+def generate_glicko2_ratings(games, slots, rating_store, batch_update_callback=None):
+    period_games, periods = rating_periods(games.dates, rating_store.period_days)
+    for batch, period in zip(period_games, periods):
+        glicko2_period_step(games, batch, period, slots, rating_store, batch_update_callback)
+
+    return rating_store
+
+def glicko2_period_step(games, batch, period, slots, rating_store, batch_update_callback=None):
+    rows = segment_rows(games.game_offsets, batch)
+
+    # deviations of the period's players grown over the periods they sat out
+    inflate_idle(rating_store, np.unique(slots[rows]), period)
+    if batch_update_callback:
+        batch_update_callback(games, batch, slots, rating_store)
+
+    glicko2_period_update(rating_store, slots, games.minutes, games.game_offsets, games.home_splits, games.home_win, batch, period)
+    rating_store.record_minutes(slots[rows], games.minutes[rows])
+    rating_store.bump_versions(slots[rows])
+
+# TrueSkill + Glicko-2 in one pass over the games: period by period, the Glicko-2 update of the period and then the
+# period's games in player-disjoint TrueSkill batches.  Periods are whole game days, so scheduling the batches per
+# period gives the same TrueSkill ratings as generate_ts_ratings over the whole block.  The callback gets both stores'
+# batches (check the store type).  returns (rating_store, glicko2_store)
+def generate_ts_glicko2_ratings(games, rating_store=None, glicko2_store=None, batch_update_callback=None):
+    if rating_store is None:
+        rating_store = RatingStore()
+    if glicko2_store is None:
+        glicko2_store = Glicko2Store()
+    if not isinstance(games, GameArrays):
+        games = GameArrays.from_games(games)
+    count(games_rated=len(games))
+
+    slots = rating_store.slots_for(games.players)[games.player_index]
+    glicko2_slots = glicko2_store.slots_for(games.players)[games.player_index]
+
+    period_games, periods = rating_periods(games.dates, glicko2_store.period_days)
+    for period_batch, period in zip(period_games, periods):
+        glicko2_period_step(games, period_batch, period, glicko2_slots, glicko2_store, batch_update_callback)
+
+        # periods are contiguous runs of games, schedule_batches gives indices into the run
+        first_game, last_game = period_batch[0], period_batch[-1]
+        for batch in schedule_batches(slots, games.game_offsets[first_game:last_game + 2], len(rating_store)):
+            ts_batch_update(games, batch + first_game, slots, rating_store, batch_update_callback)
+
+    return rating_store, glicko2_store
+
+# pregame callback that writes each game's home/away team rating + variance into the given arrays
+def pregame_snapshot_callback(home_ratings, home_ratings_var, away_ratings, away_ratings_var):
+    def pregame_update_callback(games, batch, slots, rating_store):
+        rows, team_seg = batch_team_rows(games, batch)
+        team_ratings, team_ratings_var = compute_team_ratings(rating_store, slots[rows], team_seg, 2 * len(batch))
+        home_ratings[batch], away_ratings[batch] = team_ratings[0::2], team_ratings[1::2]
+        home_ratings_var[batch], away_ratings_var[batch] = team_ratings_var[0::2], team_ratings_var[1::2]
+    return pregame_update_callback
+
+# pregame table columns (team a = the alphabetically later team) out of home/away ratings
+def pregame_columns(games, home_ratings, home_ratings_var, away_ratings, away_ratings_var, suffix="rating"):
+    team_a_is_home = games.home_team_names > games.away_team_names
+    return {
+        f"team_a_po_{suffix}": np.where(team_a_is_home, home_ratings, away_ratings),
+        f"team_a_po_{suffix}_var": np.where(team_a_is_home, home_ratings_var, away_ratings_var),
+        f"team_b_po_{suffix}": np.where(team_a_is_home, away_ratings, home_ratings),
+        f"team_b_po_{suffix}_var": np.where(team_a_is_home, away_ratings_var, home_ratings_var),
+    }
+
+def pregame_team_columns(games):
+    team_a_is_home = games.home_team_names > games.away_team_names
+    return {
+        "game_id": games.game_ids,
+        "team_a_name": np.where(team_a_is_home, games.home_team_names, games.away_team_names),
+        "team_b_name": np.where(team_a_is_home, games.away_team_names, games.home_team_names),
+    }
+
+def generate_ts_ratings_pregame(games, prefix_rating_store=None):
+    if not isinstance(games, GameArrays):
+        games = GameArrays.from_games(games)
+
+    ratings = [np.zeros(len(games)) for _ in range(4)]
+    rating_store = generate_ts_ratings(games, prefix_rating_store, batch_update_callback=pregame_snapshot_callback(*ratings))
+
+    pregame_recorder = SnapshotRecorder(PREGAME_RATING_COLUMNS, len(games))
+    pregame_recorder.extend(len(games), **pregame_team_columns(games), **pregame_columns(games, *ratings))
+    pregame_ratings_df = pregame_recorder.to_frame()
+
+    return pregame_ratings_df, rating_store
+
+# TrueSkill + Glicko-2 pregame ratings off the same games, in one replay (see generate_ts_glicko2_ratings): the
+# generate_ts_ratings_pregame table with the Glicko-2 team a/b ratings added as *_po_glicko columns.
+# returns (df, rating_store, glicko2_store)
+def generate_ts_glicko2_ratings_pregame(games, prefix_rating_store=None, prefix_glicko2_store=None):
+    if not isinstance(games, GameArrays):
+        games = GameArrays.from_games(games)
+
+    ratings = [np.zeros(len(games)) for _ in range(4)]
+    glicko2_ratings = [np.zeros(len(games)) for _ in range(4)]
+    ts_callback, glicko2_callback = pregame_snapshot_callback(*ratings), pregame_snapshot_callback(*glicko2_ratings)
+
+    def pregame_update_callback(games, batch, slots, rating_store):
+        (glicko2_callback if isinstance(rating_store, Glicko2Store) else ts_callback)(games, batch, slots, rating_store)
+
+    rating_store, glicko2_store = generate_ts_glicko2_ratings(games, prefix_rating_store, prefix_glicko2_store, pregame_update_callback)
+
+    pregame_recorder = SnapshotRecorder({**PREGAME_RATING_COLUMNS, **PO_GLICKO2_RATING_COLUMNS}, len(games))
+    pregame_recorder.extend(len(games), **pregame_team_columns(games), **pregame_columns(games, *ratings),
+                            **pregame_columns(games, *glicko2_ratings, suffix="glicko"))
+    pregame_ratings_df = pregame_recorder.to_frame()
+
+    return pregame_ratings_df, rating_store, glicko2_store
+
+# rows of a batch of games + the team segment of each row (2i home, 2i + 1 away for the i-th game in the batch)
+def batch_team_rows(games, batch):
+    rows = segment_rows(games.game_offsets, batch)
+    row_game = np.repeat(np.arange(len(batch)), games.game_offsets[batch + 1] - games.game_offsets[batch])
+    return rows, 2 * row_game + (rows >= games.home_splits[batch][row_game])
+
+# team rating for many teams at once.  slots are player rows, team_seg says which of the n_teams each row belongs to
+@profiled("compute_team_ratings")
+def compute_team_ratings(rating_store, slots, team_seg, n_teams):
+
+    return team_ratings_from_sums(rating_store, *team_rating_sums(rating_store, slots, team_seg, n_teams))
+
+# per team sums over its rated players: mins, mins * mu, (mins * sigma)^2
+def team_rating_sums(rating_store, slots, team_seg, n_teams):
+
+    # only players we've rated count, weighted by their average mins so far
+    rated = rating_store.games[slots] > 0
+    slots, team_seg = slots[rated], team_seg[rated]
+    player_mins = rating_store.mean_minutes(slots)
+    team_mins = np.bincount(team_seg, player_mins, minlength=n_teams)
+    weighted_mu = np.bincount(team_seg, player_mins * rating_store.mu[slots], minlength=n_teams)
+    weighted_var = np.bincount(team_seg, (player_mins * rating_store.sigma[slots]) ** 2, minlength=n_teams)
+    return team_mins, weighted_mu, weighted_var
+
+def team_ratings_from_sums(rating_store, team_mins, weighted_mu, weighted_var):
+
+    # if our total average mins for everyone on the roster is below 240 (total person-min for a game), add a "default" player
+    # with a default rating and the remaining mins
+    # this accounts for a roster where we only know about low-mins players, or don't have data on anyone
+    default_mins = np.maximum(240 - team_mins, 0)
 
-def compute_team_rating(ratings_dict, team):
+    # normalize mins (weights)
+    team_mean = (weighted_mu + default_mins * rating_store.default_mu) / 240
+    team_var = (weighted_var + (default_mins * rating_store.default_sigma) ** 2) / 240 ** 2
+    return team_mean, team_var
+
+# Memoized single team ratings off one store, keyed by roster (the set of player ids).  Each entry keeps its players'
+# mins, mins * mu and (mins * sigma)^2 terms + the sums of them, and the store version of every player when it was
+# last looked at.  generate_ts_ratings bumps a player's version whenever it updates them, so a lookup only touches
+# the players who've played since: their old terms come out of the sums and their new ones go in, the rest of the
+# roster isn't read again
+#   - a new entry (or one where the whole roster changed, or after max_deltas delta updates so float error can't
+#     pile up) is a full recompute, summed like compute_team_ratings.  Otherwise it's within float rounding of that
+#     (~1e-15 relative)
+#   - least recently used rosters are dropped past max_rosters, so traded/finished rosters don't stick around
+#   - players with no slot yet get looked up again each time, they can start playing later
+class TeamRatingCache:
+    def __init__(self, rating_store, max_rosters=256, max_deltas=64):
+        self.rating_store = rating_store
+        self.max_rosters = max_rosters
+        self.max_deltas = max_deltas
+        self.entries = OrderedDict()
+        self.hits = self.delta_updates = self.misses = self.evictions = 0
+
+    def __repr__(self):
+        return (f"TeamRatingCache(Rosters: {len(self.entries)}, Hits: {self.hits}, Delta updates: {self.delta_updates}, "
+                f"Misses: {self.misses}, Evictions: {self.evictions})")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def team_rating(self, team):
+        return self.roster_rating([player.player_id for player in team.players])
+
+    def roster_rating(self, player_ids):
+        key = frozenset(player_ids)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            entry = self.entries[key] = self._new_entry(player_ids)
+            if len(self.entries) > self.max_rosters:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.entries.move_to_end(key)
+            self._refresh(entry)
+
+        return team_ratings_from_sums(self.rating_store, *entry["sums"])
+
+    # players stay in the order first asked for, so a new entry sums up exactly like compute_team_rating always has.
+    # slots/versions/terms are only for players the store knows, the rest wait in missing
+    def _new_entry(self, player_ids):
+        index = self.rating_store.index
+        player_ids = list(dict.fromkeys(player_ids))
+        entry = {
+            "slots": np.array([index[player_id] for player_id in player_ids if player_id in index], dtype=np.int64),
+            "missing": [player_id for player_id in player_ids if player_id not in index],
+        }
+        self._recompute(entry)
+        return entry
+
+    # full recompute of an entry's terms + sums (summed the same way compute_team_ratings does)
+    def _recompute(self, entry):
+        rating_store, slots = self.rating_store, entry["slots"]
+        entry["versions"] = rating_store.versions[slots]
+        entry["terms"] = self._player_terms(slots)
+        entry["sums"] = tuple(sums[0] for sums in team_rating_sums(rating_store, slots, np.zeros(len(slots), dtype=np.int64), 1))
+        entry["deltas"] = 0
+
+    # mins, mins * mu, (mins * sigma)^2 per player, 0 for players who haven't played yet
+    def _player_terms(self, slots):
+        rating_store = self.rating_store
+        rated = rating_store.games[slots] > 0
+        terms = np.zeros((3, len(slots)))
+        rated_slots = slots[rated]
+        player_mins = rating_store.mean_minutes(rated_slots)
+        terms[0, rated] = player_mins
+        terms[1, rated] = player_mins * rating_store.mu[rated_slots]
+        terms[2, rated] = (player_mins * rating_store.sigma[rated_slots]) ** 2
+        return terms
+
+    def _refresh(self, entry):
+        rating_store = self.rating_store
+
+        # players who weren't in the store last time might be now- they join with version -1 so they count as changed
+        if entry["missing"]:
+            found = [player_id for player_id in entry["missing"] if player_id in rating_store.index]
+            if found:
+                entry["missing"] = [player_id for player_id in entry["missing"] if player_id not in rating_store.index]
+                entry["slots"] = np.concatenate([entry["slots"], [rating_store.index[player_id] for player_id in found]])
+                entry["versions"] = np.concatenate([entry["versions"], np.full(len(found), -1)])
+                entry["terms"] = np.concatenate([entry["terms"], np.zeros((3, len(found)))], axis=1)
+
+        slots = entry["slots"]
+        versions = rating_store.versions[slots]
+        changed = np.flatnonzero(versions != entry["versions"])
+        if len(changed) == 0:
+            self.hits += 1
+            return
+
+        if len(changed) == len(slots) or entry["deltas"] >= self.max_deltas:
+            self.misses += 1
+            self._recompute(entry)
+            return
+
+        # swap the changed players' old terms for their new ones
+        self.delta_updates += 1
+        new_terms = self._player_terms(slots[changed])
+        delta = new_terms.sum(axis=1) - entry["terms"][:, changed].sum(axis=1)
+        entry["sums"] = tuple(total + d for total, d in zip(entry["sums"], delta))
+        entry["terms"][:, changed] = new_terms
+        entry["versions"][changed] = versions[changed]
+        entry["deltas"] += 1
+
+@profiled("compute_team_rating")
+def compute_team_rating(rating_store, team):
     
     # default here handled below
     # # if no players, return default rating
@@ -72,106 +320,196 @@ def compute_team_rating(ratings_dict, team):
     #     rating_default = Rating()
     #     return rating_default.mu, rating_default.sigma ** 2
     
-    # otherwise...
-    team_ratings = []
-    team_mins = []
-    for player in team.players:
-        if player.player_id in ratings_dict:
-            team_ratings.append(ratings_dict[player.player_id][0])
-            team_mins.append(average(ratings_dict[player.player_id][1]))
-
-    # if our total average mins for everyone on the roster is below 240 (total person-min for a game), add a "default" player to our list with
-    # a default rating and the remaining mins
-    # this accounts for a roster where we only know about low-mins players, or don't have data on anyone
-    if sum(team_mins) < 240:
-        default_player = Rating()
-        team_ratings.append(default_player)
-        team_mins.append(240 - sum(team_mins))
+    # otherwise... same as the batched version, just one team, memoized per roster on the store
+    if rating_store.team_cache is None:
+        rating_store.team_cache = TeamRatingCache(rating_store)
+    return rating_store.team_cache.team_rating(team)
+
+def generate_rs_ratings(games_list, roster_list, rating_store=None):
+    rating_store = generate_ts_ratings(games_list, rating_store)
+    return generate_roster_ratings(rating_store, roster_list)
+
+# team ratings for a list of rosters off a finished store, every roster in one vectorized pass
+def generate_roster_ratings(rating_store, roster_list):
+    roster_slots = [rating_store.rated_slots([player.player_id for player in team.players]) for team in roster_list]
+    slots = np.concatenate(roster_slots) if roster_slots else np.zeros(0, dtype=np.int64)
+    team_seg = np.repeat(np.arange(len(roster_list)), [len(team_slots) for team_slots in roster_slots])
+    means, variances = compute_team_ratings(rating_store, slots, team_seg, len(roster_list))
+
+    team_ratings_recorder = SnapshotRecorder(TEAM_RATING_COLUMNS, len(roster_list))
+    team_ratings_recorder.extend(len(roster_list), team_name=[team.team_name for team in roster_list], rating_mean=means, rating_var=variances)
+
+    return team_ratings_recorder.to_frame()
+
+
+# checkpoint_path: optional rating_checkpoint file.  Seasons are independent, so finished seasons before the checkpoint
+# are reused as is, the checkpointed season picks up from its saved store with only the games after the tag, and
+# anything later is rated from scratch
+# stream_chunk_rows: stream the games off the db in fetchmany chunks of that many rows (see stream_game_blocks) instead
+# of reading the whole range up front- memory stays flat however many seasons are rated
+# glicko2_period_days: also rate every season with Glicko-2 (rating periods of that many days) in the same replay and
+# add the teams' glicko_mean/glicko_var.  Checkpoints only hold the TrueSkill store, so it can't go with checkpoint_path
+def generate_rs_rating_period(season_range, checkpoint_path=None, stream_chunk_rows=None, glicko2_period_days=None):
+    start_season, end_season = season_range
+    checkpoint_key = {"stage": "rs_ratings"}
+    if glicko2_period_days and checkpoint_path:
+        raise ValueError("rating checkpoints only hold the TrueSkill store, can't checkpoint with glicko2_period_days")
+
+    rs_ratings_recorder = SnapshotRecorder({**RS_RATING_COLUMNS, **RS_GLICKO2_RATING_COLUMNS} if glicko2_period_days else RS_RATING_COLUMNS)
+    first_season, resume_store, tag = start_season, None, None
+
+    checkpoint = load_rating_checkpoint(checkpoint_path, checkpoint_key)
+    if checkpoint:
+        checkpoint_store, checkpoint_tag, checkpoint_tables = checkpoint
+        cached_df = checkpoint_tables["rs_ratings"]
+        cached_seasons = set(cached_df["season_start_year"].astype(int))
+        if (start_season <= checkpoint_tag["season_start_year"] <= end_season
+                and all(season_year in cached_seasons for season_year in range(start_season, checkpoint_tag["season_start_year"]))
+                and count_games_through("Regular Season", checkpoint_tag["season_start_year"], checkpoint_tag) == checkpoint_tag["games_in_db"]):
+            print("Resuming regular season ratings from checkpoint at game", checkpoint_tag["game_id"], checkpoint_tag["game_date"])
+            first_season, resume_store, tag = checkpoint_tag["season_start_year"], checkpoint_store, checkpoint_tag
+            rs_ratings_recorder.extend_frame(cached_df[cached_df["season_start_year"].astype(int).between(start_season, first_season - 1)])
+
+    # Get the games and rosters for every season at once- or stream the games in blocks and get each season's
+    # rosters when we get to it
+    after = None if tag is None else (tag["game_date"], tag["game_id"])
+    if stream_chunk_rows:
+        print("Streaming regular season games for: ", first_season, "-", end_season)
+        season_blocks = prefetch_game_blocks(regular_season_games_query((first_season, end_season), after), stream_chunk_rows)
+        season_rosters = None
+    else:
+        print("Getting regular season games and rosters for: ", first_season, "-", end_season, "... ", end="", flush=True)
+        season_blocks = get_regular_season_game_arrays_range((first_season, end_season), after=after).items()
+        season_rosters = get_season_end_rosters_range((first_season, end_season))
+        print("Done")
 
-    # normalize mins (weights)
-    team_mins = [x / 240 for x in team_mins]
-    return weighted_team_rating(team_ratings, team_mins)
-
-def generate_rs_ratings(games_list, roster_list):
-    ratings_dict = generate_ts_ratings(games_list)
-
-    team_ratings_df = pd.DataFrame(columns=["team_name", "rating_mean", "rating_var"])
-    for team in roster_list:
-        mean, var = compute_team_rating(ratings_dict, team)
-        team_ratings_df.loc[len(team_ratings_df)] = {
-            "team_name": team.team_name,
-            "rating_mean": mean,
-            "rating_var": var
-        }
+    for season_year, games_blocks in blocks_by_season(season_blocks, range(first_season, end_season + 1)):
+        with profile_stage("rs_ratings", season_year):
 
-    return team_ratings_df
+            print("Calculating regular season ratings for: ", season_year, "... ", end="", flush=True)
 
+            # Generate ratings for the current season- fresh store, unless it's the season we're resuming
+            rating_store = resume_store if tag is not None and season_year == tag["season_start_year"] else RatingStore()
 
-def generate_rs_rating_period(season_range):
-    start_season, end_season = season_range
+            # Glicko-2 rates a whole rating period at once, so a block can't end inside one- it gets the whole season
+            glicko2_store = None
+            if glicko2_period_days:
+                games_blocks = [GameArrays.concat(list(games_blocks))]
+                glicko2_store = Glicko2Store(period_days=glicko2_period_days)
 
-    rs_ratings_period_df = pd.DataFrame(columns=["season_start_year", "team_name", "rating_mean", "rating_var"])
-    for season_year in range(start_season, end_season + 1):
+            for games_block in games_blocks:
+                if glicko2_store is not None:
+                    rating_store, glicko2_store = generate_ts_glicko2_ratings(games_block, rating_store, glicko2_store)
+                else:
+                    rating_store = generate_ts_ratings(games_block, rating_store)
 
-        print("Calculating regular season ratings for: ", season_year, "... ", end="", flush=True)
+                # keep the latest season with games around for the checkpoint
+                if len(games_block):
+                    resume_store, tag = rating_store, last_game_tag(games_block)
 
-        # Get the games and rosters for the current season
-        games_list = get_regular_season_games(season_year)
-        roster_list = get_season_end_rosters(season_year)
+            # the rosters for the current season
+            roster_list = season_rosters[season_year] if season_rosters is not None else get_season_end_rosters(season_year)
+            ratings_df = generate_roster_ratings(rating_store, roster_list)
+            if glicko2_store is not None:
+                glicko2_df = generate_roster_ratings(glicko2_store, roster_list)
+                ratings_df["glicko_mean"], ratings_df["glicko_var"] = glicko2_df["rating_mean"].to_numpy(), glicko2_df["rating_var"].to_numpy()
 
-        # Generate ratings for the current season
-        ratings_df = generate_rs_ratings(games_list, roster_list)
+            # add to the period table
+            rs_ratings_recorder.extend_frame(ratings_df, season_start_year=season_year)
 
-        # add to the period dataframe
-        for i, row in ratings_df.iterrows():
-            rs_ratings_period_df.loc[len(rs_ratings_period_df)] = {
-                "season_start_year": season_year,
-                "team_name": row["team_name"],
-                "rating_mean": row["rating_mean"],
-                "rating_var": row["rating_var"]
-            }
+            print("Done")
 
-        print("Done")
+    rs_ratings_period_df = rs_ratings_recorder.to_frame()
+    if checkpoint_path and tag is not None:
+        tag["games_in_db"] = count_games_through("Regular Season", tag["season_start_year"], tag)
+        save_rating_checkpoint(checkpoint_path, checkpoint_key, tag, resume_store, {"rs_ratings": rs_ratings_period_df})
 
     return rs_ratings_period_df
 
-def generate_po_pregame_ratings(season_range, prefix_seasons_size):
+# checkpoint_path: optional rating_checkpoint file.  The playoff chain is sequential, so a checkpoint holds the store
+# after the last rated game + every pregame snapshot so far, and a resumed run only rates the games after it
+# glicko2_period_days: also run a Glicko-2 chain (rating periods of that many days) in the same replay and add its
+# *_po_glicko columns.  Checkpoints + resume_store only hold the TrueSkill chain, so it can't go with either
+# resume_store: a store that already holds the chain up to (not including) season_range[0]- the prefix is skipped and
+# rating continues from it (the stage cache keeps one per cached season).  It gets updated in place
+# stream_chunk_rows: stream the games in blocks (see generate_rs_rating_period)- a long prefix never sits in memory
+def generate_po_pregame_ratings(season_range, prefix_seasons_size, checkpoint_path=None, glicko2_period_days=None, resume_store=None, stream_chunk_rows=None):
     start_season, end_season = season_range
-
-    prefix_po_games = []
-    for season_year in range(start_season - prefix_seasons_size, start_season):
-        print("Getting prefix playoff games for: ", season_year, "... ", end="", flush=True)
-        prefix_po_games = prefix_po_games + get_playoff_games(season_year)
+    checkpoint_key = {"stage": "po_pregame_ratings", "start_season": start_season, "prefix_seasons_size": prefix_seasons_size}
+
+    glicko2_store = None
+    if glicko2_period_days:
+        if checkpoint_path:
+            raise ValueError("rating checkpoints only hold the TrueSkill chain, can't checkpoint with glicko2_period_days")
+        glicko2_store = Glicko2Store(period_days=glicko2_period_days)
+
+    po_ratings_recorder = SnapshotRecorder({**PO_PREGAME_RATING_COLUMNS, **PO_GLICKO2_RATING_COLUMNS} if glicko2_store is not None else PO_PREGAME_RATING_COLUMNS)
+    first_season, prefix_rating_store, tag = start_season - prefix_seasons_size, RatingStore(), None
+
+    if resume_store is not None:
+        if glicko2_store is not None:
+            raise ValueError("resume_store only holds the TrueSkill chain, can't resume with glicko2_period_days")
+        first_season, prefix_rating_store, checkpoint_path = start_season, resume_store, None
+
+    checkpoint = load_rating_checkpoint(checkpoint_path, checkpoint_key)
+    if checkpoint:
+        checkpoint_store, checkpoint_tag, checkpoint_tables = checkpoint
+        if (checkpoint_tag["season_start_year"] <= end_season
+                and count_games_through("Playoffs", start_season - prefix_seasons_size, checkpoint_tag) == checkpoint_tag["games_in_db"]):
+            print("Resuming playoff ratings from checkpoint at game", checkpoint_tag["game_id"], checkpoint_tag["game_date"])
+            first_season, prefix_rating_store, tag = checkpoint_tag["season_start_year"], checkpoint_store, checkpoint_tag
+            po_ratings_recorder.extend_frame(checkpoint_tables["po_ratings"])
+
+    # prefix + rated seasons in one go (or just what's after the checkpoint)- or streamed in blocks
+    after = None if tag is None else (tag["game_date"], tag["game_id"])
+    if stream_chunk_rows:
+        print("Streaming playoff games for: ", first_season, "-", end_season)
+        season_blocks = prefetch_game_blocks(playoff_games_query((first_season, end_season), after), stream_chunk_rows)
+    else:
+        print("Getting playoff games for: ", first_season, "-", end_season, "... ", end="", flush=True)
+        season_blocks = get_playoff_game_arrays_range((first_season, end_season), after=after).items()
         print("Done")
 
-    print("Generating prefix ratings for playoff games...", end="", flush=True)
-    prefix_ratings_dict = generate_ts_ratings(prefix_po_games)
-    print("Done")
-
-    po_ratings_df = pd.DataFrame(columns=["season_start_year", "game_id", "team_a_name", "team_b_name", "team_a_po_rating", "team_a_po_rating_var", "team_b_po_rating", "team_b_po_rating_var"]) 
-    for season_year in range(start_season, end_season + 1):
-        
-        print("Getting prefix ratings for: ", season_year, "... ", end="", flush=True)
-        
-        # Get the games and rosters for the current season
-        games_list = get_playoff_games(season_year)
-
-        # Generate ratings for the current season
-        pregame_ratings_df, prefix_ratings_dict = generate_ts_ratings_pregame(games_list, prefix_ratings_dict)
-
-        # add to the period dataframe'
-        for i, row in pregame_ratings_df.iterrows():
-            po_ratings_df.loc[len(po_ratings_df)] = {
-                "season_start_year": season_year,
-                "game_id": row["game_id"],
-                "team_a_name": row["team_a_name"],
-                "team_b_name": row["team_b_name"],
-                "team_a_po_rating": row["team_a_po_rating"],
-                "team_a_po_rating_var": row["team_a_po_rating_var"],
-                "team_b_po_rating": row["team_b_po_rating"],
-                "team_b_po_rating_var": row["team_b_po_rating_var"]
-            }
-
-        print("Done")
+    for season_year, games_blocks in blocks_by_season(season_blocks, range(first_season, end_season + 1)):
+        with profile_stage("po_pregame_ratings", season_year):
+
+            # Glicko-2 rates a whole rating period at once, so a block can't end inside one- that chain gets whole seasons
+            if glicko2_store is not None:
+                games_blocks = [GameArrays.concat(list(games_blocks))]
+
+            # prefix seasons only move the stores along
+            if season_year < start_season:
+                print("Generating prefix ratings for: ", season_year, "... ", end="", flush=True)
+                for games_block in games_blocks:
+                    if glicko2_store is not None:
+                        prefix_rating_store, glicko2_store = generate_ts_glicko2_ratings(games_block, prefix_rating_store, glicko2_store)
+                    else:
+                        prefix_rating_store = generate_ts_ratings(games_block, prefix_rating_store)
+                    if len(games_block):
+                        tag = last_game_tag(games_block)
+                print("Done")
+                continue
+
+            print("Getting prefix ratings for: ", season_year, "... ", end="", flush=True)
+
+            for games_block in games_blocks:
+
+                # Generate ratings for the current season
+                if glicko2_store is not None:
+                    pregame_ratings_df, prefix_rating_store, glicko2_store = generate_ts_glicko2_ratings_pregame(games_block, prefix_rating_store, glicko2_store)
+                else:
+                    pregame_ratings_df, prefix_rating_store = generate_ts_ratings_pregame(games_block, prefix_rating_store)
+                if len(games_block):
+                    tag = last_game_tag(games_block)
+
+                # add to the period table
+                po_ratings_recorder.extend_frame(pregame_ratings_df, season_start_year=season_year)
+
+            print("Done")
+
+    po_ratings_df = po_ratings_recorder.to_frame()
+    if checkpoint_path and tag is not None:
+        tag["games_in_db"] = count_games_through("Playoffs", start_season - prefix_seasons_size, tag)
+        save_rating_checkpoint(checkpoint_path, checkpoint_key, tag, prefix_rating_store, {"po_ratings": po_ratings_df})
 
     return po_ratings_df
@@ -0,0 +1,66 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from rating_store import RatingStore
+
+# On-disk checkpoint of the rating pipeline: player rating state + the snapshot tables built so far, tagged with the
+# last game that was rated.  One compressed .npz per stage, no pickles.
+#
+# key: the stage parameters the state depends on (a checkpoint for a different prefix/start season is useless)
+# tag: {"season_start_year", "game_date", "game_id", "games_in_db"}- the last game rated + how many games of that
+#      type the db had up to it, so a rebuilt/changed db doesn't silently resume from the wrong place
+
+CHECKPOINT_VERSION = 1
+
+def save_rating_checkpoint(path, key, tag, rating_store, tables):
+    arrays = {"store__" + name: arr for name, arr in rating_store.state_arrays().items()}
+    for table_name, df in tables.items():
+        for column in df.columns:
+            values = df[column].to_numpy()
+            # strings as fixed width unicode, keeps the file pickle free
+            if values.dtype == object:
+                values = values.astype(str)
+            arrays[f"table__{table_name}__{column}"] = values
+
+    meta = {
+        "version": CHECKPOINT_VERSION,
+        "key": key,
+        "tag": tag,
+        "tables": {table_name: list(df.columns) for table_name, df in tables.items()},
+    }
+    arrays["meta"] = np.array(json.dumps(meta))
+
+    # write + rename so a crashed run never leaves a half written checkpoint behind
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+# returns (rating_store, tag, tables) or None if there's no usable checkpoint for this key
+def load_rating_checkpoint(path, key):
+    if not path or not os.path.exists(path):
+        return None
+
+    with np.load(path, allow_pickle=False) as checkpoint:
+        meta = json.loads(str(checkpoint["meta"]))
+        if meta["version"] != CHECKPOINT_VERSION or meta["key"] != key:
+            return None
+
+        rating_store = RatingStore.from_state_arrays({
+            name: checkpoint["store__" + name] for name in ["player_ids", "mu", "sigma", "minutes_sum", "games"]
+        })
+        tables = {
+            table_name: pd.DataFrame({column: checkpoint[f"table__{table_name}__{column}"] for column in columns}, columns=columns)
+            for table_name, columns in meta["tables"].items()
+        }
+
+    return rating_store, meta["tag"], tables
+
+# tag for the last game of a GameArrays block (with season_start_years set, i.e. from a range query)
+def last_game_tag(games):
+    return {
+        "season_start_year": int(games.season_start_years[-1]),
+        "game_date": str(games.date_strings[-1]),
+        "game_id": int(games.game_ids[-1]),
+    }
@@ -0,0 +1,138 @@
+import numpy as np
+from trueskill import Rating
+from ts_ratings import env
+
+# Compact player rating state: player_id -> slot index, plus contiguous arrays indexed by slot.
+# Replaces the old player_id -> (Rating, [minutes...]) dictionary- minutes history is kept as a running sum + count,
+# so per-game cost and memory don't grow with career length
+class RatingStore:
+    # rating of a player we know nothing about (also the default player in compute_team_ratings)
+    default_mu = env.mu
+    default_sigma = env.sigma
+
+    def __init__(self, capacity=1024):
+        self.index = dict()
+        self.size = 0
+        for name, (dtype, fill) in self.slot_arrays().items():
+            setattr(self, name, np.full(capacity, fill, dtype=dtype))
+        # memoized team ratings off this store (see TeamRatingCache in rate_games), made on first use
+        self.team_cache = None
+
+    # per slot arrays: name -> (dtype, value a new slot starts at)
+    def slot_arrays(self):
+        return {
+            "player_ids": (np.int64, 0),
+            "mu": (np.float64, self.default_mu),
+            "sigma": (np.float64, self.default_sigma),
+            "minutes_sum": (np.float64, 0),
+            "games": (np.int64, 0),
+            # bumped every time a player's rating/minutes change, so cached team ratings know who is stale
+            "versions": (np.int64, 0),
+        }
+
+    def __len__(self):
+        return self.size
+
+    # a player only counts as rated once they've actually played a game
+    def __contains__(self, player_id):
+        slot = self.index.get(player_id)
+        return slot is not None and self.games[slot] > 0
+
+    def __repr__(self):
+        return f"RatingStore(Players: {self.size}, Rated: {int(np.count_nonzero(self.games[:self.size]))})"
+
+    # amortized doubling growth, new slots start at the default rating
+    def _grow(self, min_capacity):
+        capacity = len(self.mu)
+        if min_capacity <= capacity:
+            return
+        new_capacity = max(min_capacity, 2 * capacity)
+
+        for name, (dtype, fill) in self.slot_arrays().items():
+            new_arr = np.full(new_capacity, fill, dtype=dtype)
+            new_arr[:capacity] = getattr(self, name)
+            setattr(self, name, new_arr)
+
+    # get or create slots for a list of player ids
+    def slots_for(self, player_ids):
+        slots = np.empty(len(player_ids), dtype=np.int64)
+        new_ids = []
+        for i, player_id in enumerate(player_ids):
+            slot = self.index.get(player_id)
+            if slot is None:
+                slot = self.size + len(new_ids)
+                self.index[player_id] = slot
+                new_ids.append(player_id)
+            slots[i] = slot
+
+        if new_ids:
+            self._grow(self.size + len(new_ids))
+            self.player_ids[self.size:self.size + len(new_ids)] = new_ids
+            self.size += len(new_ids)
+        return slots
+
+    # slots of already rated players only (no slot creation), used for team snapshots
+    def rated_slots(self, player_ids):
+        slots = np.array([self.index.get(player_id, -1) for player_id in player_ids], dtype=np.int64)
+        slots = slots[slots >= 0]
+        return slots[self.games[slots] > 0]
+
+    def mean_minutes(self, slots):
+        return self.minutes_sum[slots] / self.games[slots]
+
+    # add one game of minutes to each player's running totals
+    def record_minutes(self, slots, minutes):
+        np.add.at(self.minutes_sum, slots, minutes)
+        np.add.at(self.games, slots, 1)
+
+    def bump_versions(self, slots):
+        np.add.at(self.versions, slots, 1)
+
+    # plain arrays of the used slots, for checkpoints (see rating_checkpoint.py)
+    def state_arrays(self):
+        return {name: getattr(self, name)[:self.size].copy() for name in self.slot_arrays()}
+
+    @classmethod
+    def from_state_arrays(cls, arrays):
+        size = len(arrays["player_ids"])
+        rating_store = cls(max(size, 1024))
+        # arrays saved before a slot array existed keep its start value
+        for name in rating_store.slot_arrays():
+            if name in arrays:
+                getattr(rating_store, name)[:size] = arrays[name]
+        rating_store.size = size
+        rating_store.index = {player_id: slot for slot, player_id in enumerate(arrays["player_ids"].tolist())}
+        return rating_store
+
+    def rating(self, player_id):
+        slot = self.index[player_id]
+        return Rating(self.mu[slot], self.sigma[slot])
+
+
+# Glicko-2 state in the same layout (see glicko2.py), so it goes through generate_ts_ratings/compute_team_ratings the
+# same way.  mu/sigma hold the rating + rating deviation on the usual 1500 scale, plus each player's volatility and
+# the last rating period they played in (idle periods widen the deviation when they play again)
+class Glicko2Store(RatingStore):
+    default_mu = 1500.
+    default_sigma = 350.
+    default_volatility = 0.06
+
+    # period_days: length of a rating period, 1 = every game day is a period
+    def __init__(self, capacity=1024, period_days=1):
+        super().__init__(capacity)
+        self.period_days = period_days
+
+    def __repr__(self):
+        return f"Glicko2Store(Players: {self.size}, Rated: {int(np.count_nonzero(self.games[:self.size]))})"
+
+    def slot_arrays(self):
+        return {
+            **super().slot_arrays(),
+            "volatility": (np.float64, self.default_volatility),
+            "last_period": (np.int64, -1),
+        }
+
+    # (rating, rating deviation, volatility)
+    def rating(self, player_id):
+        slot = self.index[player_id]
+        return self.mu[slot], self.sigma[slot], self.volatility[slot]
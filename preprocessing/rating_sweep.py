@@ -0,0 +1,195 @@
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+from ts_ratings import env, schedule_batches, config_bincount, batch_weighted_update_configs, _cdf
+from rating_store import RatingStore
+from db_extract import GameArrays, get_playoff_game_arrays_range
+from rate_games import PO_PREGAME_RATING_COLUMNS, batch_team_rows
+from snapshot_recorder import SnapshotRecorder
+
+# One-pass replay of the playoff rating chain for K TrueSkill configs at once, for tuning the rating parameters
+# without re-running extract_features per setting.  Every per player array gets a leading config dimension, the games
+# are read + scheduled once, and each batch is rated for all configs in one vectorized update.
+#
+# Per config: beta, tau, prefix_seasons_size (configs with a shorter prefix skip the games before their own start),
+# minutes_power (weights are minutes ** minutes_power- 1 is the normal minute weighting, 0 weights everyone equally)
+# and fill_minutes (the default player fill in compute_team_ratings, 240 normally- None drops the default player
+# and averages over the known players only).
+# The default config reproduces generate_po_pregame_ratings.
+
+class RatingConfig:
+    def __init__(self, beta=env.beta, tau=env.tau, prefix_seasons_size=5, minutes_power=1.0, fill_minutes=240):
+        self.beta = beta
+        self.tau = tau
+        self.prefix_seasons_size = prefix_seasons_size
+        self.minutes_power = minutes_power
+        self.fill_minutes = fill_minutes
+
+    def __repr__(self):
+        return (f"RatingConfig(beta={self.beta}, tau={self.tau}, prefix={self.prefix_seasons_size}, "
+                f"minutes_power={self.minutes_power}, fill_minutes={self.fill_minutes})")
+
+    def as_dict(self):
+        return {"beta": self.beta, "tau": self.tau, "prefix_seasons_size": self.prefix_seasons_size,
+                "minutes_power": self.minutes_power, "fill_minutes": self.fill_minutes}
+
+# every combination of the given parameter lists, e.g. config_grid(beta=[2, 4, 6], tau=[0.05, 0.1])
+def config_grid(**param_lists):
+    names = list(param_lists)
+    return [RatingConfig(**dict(zip(names, values))) for values in itertools.product(*(param_lists[name] for name in names))]
+
+# pregame team ratings for every config.  slots/team_seg as in compute_team_ratings, the rest are (K, n_slots) state
+# arrays + the per config params.  returns (K, n_teams) means + variances
+def compute_team_ratings_configs(minutes_sum, games_played, mu, sigma, slots, team_seg, n_teams, minutes_power, fill_minutes):
+    rated = games_played[:, slots] > 0
+    player_mins = np.where(rated, minutes_sum[:, slots] / np.where(rated, games_played[:, slots], 1), 0)
+    team_mins = config_bincount(team_seg, player_mins, n_teams)
+
+    # reweight by minutes ** power, scaled back up to the team's minutes so the fill stays in minutes
+    player_weights = player_mins ** minutes_power[:, None]
+    team_weights = config_bincount(team_seg, player_weights, n_teams)
+    scale = np.divide(team_mins, team_weights, out=np.zeros_like(team_mins), where=team_weights > 0)
+    player_weights = np.where(rated, player_weights * scale[:, team_seg], 0)
+
+    # same default player fill as compute_team_ratings, up to fill_minutes.  No fill (0): plain weighted average
+    fill = fill_minutes[:, None]
+    default_mins = np.where(fill > 0, np.maximum(fill - team_mins, 0), 0)
+    total_mins = np.where(fill > 0, fill, team_mins)
+
+    team_mean = config_bincount(team_seg, player_weights * mu[:, slots], n_teams) + default_mins * env.mu
+    team_var = config_bincount(team_seg, (player_weights * sigma[:, slots]) ** 2, n_teams) + (default_mins * env.sigma) ** 2
+
+    # nobody known and no fill- default rating
+    known = total_mins > 0
+    safe_total = np.where(known, total_mins, 1)
+    team_mean = np.where(known, team_mean / safe_total, env.mu)
+    team_var = np.where(known, team_var / safe_total ** 2, env.sigma ** 2)
+    return team_mean, team_var
+
+# replays a chronological GameArrays block for all configs.  start_game[k] is the first game config k rates,
+# pregame team ratings are recorded for the games from snapshot_from on.
+# returns (home mean, home var, away mean, away var), each (K, n_games) and only filled from snapshot_from on
+def replay_configs(games, configs, start_game, snapshot_from=0):
+    n_configs, n_games = len(configs), len(games)
+    beta = np.array([config.beta for config in configs], dtype=np.float64)
+    tau = np.array([config.tau for config in configs], dtype=np.float64)
+    minutes_power = np.array([config.minutes_power for config in configs], dtype=np.float64)
+    fill_minutes = np.array([config.fill_minutes or 0 for config in configs], dtype=np.float64)
+
+    # the store only maps player ids to slots here, the rating state itself is per config
+    slots = RatingStore().slots_for(games.players)[games.player_index]
+    n_slots = len(games.players)
+    mu = np.full((n_configs, n_slots), env.mu)
+    sigma = np.full((n_configs, n_slots), env.sigma)
+    minutes_sum = np.zeros((n_configs, n_slots))
+    games_played = np.zeros((n_configs, n_slots), dtype=np.int64)
+
+    home_mean, home_var = np.zeros((n_configs, n_games)), np.zeros((n_configs, n_games))
+    away_mean, away_var = np.zeros((n_configs, n_games)), np.zeros((n_configs, n_games))
+    game_numbers = np.arange(n_games)
+
+    for batch in schedule_batches(slots, games.game_offsets, n_slots):
+        rows, team_seg = batch_team_rows(games, batch)
+
+        snapshot = batch[batch >= snapshot_from]
+        if len(snapshot):
+            snapshot_rows, snapshot_seg = batch_team_rows(games, snapshot)
+            team_mean, team_var = compute_team_ratings_configs(minutes_sum, games_played, mu, sigma, slots[snapshot_rows], snapshot_seg,
+                                                               2 * len(snapshot), minutes_power, fill_minutes)
+            home_mean[:, snapshot], away_mean[:, snapshot] = team_mean[:, 0::2], team_mean[:, 1::2]
+            home_var[:, snapshot], away_var[:, snapshot] = team_var[:, 0::2], team_var[:, 1::2]
+
+        active = game_numbers[batch][None, :] >= start_game[:, None]
+        batch_weighted_update_configs(mu, sigma, slots, games.minutes, games.game_offsets, games.home_splits, games.home_win,
+                                      batch, beta, tau, minutes_power, active)
+
+        # minutes history only counts from each config's own start
+        config_index, batch_rows = np.nonzero(active[:, team_seg // 2])
+        flat_slots = config_index * n_slots + slots[rows][batch_rows]
+        np.add.at(minutes_sum.reshape(-1), flat_slots, games.minutes[rows][batch_rows])
+        np.add.at(games_played.reshape(-1), flat_slots, 1)
+
+    return home_mean, home_var, away_mean, away_var
+
+# predicted home win probability from pregame team ratings, same performance model as the update
+def home_win_probability(home_mean, home_var, away_mean, away_var, beta):
+    return _cdf((home_mean - away_mean) / np.sqrt(2 * beta[:, None] ** 2 + home_var + away_var))
+
+# the playoff chain (see generate_po_pregame_ratings) for every config in one pass.
+# returns (pregame_df, summary_df): pregame_df is the po_pregame_ratings table for every config with a config_id column,
+# summary_df has one row per config with its params + the log loss of its home win probability over the rated seasons
+def sweep_po_pregame_ratings(season_range, configs):
+    start_season, end_season = season_range
+    max_prefix = max(config.prefix_seasons_size for config in configs)
+
+    print("Getting playoff games for: ", start_season - max_prefix, "-", end_season, "... ", end="", flush=True)
+    season_games = get_playoff_game_arrays_range((start_season - max_prefix, end_season))
+    games = GameArrays.concat([season_games[season_year] for season_year in sorted(season_games)])
+    print("Done")
+
+    # each config starts at the first game of its own prefix, snapshots (and the log loss) start at start_season
+    season_start_years = games.season_start_years if len(games) else np.zeros(0, dtype=np.int32)
+    start_game = np.searchsorted(season_start_years, [start_season - config.prefix_seasons_size for config in configs]).astype(np.int64)
+    snapshot_from = int(np.searchsorted(season_start_years, start_season))
+
+    print("Replaying", len(games), "playoff games for", len(configs), "rating configs... ", end="", flush=True)
+    home_mean, home_var, away_mean, away_var = replay_configs(games, configs, start_game, snapshot_from)
+    print("Done")
+
+    home_mean, home_var = home_mean[:, snapshot_from:], home_var[:, snapshot_from:]
+    away_mean, away_var = away_mean[:, snapshot_from:], away_var[:, snapshot_from:]
+    rated = games.slice_games(snapshot_from, len(games))
+
+    # log loss of each config's pregame home win probability
+    beta = np.array([config.beta for config in configs], dtype=np.float64)
+    home_win_prob = np.clip(home_win_probability(home_mean, home_var, away_mean, away_var, beta), 1e-15, 1 - 1e-15)
+    home_win = rated.home_win.astype(bool)
+    log_loss = -np.mean(np.where(home_win, np.log(home_win_prob), np.log(1 - home_win_prob)), axis=1) if len(rated) else np.full(len(configs), np.nan)
+
+    # same team a/b layout as generate_ts_ratings_pregame
+    team_a_is_home = rated.home_team_names > rated.away_team_names
+    pregame_recorder = SnapshotRecorder({"config_id": np.int64, **PO_PREGAME_RATING_COLUMNS}, len(configs) * len(rated))
+    for config_index in range(len(configs)):
+        pregame_recorder.extend(
+            len(rated),
+            config_id=config_index,
+            season_start_year=rated.season_start_years,
+            game_id=rated.game_ids,
+            team_a_name=np.where(team_a_is_home, rated.home_team_names, rated.away_team_names),
+            team_b_name=np.where(team_a_is_home, rated.away_team_names, rated.home_team_names),
+            team_a_po_rating=np.where(team_a_is_home, home_mean[config_index], away_mean[config_index]),
+            team_a_po_rating_var=np.where(team_a_is_home, home_var[config_index], away_var[config_index]),
+            team_b_po_rating=np.where(team_a_is_home, away_mean[config_index], home_mean[config_index]),
+            team_b_po_rating_var=np.where(team_a_is_home, away_var[config_index], home_var[config_index])
+        )
+
+    summary_df = pd.DataFrame([{"config_id": config_index, **config.as_dict()} for config_index, config in enumerate(configs)])
+    summary_df["log_loss"] = log_loss
+    summary_df["n_games"] = len(rated)
+
+    return pregame_recorder.to_frame(), summary_df
+
+if __name__ == "__main__":
+    from db_extract import init_db
+
+    def float_list(value):
+        return [float(item) for item in value.split(",")]
+
+    parser = argparse.ArgumentParser(description="Sweep TrueSkill rating configs over the playoff rating chain in one pass.")
+    parser.add_argument("--start", type=int, default=2009, help="First rated season start year.")
+    parser.add_argument("--end", type=int, default=2024, help="Last rated season start year.")
+    parser.add_argument("--beta", type=float_list, default=[env.beta], help="Comma separated beta values.")
+    parser.add_argument("--tau", type=float_list, default=[env.tau], help="Comma separated tau values.")
+    parser.add_argument("--prefix", type=lambda value: [int(item) for item in value.split(",")], default=[5], help="Comma separated playoff rating prefix sizes.")
+    parser.add_argument("--minutes-power", type=float_list, default=[1.0], help="Comma separated minute weighting powers.")
+    parser.add_argument("--fill-minutes", type=float_list, default=[240.0], help="Comma separated default player fill minutes (0 for no fill).")
+    parser.add_argument("--output", default=None, help="Optional csv path for the per config pregame ratings.")
+    args = parser.parse_args()
+
+    init_db()
+    configs = config_grid(beta=args.beta, tau=args.tau, prefix_seasons_size=args.prefix, minutes_power=args.minutes_power, fill_minutes=args.fill_minutes)
+    pregame_df, summary_df = sweep_po_pregame_ratings((args.start, args.end), configs)
+    if args.output:
+        pregame_df.to_csv(args.output, index=False)
+    print(summary_df.sort_values("log_loss").to_string(index=False))
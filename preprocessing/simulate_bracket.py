@@ -0,0 +1,232 @@
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from compiled_model import CompiledModel, load_compiled_model
+
+# Monte-carlo simulator for the playoff bracket (step 13 in notes.md), on top of a trained game model.
+#
+# Every simulated game builds the same feature row the models were trained on (see merge_features.extract_features):
+# team a is the team whose name sorts last, series state (series_game_number, team_a/b_series_wins, series_diff) and
+# team_a_home are tracked per simulation, RS + PO ratings are the teams' current ones and stay fixed for the run.
+# All live simulations of a round are stepped together one game slot at a time, so there's exactly one
+# predict_proba call per (round, game number)- never one per simulation (and only on the distinct feature rows).
+#
+# bracket: team names in bracket order, winners of adjacent pairs meet in the next round
+# seeds: team -> seed, lower seed has home court (2-2-1-1-1), ties go to the better RS rating
+
+# best of 7, the higher seed is home in games 1, 2, 5, 7
+HIGH_SEED_HOME_GAMES = {1, 2, 5, 7}
+WINS_NEEDED = 4
+
+FEATURE_COLUMNS = ["team_a_home", "series_game_number", "team_a_series_wins", "team_b_series_wins", "series_diff", "season_start_year",
+                   "team_a_rs_rating", "team_a_rs_rating_var", "team_b_rs_rating", "team_b_rs_rating_var",
+                   "team_a_po_rating", "team_a_po_rating_var", "team_b_po_rating", "team_b_po_rating_var",
+                   "rs_rating_diff", "po_rating_diff"]
+
+# standard 16 team layout, one conference after the other: 1v8, 4v5, 3v6, 2v7
+DEFAULT_SEED_ORDER = [1, 8, 4, 5, 3, 6, 2, 7] * 2
+
+# a compiled model (.npz, see compiled_model.py) or a joblib saved one.  Compiled tree models score with numpy (fast
+# cold start, small batches), batches of NATIVE_MIN_ROWS+ rows go to the saved xgboost booster when xgboost is installed
+def load_model(model_path):
+    if model_path.endswith(".npz"):
+        return load_compiled_model(model_path)
+    import joblib
+    return joblib.load(model_path)
+
+# win probability for team a, for a batch of feature rows.  Works with anything sklearn-like fit on a DataFrame
+# (boosted_tree.pkl, the logreg pipeline)- only the columns the model was trained on get passed in.
+# Compiled models read the feature arrays directly
+def predict_team_a_win(model, features):
+    if isinstance(model, CompiledModel):
+        return model.predict_proba(features)[:, 1]
+    columns = list(getattr(model, "feature_names_in_", FEATURE_COLUMNS))
+    return model.predict_proba(pd.DataFrame({column: features[column] for column in columns}, columns=columns))[:, 1]
+
+# team level inputs as arrays indexed by bracket position
+class BracketInputs:
+    def __init__(self, bracket, seeds, rs_ratings, po_ratings, season_start_year):
+        self.teams = list(bracket)
+        n_teams = len(self.teams)
+        if n_teams < 2 or n_teams & (n_teams - 1):
+            raise ValueError("Bracket size must be a power of 2")
+
+        self.season_start_year = season_start_year
+        self.seeds = np.array([seeds[team] for team in self.teams], dtype=np.float64)
+        self.rs_rating = np.array([rs_ratings[team][0] for team in self.teams], dtype=np.float64)
+        self.rs_rating_var = np.array([rs_ratings[team][1] for team in self.teams], dtype=np.float64)
+        self.po_rating = np.array([po_ratings[team][0] for team in self.teams], dtype=np.float64)
+        self.po_rating_var = np.array([po_ratings[team][1] for team in self.teams], dtype=np.float64)
+        # team a is the team that sorts last by name, same as the training data
+        self.name_rank = np.argsort(np.argsort(self.teams))
+        # home court priority: lower seed, then better RS rating
+        self.home_priority = np.lexsort((-self.rs_rating, self.seeds)).argsort()
+
+    @property
+    def n_rounds(self):
+        return int(np.log2(len(self.teams)))
+
+# series_wins: optional team -> wins already banked in the current (first simulated) round's series.
+# returns round_wins (n_teams, n_rounds): how many simulations each team won each round in
+def simulate_chunk(inputs, model, n_sims, seed, series_wins=None):
+    rng = np.random.default_rng(seed)
+    n_teams = len(inputs.teams)
+    round_wins = np.zeros((n_teams, inputs.n_rounds), dtype=np.int64)
+    n_win_states = WINS_NEEDED + 1
+    n_keys = n_teams * n_teams * 2 * n_win_states ** 2
+
+    # alive[s, j] = team index in bracket slot j of simulation s
+    alive = np.tile(np.arange(n_teams), (n_sims, 1))
+    start_wins = np.zeros(n_teams, dtype=np.int64)
+    for team, wins in (series_wins or dict()).items():
+        start_wins[inputs.teams.index(team)] = wins
+
+    for round_index in range(inputs.n_rounds):
+        team_1, team_2 = alive[:, 0::2], alive[:, 1::2]
+
+        # higher seed = home court holder in each series
+        team_1_high = inputs.home_priority[team_1] < inputs.home_priority[team_2]
+        high = np.where(team_1_high, team_1, team_2).ravel()
+        low = np.where(team_1_high, team_2, team_1).ravel()
+        high_wins = start_wins[high] if round_index == 0 else np.zeros(len(high), dtype=np.int64)
+        low_wins = start_wins[low] if round_index == 0 else np.zeros(len(low), dtype=np.int64)
+
+        team_a_is_high = inputs.name_rank[high] > inputs.name_rank[low]
+        team_a = np.where(team_a_is_high, high, low)
+        team_b = np.where(team_a_is_high, low, high)
+
+        for game_number in range(1, 2 * WINS_NEEDED):
+            live = np.flatnonzero((high_wins < WINS_NEEDED) & (low_wins < WINS_NEEDED) & (high_wins + low_wins == game_number - 1))
+            if len(live) == 0:
+                continue
+
+            a, b, a_is_high = team_a[live], team_b[live], team_a_is_high[live].astype(np.int64)
+            a_wins = np.where(a_is_high, high_wins[live], low_wins[live])
+            b_wins = np.where(a_is_high, low_wins[live], high_wins[live])
+            high_home = game_number in HIGH_SEED_HOME_GAMES
+
+            # the feature row only depends on (team a, team b, who holds home court, series wins), and there are at
+            # most a few thousand of those across all simulations- score each distinct row once and map back
+            # (dense key space, so a lookup table instead of sorting millions of keys)
+            state_key = ((a * n_teams + b) * 2 + a_is_high) * n_win_states ** 2 + a_wins * n_win_states + b_wins
+            seen = np.zeros(n_keys, dtype=bool)
+            seen[state_key] = True
+            unique_keys = np.flatnonzero(seen)
+            key_to_state = np.zeros(n_keys, dtype=np.int64)
+            key_to_state[unique_keys] = np.arange(len(unique_keys))
+            state_inverse = key_to_state[state_key]
+
+            a_wins, b_wins = unique_keys // n_win_states % n_win_states, unique_keys % n_win_states
+            a_is_high = (unique_keys // n_win_states ** 2 % 2).astype(bool)
+            a, b = unique_keys // (2 * n_win_states ** 2) // n_teams, unique_keys // (2 * n_win_states ** 2) % n_teams
+            n_states = len(unique_keys)
+
+            features = {
+                "team_a_home": (a_is_high == high_home).astype(np.int64),
+                "series_game_number": np.full(n_states, float(game_number)),
+                "team_a_series_wins": a_wins,
+                "team_b_series_wins": b_wins,
+                "series_diff": a_wins - b_wins,
+                "season_start_year": np.full(n_states, inputs.season_start_year, dtype=np.int64),
+                "team_a_rs_rating": inputs.rs_rating[a],
+                "team_a_rs_rating_var": inputs.rs_rating_var[a],
+                "team_b_rs_rating": inputs.rs_rating[b],
+                "team_b_rs_rating_var": inputs.rs_rating_var[b],
+                "team_a_po_rating": inputs.po_rating[a],
+                "team_a_po_rating_var": inputs.po_rating_var[a],
+                "team_b_po_rating": inputs.po_rating[b],
+                "team_b_po_rating_var": inputs.po_rating_var[b],
+                "rs_rating_diff": inputs.rs_rating[a] - inputs.rs_rating[b],
+                "po_rating_diff": inputs.po_rating[a] - inputs.po_rating[b],
+            }
+            team_a_win = rng.random(len(live)) < predict_team_a_win(model, features)[state_inverse]
+            high_win = team_a_win == team_a_is_high[live]
+            high_wins[live] += high_win
+            low_wins[live] += ~high_win
+
+        winners = np.where(high_wins >= WINS_NEEDED, high, low)
+        np.add.at(round_wins[:, round_index], winners, 1)
+        alive = winners.reshape(n_sims, -1)
+
+    return round_wins
+
+# worker entry point- loads its own copy of the model so only the path crosses the process boundary
+def _simulate_chunk_worker(args):
+    inputs, model_path, n_sims, seed, series_wins = args
+    return simulate_chunk(inputs, load_model(model_path), n_sims, seed, series_wins)
+
+# runs n_sims simulations in chunks of chunk_size.  Every chunk gets its own child seed of `seed`, so the result only
+# depends on (seed, n_sims, chunk_size)- not on n_workers.  n_workers > 1 needs model_path (workers load the model)
+def simulate_bracket(bracket, seeds, rs_ratings, po_ratings, season_start_year, model=None, model_path=None,
+                     n_sims=100000, chunk_size=100000, n_workers=1, seed=0, series_wins=None):
+    inputs = BracketInputs(bracket, seeds, rs_ratings, po_ratings, season_start_year)
+    chunk_sizes = [min(chunk_size, n_sims - start) for start in range(0, n_sims, chunk_size)]
+    chunk_seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+
+    if n_workers > 1:
+        if model_path is None:
+            raise ValueError("model_path is required with n_workers > 1")
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            chunk_results = list(executor.map(_simulate_chunk_worker, [(inputs, model_path, size, chunk_seed, series_wins) for size, chunk_seed in zip(chunk_sizes, chunk_seeds)]))
+    else:
+        if model is None:
+            model = load_model(model_path)
+        chunk_results = [simulate_chunk(inputs, model, size, chunk_seed, series_wins) for size, chunk_seed in zip(chunk_sizes, chunk_seeds)]
+
+    round_wins = np.sum(chunk_results, axis=0)
+    results_df = pd.DataFrame({"team_name": inputs.teams, "seed": inputs.seeds.astype(np.int64)})
+    for round_index in range(inputs.n_rounds):
+        results_df[f"round_{round_index + 1}_win_prob"] = round_wins[:, round_index] / n_sims
+    results_df["finals_prob"] = round_wins[:, -2] / n_sims if inputs.n_rounds > 1 else 1.0
+    results_df["champion_prob"] = round_wins[:, -1] / n_sims
+    return results_df.sort_values("champion_prob", ascending=False).reset_index(drop=True)
+
+# current rating state for a season: (RS ratings for the season, the playoff rating chain's store- the
+# po_pregame_ratings checkpoint, which is brought up to date first- and the season end rosters)
+def load_rating_state(season_start_year, po_start_season=2009, playoff_rating_prefix=5, checkpoint_dir="output/checkpoints/"):
+    from db_extract import get_season_end_rosters
+    from rate_games import generate_rs_rating_period, generate_po_pregame_ratings
+    from rating_checkpoint import load_rating_checkpoint
+
+    rs_ratings_df = generate_rs_rating_period((season_start_year, season_start_year))
+    rs_ratings = {row.team_name: (row.rating_mean, row.rating_var) for row in rs_ratings_df.itertuples()}
+
+    checkpoint_path = checkpoint_dir + "po_pregame_ratings.npz"
+    generate_po_pregame_ratings((po_start_season, season_start_year), playoff_rating_prefix, checkpoint_path=checkpoint_path)
+    po_rating_store, _, _ = load_rating_checkpoint(checkpoint_path, {"stage": "po_pregame_ratings", "start_season": po_start_season, "prefix_seasons_size": playoff_rating_prefix})
+
+    return rs_ratings, po_rating_store, get_season_end_rosters(season_start_year)
+
+# current team ratings for a season: RS ratings for the season + PO ratings off the playoff rating chain applied to
+# the season end rosters
+def load_team_ratings(season_start_year, po_start_season=2009, playoff_rating_prefix=5, checkpoint_dir="output/checkpoints/"):
+    from rate_games import compute_team_rating
+
+    rs_ratings, po_rating_store, rosters = load_rating_state(season_start_year, po_start_season, playoff_rating_prefix, checkpoint_dir)
+    po_ratings = {team.team_name: compute_team_rating(po_rating_store, team) for team in rosters}
+
+    return rs_ratings, po_ratings
+
+if __name__ == "__main__":
+    from db_extract import init_db
+
+    parser = argparse.ArgumentParser(description="Monte-carlo playoff bracket simulation.")
+    parser.add_argument("--season", type=int, required=True, help="Season start year of the playoffs to simulate.")
+    parser.add_argument("--bracket", required=True, help="Comma separated team names in bracket order.")
+    parser.add_argument("--seeds", default=None, help="Comma separated seeds matching --bracket (default: standard 16 team layout).")
+    parser.add_argument("--model", default="output/boosted_tree.pkl", help="Saved model to simulate games with (.pkl, or a compiled .npz).")
+    parser.add_argument("--sims", type=int, default=1000000, help="Number of simulated playoff runs.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+
+    bracket = [team.strip() for team in args.bracket.split(",")]
+    seed_list = [int(seed) for seed in args.seeds.split(",")] if args.seeds else DEFAULT_SEED_ORDER
+    seeds = dict(zip(bracket, seed_list))
+
+    init_db()
+    rs_ratings, po_ratings = load_team_ratings(args.season)
+    results_df = simulate_bracket(bracket, seeds, rs_ratings, po_ratings, args.season, model_path=args.model,
+                                  n_sims=args.sims, n_workers=args.workers, seed=args.seed)
+    print(results_df.to_string(index=False))
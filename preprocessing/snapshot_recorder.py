@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+# Collects rating snapshot rows into preallocated typed column buffers and builds one DataFrame at the end.
+# Replaces growing DataFrames a row at a time with df.loc[len(df)] = {...}, which reallocates on every append.
+# columns: column name -> numpy dtype (object for strings), in output order
+class SnapshotRecorder:
+    def __init__(self, columns, capacity=1024):
+        self.columns = dict(columns)
+        self.size = 0
+        self.buffers = {name: np.empty(capacity, dtype=dtype) for name, dtype in self.columns.items()}
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"SnapshotRecorder(Columns: {len(self.columns)}, Rows: {self.size})"
+
+    # amortized doubling growth
+    def _reserve(self, extra_rows):
+        capacity = len(next(iter(self.buffers.values())))
+        if self.size + extra_rows <= capacity:
+            return
+        new_capacity = max(self.size + extra_rows, 2 * capacity)
+        for name, buffer in self.buffers.items():
+            new_buffer = np.empty(new_capacity, dtype=buffer.dtype)
+            new_buffer[:self.size] = buffer[:self.size]
+            self.buffers[name] = new_buffer
+
+    # one row, every column given as a keyword
+    def append(self, **row):
+        self._reserve(1)
+        for name, buffer in self.buffers.items():
+            buffer[self.size] = row[name]
+        self.size += 1
+
+    # many rows at once- each column an array (or a scalar broadcast over all of them)
+    def extend(self, n_rows, **columns):
+        if n_rows == 0:
+            return
+        self._reserve(n_rows)
+        for name, buffer in self.buffers.items():
+            buffer[self.size:self.size + n_rows] = columns[name]
+        self.size += n_rows
+
+    # rows of a DataFrame with (at least) our columns, plus scalar overrides for the columns it doesn't have
+    def extend_frame(self, df, **constants):
+        self.extend(len(df), **{name: constants[name] if name in constants else df[name].to_numpy() for name in self.columns})
+
+    def to_frame(self):
+        return pd.DataFrame({name: buffer[:self.size] for name, buffer in self.buffers.items()}, columns=list(self.columns))
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from rating_store import RatingStore
+
+# On-disk cache of extract_features stage results, one entry per (stage, season).  An entry's key is a hash of
+#   - the stage parameters (start season + prefix for the playoff chain)
+#   - the db content it was built from: season_fingerprints of every season it reads (see db_extract)
+#   - the code version: a hash of every preprocessing module the stages import (plus this one, it owns the entry
+#     format), so a code change never serves stale numbers
+# A wider season range only computes the new seasons, and a db refresh that only touched the latest season only
+# recomputes that season (plus, for the playoff chain, the seasons after it).
+# Entries are .npz files (no pickles), named <season>-<params hash>-<key hash>.npz under cache_dir/<stage>/- writing
+# an entry drops the older ones for the same season + params, and evict() trims the rest by age and total size.
+
+STAGE_CACHE_VERSION = 1
+CODE_VERSION_MODULES = ["db_extract.py", "ts_ratings.py", "rating_store.py", "rate_games.py", "glicko2.py", "merge_features.py", "snapshot_recorder.py",
+                        "rating_checkpoint.py", "profiling.py", "stage_cache.py"]
+
+def code_version():
+    digest = hashlib.sha256()
+    for module in CODE_VERSION_MODULES:
+        digest.update((Path(__file__).parent / module).read_bytes())
+    return digest.hexdigest()[:16]
+
+def _hash(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+class StageCache:
+    def __init__(self, cache_dir, max_bytes=512 * 1024 ** 2, max_age_days=30):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.code_version = code_version()
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"StageCache({self.cache_dir}, Hits: {self.hits}, Misses: {self.misses})"
+
+    # key for one season of a stage.  fingerprint: json-able summary of the db content the season was built from
+    def key(self, stage, params, season_year, fingerprint):
+        params_hash = _hash({"stage": stage, "params": params})
+        key_hash = _hash({"version": STAGE_CACHE_VERSION, "code": self.code_version, "season": season_year, "params": params, "db": fingerprint})
+        return f"{season_year}-{params_hash}-{key_hash}"
+
+    def _path(self, stage, key):
+        return self.cache_dir / stage / (key + ".npz")
+
+    # (df, rating_store or None) for a key, or None on a miss.  A hit refreshes the entry's age
+    def load(self, stage, key):
+        path = self._path(stage, key)
+        if not path.exists():
+            self.misses += 1
+            return None
+
+        with np.load(path, allow_pickle=False) as entry:
+            meta = json.loads(str(entry["meta"]))
+            df = pd.DataFrame({column: entry["frame__" + column] for column in meta["columns"]}, columns=meta["columns"])
+            rating_store = None
+            if meta["has_store"]:
+                rating_store = RatingStore.from_state_arrays({name: entry["store__" + name] for name in meta["store_arrays"]})
+        os.utime(path)
+        self.hits += 1
+        return df, rating_store
+
+    def save(self, stage, key, df, rating_store=None):
+        arrays = dict()
+        for column in df.columns:
+            values = df[column].to_numpy()
+            # strings as fixed width unicode, keeps the file pickle free
+            if values.dtype.kind not in "biuf":
+                values = values.astype(str)
+            arrays["frame__" + column] = values
+        store_arrays = rating_store.state_arrays() if rating_store is not None else dict()
+        arrays.update({"store__" + name: arr for name, arr in store_arrays.items()})
+        arrays["meta"] = np.array(json.dumps({"columns": list(df.columns), "has_store": rating_store is not None, "store_arrays": list(store_arrays)}))
+
+        # write + rename, then drop the entries this one replaces (same season + params, older db/code)
+        path = self._path(stage, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp.npz")
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        season_params = key.rsplit("-", 1)[0]
+        for old_path in path.parent.glob(season_params + "-*.npz"):
+            if old_path != path:
+                old_path.unlink()
+
+    # drop entries not used for max_age_days, then the least recently used ones until we're under max_bytes
+    def evict(self):
+        entries = [(path.stat().st_mtime, path.stat().st_size, path) for path in self.cache_dir.glob("*/*.npz")]
+        cutoff = time.time() - self.max_age_days * 24 * 60 * 60
+        total_bytes, evicted = 0, 0
+        for mtime, size, path in sorted(entries, reverse=True):
+            if mtime < cutoff or total_bytes + size > self.max_bytes:
+                path.unlink()
+                evicted += 1
+            else:
+                total_bytes += size
+        return evicted
+
+# per season frames out of a stage result covering several seasons
+def split_by_season(df, season_years):
+    return {season_year: df[df["season_start_year"] == season_year].reset_index(drop=True) for season_year in season_years}
+
+# contiguous runs of season years, e.g. [2004, 2005, 2009] -> [(2004, 2005), (2009, 2009)]
+def season_runs(season_years):
+    runs = []
+    for season_year in sorted(season_years):
+        if runs and runs[-1][1] == season_year - 1:
+            runs[-1] = (runs[-1][0], season_year)
+        else:
+            runs.append((season_year, season_year))
+    return runs
+
+# one independent-season stage through the cache: compute_range((start, end)) -> df with a season_start_year column,
+# called once per run of missing seasons.  returns the df for the whole range, in season order
+def cached_season_stage(cache, stage, params, season_range, fingerprints, compute_range):
+    start_season, end_season = season_range
+    keys = {season_year: cache.key(stage, params, season_year, fingerprints[season_year]) for season_year in range(start_season, end_season + 1)}
+
+    season_dfs = dict()
+    for season_year, key in keys.items():
+        entry = cache.load(stage, key)
+        if entry is not None:
+            season_dfs[season_year] = entry[0]
+
+    missing = [season_year for season_year in keys if season_year not in season_dfs]
+    for run in season_runs(missing):
+        computed = split_by_season(compute_range(run), range(run[0], run[1] + 1))
+        for season_year, season_df in computed.items():
+            cache.save(stage, keys[season_year], season_df)
+            season_dfs[season_year] = season_df
+
+    return pd.concat([season_dfs[season_year] for season_year in keys], ignore_index=True)
+
+# the playoff chain through the cache.  Season Y depends on every playoff season from the prefix start up to Y, so its
+# key covers all of them, and each entry also keeps the rating store after Y so the chain can pick up from the last
+# valid season instead of replaying the prefix.  compute_season(season_year, resume_store) -> (df, rating_store),
+# resume_store None means start the chain (prefix) from scratch
+def cached_chain_stage(cache, stage, params, season_range, fingerprints, chain_start, compute_season):
+    start_season, end_season = season_range
+    keys = dict()
+    for season_year in range(start_season, end_season + 1):
+        keys[season_year] = cache.key(stage, params, season_year, [fingerprints[year] for year in range(chain_start, season_year + 1)])
+
+    season_dfs, resume_store = dict(), None
+    for season_year, key in keys.items():
+        entry = cache.load(stage, key)
+        if entry is None:
+            break
+        season_dfs[season_year], resume_store = entry
+
+    # everything after the first miss gets rated again, continuing from the last cached store
+    for season_year in range(start_season + len(season_dfs), end_season + 1):
+        season_df, resume_store = compute_season(season_year, resume_store)
+        cache.save(stage, keys[season_year], season_df, resume_store)
+        season_dfs[season_year] = season_df
+
+    return pd.concat([season_dfs[season_year] for season_year in keys], ignore_index=True)
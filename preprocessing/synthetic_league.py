@@ -0,0 +1,249 @@
+import argparse
+import sqlite3
+from pathlib import Path
+import numpy as np
+from db_extract import prepare_db
+
+# Seeded synthetic league in the kaggle db layout (games + PlayerStatistics), for benchmarks and for running the
+# pipeline without the download.  Same seed + seasons -> the same db, row for row.
+# Per season:
+#   - offseason: players age, develop/decline, old ones retire and get replaced by rookies, some players change teams
+#   - regular season: 30 teams, 82 games each (1230 games), Oct - Apr, a few trades at the deadline
+#   - playoffs: top 8 per conference by wins, best of 7 series (2-2-1-1-1), ~85 games, Apr - Jun
+# Every game has a row per rostered player: ~10 play and split the 240 (+ overtime) minutes, the rest are DNPs
+# (0 minutes) or inactive (NULL minutes).  The winner is drawn from the minute weighted skill of who played + home
+# court, so ratings have something real to find.
+
+TEAMS = [
+    ("Atlanta", "Hawks"), ("Boston", "Celtics"), ("Brooklyn", "Nets"), ("Charlotte", "Hornets"), ("Chicago", "Bulls"),
+    ("Cleveland", "Cavaliers"), ("Detroit", "Pistons"), ("Indiana", "Pacers"), ("Miami", "Heat"), ("Milwaukee", "Bucks"),
+    ("New York", "Knicks"), ("Orlando", "Magic"), ("Philadelphia", "76ers"), ("Toronto", "Raptors"), ("Washington", "Wizards"),
+    ("Dallas", "Mavericks"), ("Denver", "Nuggets"), ("Golden State", "Warriors"), ("Houston", "Rockets"), ("LA", "Clippers"),
+    ("Los Angeles", "Lakers"), ("Memphis", "Grizzlies"), ("Minnesota", "Timberwolves"), ("New Orleans", "Pelicans"),
+    ("Oklahoma City", "Thunder"), ("Phoenix", "Suns"), ("Portland", "Trail Blazers"), ("Sacramento", "Kings"),
+    ("San Antonio", "Spurs"), ("Utah", "Jazz"),
+]
+FIRST_TEAM_ID = 1610612737
+CONFERENCE_SIZE = 15 # first 15 teams east, rest west
+
+FIRST_NAMES = ["James", "Michael", "Chris", "Anthony", "Kevin", "Marcus", "Tyler", "Jalen", "Jaylen", "Devin", "Brandon", "Kyle",
+               "Derrick", "Andre", "Luka", "Nikola", "Giannis", "Stephen", "Trae", "Donovan", "Jamal", "Darius", "Isaiah", "Aaron"]
+LAST_NAMES = ["Johnson", "Williams", "Brown", "Jones", "Davis", "Miller", "Wilson", "Moore", "Taylor", "Thomas", "Jackson", "White",
+              "Harris", "Martin", "Thompson", "Robinson", "Walker", "Young", "Allen", "King", "Wright", "Green", "Hill", "Adams"]
+
+ROSTER_SIZE = 15
+ROTATION_SIZE = 10
+RS_ROUNDS = 82 # every round pairs up all 30 teams, so 82 games per team
+RS_DAYS = 170
+PLAYOFF_SEEDS = 8
+SERIES_ORDER = [0, 7, 3, 4, 2, 5, 1, 6] # bracket order of the seeds, 1v8 4v5 3v6 2v7
+HOME_GAMES = np.array([True, True, False, False, True, False, True]) # higher seed at home, 2-2-1-1-1
+
+GAMES_COLUMNS = ["gameId", "gameDate", "hometeamCity", "hometeamName", "hometeamId", "awayteamCity", "awayteamName", "awayteamId",
+                 "homeScore", "awayScore", "winner", "gameType", "seriesGameNumber"]
+PLAYER_STATISTICS_COLUMNS = ["firstName", "lastName", "personId", "gameId", "gameDate", "playerteamCity", "playerteamName",
+                             "opponentteamCity", "opponentteamName", "gameType", "win", "home", "numMinutes"]
+
+# league state carried from season to season: every player ever (skill, age, name) + who is on which roster
+class SyntheticLeague:
+    def __init__(self, seed=0, n_teams=len(TEAMS)):
+        self.rng = np.random.default_rng(seed)
+        self.n_teams = n_teams
+        self.skill = np.zeros(0)
+        self.age = np.zeros(0, dtype=np.int64)
+        self.first_names = np.zeros(0, dtype=object)
+        self.last_names = np.zeros(0, dtype=object)
+        self.next_game_id = 1
+        self.rosters = self.new_players(n_teams * ROSTER_SIZE, rng_age=(20, 34)).reshape(n_teams, ROSTER_SIZE)
+
+    def __repr__(self):
+        return f"SyntheticLeague(Teams: {self.n_teams}, Players: {len(self.skill)})"
+
+    # person ids are 1000 + index into the player arrays
+    def new_players(self, n, rng_age=(19, 23)):
+        start = len(self.skill)
+        self.skill = np.append(self.skill, self.rng.normal(-0.3 if rng_age[0] < 20 else 0, 1, n))
+        self.age = np.append(self.age, self.rng.integers(rng_age[0], rng_age[1], n))
+        self.first_names = np.append(self.first_names, self.rng.choice(np.array(FIRST_NAMES, dtype=object), n))
+        self.last_names = np.append(self.last_names, self.rng.choice(np.array(LAST_NAMES, dtype=object), n))
+        return np.arange(start, start + n)
+
+    # n random roster spot swaps between different teams
+    def swap_players(self, n):
+        for _ in range(n):
+            team_a, team_b = self.rng.choice(self.n_teams, 2, replace=False)
+            slot_a, slot_b = self.rng.integers(ROSTER_SIZE, size=2)
+            self.rosters[team_a, slot_a], self.rosters[team_b, slot_b] = self.rosters[team_b, slot_b], self.rosters[team_a, slot_a]
+
+    def offseason(self):
+        self.age += 1
+        # young players improve, old ones decline
+        self.skill += self.rng.normal(np.clip((27 - self.age) * 0.06, -0.4, 0.3), 0.25)
+        retiring = (self.age[self.rosters] >= 38) | (self.rng.random(self.rosters.shape) < np.clip((self.age[self.rosters] - 30) * 0.06, 0.03, 0.9))
+        self.rosters[retiring] = self.new_players(int(retiring.sum()))
+        self.swap_players(3 * self.n_teams)
+
+    # minute rows for a block of games: home/away team indices -> (player index, minutes) per team slot, shape
+    # (games, 2, ROSTER_SIZE).  Minutes go to the ROTATION_SIZE best available players (skill + game noise),
+    # injured players get NaN (inactive), the rest of the bench 0
+    def play_minutes(self, home_teams, away_teams):
+        players = self.rosters[np.stack([home_teams, away_teams], axis=1)]
+        n_games = len(home_teams)
+        preference = self.skill[players] + self.rng.normal(0, 0.5, players.shape)
+        injured = self.rng.random(players.shape) < 0.07
+        preference[injured] = -np.inf
+        rank = np.argsort(np.argsort(-preference, axis=2), axis=2)
+        playing = (rank < ROTATION_SIZE) & ~injured
+
+        weights = np.where(playing, np.exp(0.35 * preference.clip(-5, 5)) * self.rng.uniform(0.6, 1.4, players.shape), 0)
+        overtimes = self.rng.binomial(3, 0.02, n_games)
+        minutes = weights / weights.sum(axis=2, keepdims=True) * (240 + 25 * overtimes)[:, None, None]
+        minutes = np.round(minutes, 2)
+        minutes[injured] = np.nan
+        return players, minutes
+
+    # winners + scores from who played: home court + minute weighted skill difference
+    def play_results(self, players, minutes):
+        weighted = np.nan_to_num(minutes) * self.skill[players]
+        strength = weighted.sum(axis=2) / np.nan_to_num(minutes).sum(axis=2)
+        home_win_probability = 1 / (1 + np.exp(-(0.3 + 2.5 * (strength[:, 0] - strength[:, 1]))))
+        home_win = self.rng.random(len(players)) < home_win_probability
+
+        winner_score = self.rng.normal(112, 11, len(players)).round().astype(np.int64)
+        margin = 1 + self.rng.geometric(0.09, len(players))
+        home_score = np.where(home_win, winner_score, winner_score - margin)
+        away_score = np.where(home_win, winner_score - margin, winner_score)
+        return home_win, home_score, away_score
+
+    # games + PlayerStatistics rows for a block of games.  played: (players, minutes, home_win, home_score, away_score)
+    # if the games have been played already, otherwise they get played here
+    def game_rows(self, game_dates, home_teams, away_teams, game_type, series_game_numbers=None, played=None):
+        if played is None:
+            players, minutes = self.play_minutes(home_teams, away_teams)
+            played = (players, minutes, *self.play_results(players, minutes))
+        players, minutes, home_win, home_score, away_score = played
+        game_ids = np.arange(self.next_game_id, self.next_game_id + len(home_teams))
+        self.next_game_id += len(home_teams)
+        if series_game_numbers is None:
+            series_game_numbers = [None] * len(home_teams)
+
+        games_rows, player_rows = [], []
+        for i, (game_id, game_date, home_team, away_team) in enumerate(zip(game_ids.tolist(), game_dates, home_teams.tolist(), away_teams.tolist())):
+            home_city, home_name = TEAMS[home_team]
+            away_city, away_name = TEAMS[away_team]
+            winner_id = FIRST_TEAM_ID + (home_team if home_win[i] else away_team)
+            games_rows.append((game_id, game_date, home_city, home_name, FIRST_TEAM_ID + home_team, away_city, away_name, FIRST_TEAM_ID + away_team,
+                               int(home_score[i]), int(away_score[i]), winner_id, game_type, series_game_numbers[i]))
+
+            for side, (city, name, opponent_city, opponent_name) in enumerate([(home_city, home_name, away_city, away_name), (away_city, away_name, home_city, home_name)]):
+                win = int(home_win[i]) if side == 0 else 1 - int(home_win[i])
+                for player, player_minutes in zip(players[i, side].tolist(), minutes[i, side].tolist()):
+                    player_rows.append((self.first_names[player], self.last_names[player], 1000 + player, game_id, game_date, city, name,
+                                        opponent_city, opponent_name, game_type, win, 1 - side, None if player_minutes != player_minutes else player_minutes))
+        return games_rows, player_rows, home_win
+
+    # RS_ROUNDS rounds of random pairings spread over the season, trades at the deadline (~60% in)
+    def regular_season(self, season_start_year):
+        season_start = np.datetime64(f"{season_start_year}-10-22T19:00:00")
+        rounds = []
+        for round_index in range(RS_ROUNDS):
+            order = self.rng.permutation(self.n_teams)
+            day = (round_index * RS_DAYS) // RS_ROUNDS + np.arange(self.n_teams // 2) % 2
+            tip_off = self.rng.choice([0, 30, 60, 90, 120, 210], self.n_teams // 2)
+            rounds.append((season_start + day.astype("timedelta64[D]") + tip_off.astype("timedelta64[m]"), order[0::2], order[1::2]))
+
+        deadline = int(RS_ROUNDS * 0.6)
+        games_rows, player_rows, wins = [], [], np.zeros(self.n_teams, dtype=np.int64)
+        for phase in [rounds[:deadline], rounds[deadline:]]:
+            dates = np.concatenate([dates for dates, _, _ in phase])
+            home_teams = np.concatenate([home for _, home, _ in phase])
+            away_teams = np.concatenate([away for _, _, away in phase])
+            order = np.argsort(dates, kind="stable")
+            phase_games, phase_players, home_win = self.game_rows(date_strings(dates[order]), home_teams[order], away_teams[order], "Regular Season")
+            games_rows += phase_games
+            player_rows += phase_players
+            np.add.at(wins, home_teams[order][home_win], 1)
+            np.add.at(wins, away_teams[order][~home_win], 1)
+            self.swap_players(4)
+
+        return games_rows, player_rows, wins
+
+    # both conferences' brackets, a round at a time: every series is played as 7 games and cut off once someone has
+    # 4 wins.  The two conference winners meet in the finals
+    def playoffs(self, season_start_year, wins):
+        standings = np.lexsort((self.rng.random(self.n_teams), -wins))
+        brackets = []
+        for conference in [np.arange(self.n_teams) < CONFERENCE_SIZE, np.arange(self.n_teams) >= CONFERENCE_SIZE]:
+            seeds = standings[conference[standings]][:PLAYOFF_SEEDS]
+            brackets.append([(seed, int(seeds[seed])) for seed in SERIES_ORDER])
+
+        round_start = np.datetime64(f"{season_start_year + 1}-04-19T20:00:00")
+        games_rows, player_rows = [], []
+        while len(brackets[0]) > 1 or len(brackets) > 1:
+            if len(brackets[0]) == 1:
+                brackets = [brackets[0] + brackets[1]]
+            next_brackets = []
+            for bracket in brackets:
+                winners = []
+                for (seed_a, team_a), (seed_b, team_b) in zip(bracket[0::2], bracket[1::2]):
+                    (high_seed, high), (low_seed, low) = sorted([(seed_a, team_a), (seed_b, team_b)], key=lambda seed_team: (seed_team[0], -wins[seed_team[1]]))
+                    home_teams = np.where(HOME_GAMES, high, low)
+                    away_teams = np.where(HOME_GAMES, low, high)
+                    dates = round_start + (2 * np.arange(7) + len(winners) % 2).astype("timedelta64[D]")
+
+                    # play all 7, then only keep the games up to the clinching one
+                    players, minutes = self.play_minutes(home_teams, away_teams)
+                    played = (players, minutes, *self.play_results(players, minutes))
+                    high_wins = played[2] == HOME_GAMES
+                    n_games = int(np.argmax(np.maximum(np.cumsum(high_wins), np.cumsum(~high_wins)) == 4)) + 1
+                    series_games, series_players, _ = self.game_rows(date_strings(dates[:n_games]), home_teams[:n_games], away_teams[:n_games], "Playoffs",
+                                                                     list(range(1, n_games + 1)), [values[:n_games] for values in played])
+                    games_rows += series_games
+                    player_rows += series_players
+                    winners.append((high_seed, high) if np.sum(high_wins[:n_games]) == 4 else (low_seed, low))
+                next_brackets.append(winners)
+            brackets = next_brackets
+            round_start += np.timedelta64(16, "D")
+        return games_rows, player_rows
+
+    def season(self, season_start_year):
+        self.offseason()
+        rs_games, rs_players, wins = self.regular_season(season_start_year)
+        po_games, po_players = self.playoffs(season_start_year, wins)
+        return rs_games + po_games, rs_players + po_players
+
+def date_strings(dates):
+    return [date.replace("T", " ") for date in np.datetime_as_string(dates, unit="s")]
+
+# writes seasons season_range[0] - season_range[1] to a fresh db at db_path, with prepare_db's index layer on top
+def build_synthetic_db(db_path, season_range, seed=0):
+    start_season, end_season = season_range
+    Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+    Path(db_path).unlink(missing_ok=True)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute(f"CREATE TABLE games ({', '.join(GAMES_COLUMNS)})")
+    conn.execute(f"CREATE TABLE PlayerStatistics ({', '.join(PLAYER_STATISTICS_COLUMNS)})")
+
+    league = SyntheticLeague(seed)
+    for season_year in range(start_season, end_season + 1):
+        games_rows, player_rows = league.season(season_year)
+        conn.executemany(f"INSERT INTO games VALUES ({', '.join('?' for _ in GAMES_COLUMNS)})", games_rows)
+        conn.executemany(f"INSERT INTO PlayerStatistics VALUES ({', '.join('?' for _ in PLAYER_STATISTICS_COLUMNS)})", player_rows)
+    conn.commit()
+
+    prepare_db(conn)
+    conn.close()
+    return league
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic league db in the kaggle layout.")
+    parser.add_argument("--db", default="output/synthetic_nba_data.db", help="Where to write the db (replaced if it exists).")
+    parser.add_argument("--start-season", type=int, default=1950, help="First season start year.")
+    parser.add_argument("--end-season", type=int, default=2024, help="Last season start year.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+
+    print("Building synthetic league", args.start_season, "-", args.end_season, "in", args.db, "... ", end="", flush=True)
+    league = build_synthetic_db(args.db, (args.start_season, args.end_season), args.seed)
+    print("done,", league)
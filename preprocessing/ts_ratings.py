@@ -1,5 +1,6 @@
-from trueskill import Rating, rate, setup
+from trueskill import Rating, rate, setup, calc_draw_margin
 import numpy as np
+from profiling import profiled
 
 # Set up TrueSkill environment with draw support
 env = setup(draw_probability=0)  # no draws! doing minute weighted game results
@@ -12,6 +13,7 @@ def weighted_team_rating(players, weights):
 
 # Perform a weighted TrueSkill update with optional draw
 # winner: 1 (team1 wins), 2 (team2 wins), 0 (draw)
+@profiled("weighted_update")
 def weighted_update(team1, team2, weights1, weights2, winner=1):
     w1 = np.array(weights1) / np.sum(weights1)
     w2 = np.array(weights2) / np.sum(weights2)
@@ -43,6 +45,195 @@ def weighted_update(team1, team2, weights1, weights2, winner=1):
 
     return updated_team1, updated_team2
 
+# Closed-form engine for the two-team, no-draw, minute-weighted case below. Each team collapses to a single
+# pseudo-player, so the factor graph in trueskill.rate reduces to the v/w truncated gaussian update and we can
+# do it directly on numpy arrays (one game, or many independent games at once)
+
+# vectorized erfc using the same approximation as the trueskill default backend, so results line up with rate()
+def _erfc(x):
+    z = np.abs(x)
+    t = 1. / (1. + z / 2.)
+    r = t * np.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (
+        0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (
+            0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (
+                -0.82215223 + t * 0.17087277
+            )))
+        )))
+    )))
+    return np.where(x < 0, 2. - r, r)
+
+def _cdf(x):
+    return 0.5 * _erfc(-x / np.sqrt(2))
+
+def _pdf(x):
+    return np.exp(-(x ** 2) / 2) / np.sqrt(2 * np.pi)
+
+# non-draw v/w functions, x is the (winner - loser) performance diff already scaled by c and shifted by the draw margin
+def v_win(x):
+    denom = _cdf(x)
+    safe_denom = np.where(denom > 0, denom, 1.)
+    return np.where(denom > 0, _pdf(x) / safe_denom, -x)
+
+def w_win(x):
+    v = v_win(x)
+    return v * (v + x)
+
+# team level update for arrays of games.  team1_win is a bool array; returns the (mu, sigma) deltas for both
+# pseudo-teams relative to the pregame team rating, same as weighted_update computes from the rate() output.
+# beta/tau default to the env's, arrays broadcast against the team arrays (one value per rating config, see rating_sweep.py)
+def team_rating_deltas(mu1, var1, mu2, var2, team1_win, beta=None, tau=None):
+    beta = env.beta if beta is None else beta
+    tau_sq = (env.tau if tau is None else tau) ** 2
+    draw_margin = calc_draw_margin(env.draw_probability, 2, env)
+
+    # dynamics factor is applied before the game, same as the prior factor in the factor graph
+    prior_var1 = var1 + tau_sq
+    prior_var2 = var2 + tau_sq
+
+    c_sq = 2 * beta ** 2 + prior_var1 + prior_var2
+    c = np.sqrt(c_sq)
+
+    # flip the perspective so the winner is always first
+    sign = np.where(team1_win, 1., -1.)
+    x = sign * (mu1 - mu2) / c - draw_margin / c
+    v = v_win(x)
+    w = w_win(x)
+
+    new_mu1 = mu1 + sign * prior_var1 / c * v
+    new_mu2 = mu2 - sign * prior_var2 / c * v
+    new_sigma1 = np.sqrt(prior_var1 * (1 - prior_var1 / c_sq * w))
+    new_sigma2 = np.sqrt(prior_var2 * (1 - prior_var2 / c_sq * w))
+
+    return new_mu1 - mu1, new_sigma1 - np.sqrt(var1), new_mu2 - mu2, new_sigma2 - np.sqrt(var2)
+
+# drop-in numeric version of weighted_update- takes/returns player mu + sigma arrays instead of Rating lists
+# winner: 1 (team1 wins), 2 (team2 wins). no draws here, we never rate them
+@profiled("closed_form_weighted_update")
+def closed_form_weighted_update(mu1, sigma1, mu2, sigma2, weights1, weights2, winner=1):
+    if winner not in (1, 2):
+        raise ValueError("Winner must be 1 (team1) or 2 (team2)")
+
+    mu1, sigma1 = np.asarray(mu1, dtype=float), np.asarray(sigma1, dtype=float)
+    mu2, sigma2 = np.asarray(mu2, dtype=float), np.asarray(sigma2, dtype=float)
+    w1 = np.asarray(weights1, dtype=float) / np.sum(weights1)
+    w2 = np.asarray(weights2, dtype=float) / np.sum(weights2)
+
+    delta_mu1, delta_sigma1, delta_mu2, delta_sigma2 = team_rating_deltas(
+        w1 @ mu1, (w1 ** 2) @ (sigma1 ** 2), w2 @ mu2, (w2 ** 2) @ (sigma2 ** 2), winner == 1)
+
+    new_mu1 = mu1 + delta_mu1 * w1
+    new_mu2 = mu2 + delta_mu2 * w2
+    new_sigma1 = np.maximum(sigma1 + delta_sigma1 * w1, 0.0001)
+    new_sigma2 = np.maximum(sigma2 + delta_sigma2 * w2, 0.0001)
+
+    return new_mu1, new_sigma1, new_mu2, new_sigma2
+
+# row indices for a set of games, given CSR style offsets (game i owns rows offsets[i]:offsets[i + 1])
+def segment_rows(offsets, games):
+    starts = offsets[games]
+    lengths = offsets[games + 1] - starts
+    if len(lengths) == 0:
+        return np.zeros(0, dtype=np.int64)
+    row_starts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return row_starts + np.arange(lengths.sum())
+
+# batch update for many games that share no players.  mu + sigma are the full per-player arrays and get updated
+# in place.  slots/minutes are the player rows of a CSR game block: game i owns rows game_offsets[i]:game_offsets[i + 1],
+# home players first up to home_splits[i].  games picks which games of the block to rate (default all of them)
+@profiled("batch_weighted_update")
+def batch_weighted_update(mu, sigma, slots, minutes, game_offsets, home_splits, home_win, games=None):
+    if games is None:
+        games = np.arange(len(home_splits))
+    n_games = len(games)
+    if n_games == 0:
+        return
+
+    rows = segment_rows(game_offsets, games)
+    row_game = np.repeat(np.arange(n_games), game_offsets[games + 1] - game_offsets[games])
+
+    # team segments alternate home/away per game: segment 2i is home, 2i + 1 is away
+    team_seg = 2 * row_game + (rows >= home_splits[games][row_game])
+
+    row_slots = slots[rows]
+    row_mins = np.asarray(minutes, dtype=float)[rows]
+    team_mins = np.bincount(team_seg, row_mins, minlength=2 * n_games)
+    w = row_mins / team_mins[team_seg]
+
+    player_mu = mu[row_slots]
+    player_sigma = sigma[row_slots]
+    team_mu = np.bincount(team_seg, w * player_mu, minlength=2 * n_games)
+    team_var = np.bincount(team_seg, (w ** 2) * (player_sigma ** 2), minlength=2 * n_games)
+
+    delta_mu1, delta_sigma1, delta_mu2, delta_sigma2 = team_rating_deltas(
+        team_mu[0::2], team_var[0::2], team_mu[1::2], team_var[1::2], np.asarray(home_win, dtype=bool)[games])
+
+    delta_mu = np.empty(2 * n_games)
+    delta_sigma = np.empty(2 * n_games)
+    delta_mu[0::2], delta_mu[1::2] = delta_mu1, delta_mu2
+    delta_sigma[0::2], delta_sigma[1::2] = delta_sigma1, delta_sigma2
+
+    mu[row_slots] = player_mu + delta_mu[team_seg] * w
+    sigma[row_slots] = np.maximum(player_sigma + delta_sigma[team_seg] * w, 0.0001)
+
+# bincount per rating config: values is (K, n_rows), seg the segment of each row.  returns (K, n_segments)
+def config_bincount(seg, values, n_segments):
+    n_configs = len(values)
+    index = (np.arange(n_configs)[:, None] * n_segments + seg).ravel()
+    return np.bincount(index, values.ravel(), minlength=n_configs * n_segments).reshape(n_configs, n_segments)
+
+# batch_weighted_update for K rating configs side by side (see rating_sweep.py).  mu + sigma are (K, n_slots) and get
+# updated in place, beta/tau/minutes_power are (K,) arrays- update weights are minutes ** minutes_power.
+# active (K, len(games)) says which configs rate which game, the others leave those players alone
+def batch_weighted_update_configs(mu, sigma, slots, minutes, game_offsets, home_splits, home_win, games,
+                                  beta, tau, minutes_power, active):
+    n_games = len(games)
+    if n_games == 0:
+        return
+
+    rows = segment_rows(game_offsets, games)
+    row_game = np.repeat(np.arange(n_games), game_offsets[games + 1] - game_offsets[games])
+    team_seg = 2 * row_game + (rows >= home_splits[games][row_game])
+
+    row_slots = slots[rows]
+    row_mins = np.asarray(minutes, dtype=float)[rows] ** minutes_power[:, None]
+    team_mins = config_bincount(team_seg, row_mins, 2 * n_games)
+    w = row_mins / team_mins[:, team_seg]
+
+    player_mu = mu[:, row_slots]
+    player_sigma = sigma[:, row_slots]
+    team_mu = config_bincount(team_seg, w * player_mu, 2 * n_games)
+    team_var = config_bincount(team_seg, (w ** 2) * (player_sigma ** 2), 2 * n_games)
+
+    delta_mu1, delta_sigma1, delta_mu2, delta_sigma2 = team_rating_deltas(
+        team_mu[:, 0::2], team_var[:, 0::2], team_mu[:, 1::2], team_var[:, 1::2], np.asarray(home_win, dtype=bool)[games],
+        beta[:, None], tau[:, None])
+
+    delta_mu = np.empty(team_mu.shape)
+    delta_sigma = np.empty(team_mu.shape)
+    delta_mu[:, 0::2], delta_mu[:, 1::2] = delta_mu1, delta_mu2
+    delta_sigma[:, 0::2], delta_sigma[:, 1::2] = delta_sigma1, delta_sigma2
+
+    row_active = active[:, row_game]
+    mu[:, row_slots] = np.where(row_active, player_mu + delta_mu[:, team_seg] * w, player_mu)
+    sigma[:, row_slots] = np.where(row_active, np.maximum(player_sigma + delta_sigma[:, team_seg] * w, 0.0001), player_sigma)
+
+# split a chronological game list into batches of games that can be rated together.  a game goes in the batch right
+# after the last batch that touched any of its players, so each batch is player-disjoint and rating the batches in
+# order gives exactly the same result as rating game by game.  returns a list of game index arrays
+def schedule_batches(slots, game_offsets, n_slots):
+    n_games = len(game_offsets) - 1
+    last_batch = np.full(n_slots, -1, dtype=np.int64)
+    game_batch = np.empty(n_games, dtype=np.int64)
+    for i in range(n_games):
+        game_slots = slots[game_offsets[i]:game_offsets[i + 1]]
+        batch = last_batch[game_slots].max() + 1 if len(game_slots) else 0
+        game_batch[i] = batch
+        last_batch[game_slots] = batch
+
+    order = np.argsort(game_batch, kind="stable")
+    splits = np.searchsorted(game_batch[order], np.arange(1, game_batch.max() + 1 if n_games else 0))
+    return np.split(order, splits)
+
 # Example usage
 # if __name__ == '__main__':
 #     team1 = [Rating(), Rating()]